@@ -1,13 +1,62 @@
 import logging
+import threading
+from urllib.parse import urlparse
 
 import requests
+from requests.adapters import HTTPAdapter
 
 log = logging.getLogger(__name__)
 
+# connections kept alive by an API client, by host (the default of requests)
+DEFAULT_POOL_SIZE = 10
+
+# request limiters, by host (see limit_host)
+_host_limiters = {}
+
+
+def limit_host(host, limiter):
+    """ Spaces out the requests of all the API clients to a host (``host[:port]``) with a :class:`RateLimiter`
+    """
+    _host_limiters[host] = limiter
+
+
+class RequestStats:
+    """ Number of requests and of bytes received, by kind of request
+    """
+
+    def __init__(self):
+        self.requests = {}
+        self.bytes = {}
+        self._lock = threading.Lock()
+
+    def record(self, kind, received):
+        with self._lock:
+            self.requests[kind] = self.requests.get(kind, 0) + 1
+            self.bytes[kind] = self.bytes.get(kind, 0) + received
+
+    def summary(self):
+        return ', '.join('{}: {} request(s), {:.1f} KB'.format(kind, self.requests[kind], self.bytes[kind] / 1024)
+                         for kind in sorted(self.requests)) or 'no request'
+
 
 class APIClient:
-    def __init__(self, api_key):
+    def __init__(self, api_key, pool_size=DEFAULT_POOL_SIZE):
+        """
+        :param pool_size: number of connections kept alive, by host, size it to the number of concurrent requests
+        """
         self.api_key = api_key
+        self.stats = RequestStats()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def request_kind(self, url):
+        """ Method to be overloaded by child classes
+
+        :return: the kind of a request, under which it is counted in ``stats``
+        """
+        return 'rest'
 
     def get_auth_headers(self):
         """ Method to be overloaded by child classes
@@ -23,13 +72,24 @@ class APIClient:
         _kwargs['headers'] = headers
         return _kwargs
 
-    def _req(self, func, *args, **kwargs):
+    @staticmethod
+    def _wait_turn(url):
+        limiter = _host_limiters.get(urlparse(url).netloc)
+        if limiter is not None:
+            limiter.wait()
+
+    def _request(self, func, *args, **kwargs):
         log.debug('HTTP REQUEST {} {} {}'.format(
             func, args, kwargs))
         kwargs = self.add_auth_headers(kwargs)
+        self._wait_turn(args[0])
         resp = func(*args, **kwargs)
+        self.stats.record(self.request_kind(args[0]), len(resp.content))
         resp.raise_for_status()
-        ret = resp.json()
+        return resp
+
+    def _req(self, func, *args, **kwargs):
+        ret = self._request(func, *args, **kwargs).json()
         log.debug('HTTP RESPONSE {}'.format(ret))
         return ret
 
@@ -37,26 +97,32 @@ class APIClient:
         log.debug('HTTP REQUEST {} {} {}'.format(
             func, args, kwargs))
         kwargs = self.add_auth_headers(kwargs)
+        self._wait_turn(args[0])
         resp = func(*args, **kwargs)
+        self.stats.record(self.request_kind(args[0]), len(resp.content))
         resp.raise_for_status()
         ret = resp.content
         log.debug('HTTP RESPONSE {}'.format(len(ret)))
         return ret
 
     def get(self, *args, **kwargs):
-        return self._req(requests.get, *args, **kwargs)
+        return self._req(self.session.get, *args, **kwargs)
 
     def post(self, *args, **kwargs):
-        return self._req(requests.post, *args, **kwargs)
+        return self._req(self.session.post, *args, **kwargs)
 
     def put(self, *args, **kwargs):
-        return self._req(requests.put, *args, **kwargs)
+        # redmine answers updates with 204, without content
+        resp = self._request(self.session.put, *args, **kwargs)
+        return resp.json() if resp.content else None
 
     def delete(self, *args, **kwargs):
-        return self._req(requests.delete, *args, **kwargs)
+        # deletions usually answer 204, without content
+        resp = self._request(self.session.delete, *args, **kwargs)
+        return resp.json() if resp.content else None
 
     def load(self, *args, **kwargs):
-        return self._req2(requests.get, *args, **kwargs)
+        return self._req2(self.session.get, *args, **kwargs)
 
 
 class Project:
@@ -0,0 +1,210 @@
+import json
+import logging
+import os
+import tarfile
+import tempfile
+
+from .cache import attachment_data_path, file_digest
+from .converters import attachments_to_markdown, convert_issue, convert_version
+
+""" Offline export of a redmine project as a gitlab project import archive
+"""
+
+log = logging.getLogger(__name__)
+
+# version of the gitlab import/export format (ndjson tree)
+EXPORT_VERSION = '0.2.4'
+LABEL_COLOR = '#428BCA'
+DEVELOPER_ACCESS = 30
+
+TREE_DIR = 'tree'
+PROJECT_DIR = 'tree/project'
+UPLOADS_DIR = 'uploads'
+RELATIONS = ('issues', 'milestones', 'labels', 'project_members')
+
+
+class ProjectArchive:
+    """ A gitlab project import archive, written from the redmine cache without any gitlab request
+
+    The archive holds an ndjson tree (one file per relation, one line per
+    object) and the uploads directory. Issues are read from the cache, one at
+    a time, and converted as by the ``issues`` command; their lines and the
+    attachment files are streamed to disk, so memory use does not depend on
+    the size of the project.
+
+    Issues keep their redmine id as iid. Users are the redmine users, which
+    gitlab matches to its own users by email on import.
+
+    :param redmine: the :class:`RedmineProjectWithCache`
+    :param cache_dir: the redmine cache directory
+    :param notes_group_by: how to merge journal entries into notes, see ``convert_notes``
+    """
+
+    def __init__(self, redmine, cache_dir, notes_group_by=None):
+        self.redmine = redmine
+        self.cache_dir = cache_dir
+        self.notes_group_by = notes_group_by
+        self.counts = {}
+
+    def write(self, path):
+        """ Writes the archive (a .tar.gz) to the given path, replacing it once complete
+
+        :return: dict of the number of objects written, by relation
+        """
+        self.counts = {i: 0 for i in RELATIONS + (UPLOADS_DIR,)}
+        tmp_path = '{}.tmp'.format(path)
+        with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(path))) as tmp_dir, \
+                tarfile.open(tmp_path, 'w:gz') as tar:
+            self._tar = tar
+            self._uploads = set()
+            files = {i: open(os.path.join(tmp_dir, '{}.ndjson'.format(i)), 'w') for i in RELATIONS}
+            try:
+                self._write_tree(files)
+            finally:
+                for i in files.values():
+                    i.close()
+
+            version_path = os.path.join(tmp_dir, 'VERSION')
+            with open(version_path, 'w') as outfile:
+                outfile.write(EXPORT_VERSION)
+            tar.add(version_path, arcname='VERSION')
+            project_path = os.path.join(tmp_dir, 'project.json')
+            with open(project_path, 'w') as outfile:
+                json.dump(self._convert_project(self.redmine.get_project()), outfile)
+            tar.add(project_path, arcname='{}/project.json'.format(TREE_DIR))
+            for i in RELATIONS:
+                tar.add(os.path.join(tmp_dir, '{}.ndjson'.format(i)), arcname='{}/{}.ndjson'.format(PROJECT_DIR, i))
+        os.replace(tmp_path, path)
+        log.info('Archive {} written: {}'.format(path, ', '.join(
+            '{} {}'.format(count, name) for name, count in sorted(self.counts.items()))))
+        return self.counts
+
+    def _write_tree(self, files):
+        users_index = self.redmine.get_users_index()
+        user_ids = {i['login']: i['id'] for i in users_index.values() if i['login']}
+        for user in users_index.values():
+            if user['login']:
+                self._write_line(files, 'project_members', self._convert_member(user))
+
+        # milestones get iids in redmine version order
+        milestones_by_title = {}
+        for iid, redmine_version in enumerate(self.redmine.get_versions(), 1):
+            milestone = self._convert_milestone(iid, redmine_version)
+            milestones_by_title[milestone['title']] = milestone
+            self._write_line(files, 'milestones', milestone)
+        milestones_by_iid = {i['iid']: i for i in milestones_by_title.values()}
+
+        # convert_issue looks milestones and users up by their gitlab id
+        milestones_index = {title: {'id': i['iid']} for title, i in milestones_by_title.items()}
+        gitlab_user_index = {login: {'id': _id} for login, _id in user_ids.items()}
+        attachments_index = self.redmine.get_attachments_index()
+
+        labels = set()
+        for record in self.redmine.get_issue_records():
+            redmine_issue = self.redmine.get_issue(record.id)
+            data, meta = convert_issue(redmine_issue, users_index, attachments_index, None, gitlab_user_index,
+                                       milestones_index, notes_group_by=self.notes_group_by)
+            issue = self._convert_issue(redmine_issue, data, meta, user_ids, milestones_by_iid)
+            labels.update(i['label']['title'] for i in issue['label_links'])
+            self._write_line(files, 'issues', issue)
+
+        for title in sorted(labels):
+            self._write_line(files, 'labels', _label(title))
+
+    def _write_line(self, files, relation, data):
+        files[relation].write(json.dumps(data))
+        files[relation].write('\n')
+        self.counts[relation] += 1
+
+    def _add_upload(self, redmine_attachment):
+        """ Adds the content of an attachment to the uploads, returns None if it is not in the cache
+        """
+        path = attachment_data_path(self.cache_dir, redmine_attachment)
+        if not os.path.exists(path):
+            log.warning('No content for attachment {}, the issue links to redmine'.format(redmine_attachment['id']))
+            return None
+        secret = file_digest(path, 'md5')
+        filename = os.path.basename(redmine_attachment['filename'])
+        arcname = '{}/{}/{}'.format(UPLOADS_DIR, secret, filename)
+        if arcname not in self._uploads:
+            self._tar.add(path, arcname=arcname)
+            self._uploads.add(arcname)
+            self.counts[UPLOADS_DIR] += 1
+        return {'alt': os.path.splitext(filename)[0], 'url': '/{}/{}/{}'.format(UPLOADS_DIR, secret, filename)}
+
+    def _convert_issue(self, redmine_issue, data, meta, user_ids, milestones_by_iid):
+        attachments = []
+        for attachment in meta['attachments']:
+            upload = self._add_upload(attachment['redmine'])
+            redmine_attachment = dict(attachment['redmine'])
+            redmine_attachment.pop('gitlab', None)
+            if upload is not None:
+                redmine_attachment['gitlab'] = upload
+            attachments.append(dict(attachment, redmine=redmine_attachment))
+
+        closed_on = redmine_issue.get('closed_on') if meta['must_close'] else None
+        issue = {
+            'iid': redmine_issue['id'],
+            'title': data['title'],
+            'description': data['description'] + attachments_to_markdown(attachments),
+            'state': 'closed' if meta['must_close'] else 'opened',
+            'author_id': user_ids.get(meta['sudo_user']),
+            'created_at': redmine_issue['created_on'],
+            'updated_at': redmine_issue.get('updated_on') or redmine_issue['created_on'],
+            'closed_at': closed_on,
+            'due_date': data.get('due_date'),
+            'confidential': False,
+            'label_links': [{'label': _label(i)} for i in data['labels'].split(', ')],
+            'issue_assignees': [{'user_id': data['assignee_id']}] if 'assignee_id' in data else [],
+            'notes': [{
+                'note': note_data['body'],
+                'noteable_type': 'Issue',
+                'author_id': user_ids.get(note_meta['sudo_user']),
+                'created_at': note_meta['created_on'],
+                'updated_at': note_meta['created_on'],
+                'system': False,
+            } for note_data, note_meta in meta['notes']],
+        }
+        if 'milestone_id' in data:
+            issue['milestone'] = milestones_by_iid[data['milestone_id']]
+        return issue
+
+    @staticmethod
+    def _convert_milestone(iid, redmine_version):
+        data, meta = convert_version(redmine_version)
+        return {
+            'iid': iid,
+            'title': data['title'],
+            'description': data['description'],
+            'state': 'closed' if meta['must_close'] else 'active',
+            'due_date': data.get('due_date'),
+            'created_at': redmine_version['created_on'],
+            'updated_at': redmine_version.get('updated_on') or redmine_version['created_on'],
+        }
+
+    @staticmethod
+    def _convert_member(redmine_user):
+        return {
+            'user_id': redmine_user['id'],
+            'access_level': DEVELOPER_ACCESS,
+            'source_type': 'Project',
+            'notification_level': 3,
+            'user': {
+                'id': redmine_user['id'],
+                'username': redmine_user['login'],
+                'email': redmine_user.get('mail'),
+                'public_email': redmine_user.get('mail'),
+            },
+        }
+
+    @staticmethod
+    def _convert_project(redmine_project):
+        return {
+            'description': redmine_project.get('description') or '',
+            'visibility_level': 0,
+            'archived': False,
+        }
+
+
+def _label(title):
+    return {'title': title, 'color': LABEL_COLOR, 'type': 'ProjectLabel'}
@@ -0,0 +1,55 @@
+import logging
+
+""" Status of the projects of a batch migration
+"""
+
+log = logging.getLogger(__name__)
+
+# the steps of the migration of a project, in their order, as commands
+BATCH_STEPS = ('init', 'verify-cache', 'migrate', 'link-roadmap', 'link-issues')
+DEFAULT_STEPS = ('init', 'migrate')
+DEFAULT_PROCESSES = 4
+
+BATCH_LOG_FILE = 'migration.log'
+
+PROJECT_DONE = 'done'
+# some items failed, the project must be run again
+PROJECT_INCOMPLETE = 'incomplete'
+PROJECT_FAILED = 'failed'
+
+STATUS_COLUMNS = (('project', 'project'), ('status', 'status'), ('step', 'step'), ('duration', 'time'),
+                  ('failed_items', 'failed items'), ('objects', 'migrated objects'), ('error', 'error'))
+# longer cells are cut, the full error is in the log of the project
+MAX_CELL_WIDTH = 80
+
+
+def project_status(project, status, step=None, duration=0, failed_items=0, objects='', error=None):
+    """ Returns the status of a project, as a row of :func:`format_status_table`
+
+    :param step: the last step run
+    :param failed_items: number of milestones, attachments and issues left failed
+    :param objects: summary of the migrated objects (see ``Ledger.summary``)
+    """
+    return {'project': project, 'status': status, 'step': step or '', 'duration': '{:.0f}s'.format(duration),
+            'failed_items': failed_items, 'objects': objects, 'error': '' if error is None else str(error)}
+
+
+def format_status_table(statuses):
+    """ Formats the status of projects as a text table, one line per project
+    """
+    rows = [[label for key, label in STATUS_COLUMNS]]
+    rows += [[_cell(status[key]) for key, label in STATUS_COLUMNS] for status in statuses]
+    widths = [max(len(row[i]) for row in rows) for i in range(len(STATUS_COLUMNS))]
+    lines = ['  '.join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip() for row in rows]
+    lines.insert(1, '  '.join('-' * width for width in widths))
+    counts = {}
+    for status in statuses:
+        counts[status['status']] = counts.get(status['status'], 0) + 1
+    lines.append('{} project(s): {}'.format(len(statuses), ', '.join(
+        '{} {}'.format(counts[i], i) for i in (PROJECT_DONE, PROJECT_INCOMPLETE, PROJECT_FAILED) if i in counts)))
+    return '\n'.join(lines)
+
+
+def _cell(value):
+    value = str(value)
+    return value if len(value) <= MAX_CELL_WIDTH else value[:MAX_CELL_WIDTH - 3] + '...'
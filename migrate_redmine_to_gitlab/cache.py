@@ -0,0 +1,287 @@
+import atexit
+import hashlib
+import json
+import logging
+import os
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from itertools import chain, repeat
+
+""" Reading of the on-disk redmine cache
+"""
+
+log = logging.getLogger(__name__)
+
+# Below this number of files, spawning worker processes costs more than
+# decoding everything in the current one.
+SERIAL_THRESHOLD = 256
+
+# Durability policies of the cache writer: never fsync, fsync all the files
+# written during a phase when it is flushed, or fsync each batch.
+DURABILITY_NONE = 'none'
+DURABILITY_PHASE = 'phase'
+DURABILITY_BATCH = 'batch'
+DURABILITY_POLICIES = (DURABILITY_NONE, DURABILITY_PHASE, DURABILITY_BATCH)
+
+# Each worker gets several shards so that a slow shard does not leave the
+# other workers idle at the end of the load.
+SHARDS_PER_JOB = 4
+
+
+def default_jobs():
+    return os.cpu_count() or 1
+
+
+def _file_sort_key(path):
+    name = os.path.splitext(os.path.basename(path))[0]
+    try:
+        return 0, int(name), ''
+    except ValueError:
+        return 1, 0, name
+
+
+def list_json_files(path):
+    """ Lists the json files of a cache directory, sorted by object id
+
+    :param path: a cache directory (ex: ``redmine/issues``)
+    :rtype: list
+    """
+    paths = [entry.path for entry in os.scandir(path)
+             if entry.is_file() and entry.name.endswith('.json')]
+    return sorted(paths, key=_file_sort_key)
+
+
+def load_json_file(path):
+    with open(path, 'r') as infile:
+        return json.load(infile)
+
+
+def attachment_data_path(cache_dir, attachment):
+    """ Returns the path of the content file of a cached attachment
+
+    The ``file`` attribute stored in the attachment is absolute and may come
+    from another machine, so the file next to the attachment json is
+    preferred.
+    """
+    path = os.path.join(cache_dir, 'attachments', '{}.data'.format(attachment['id']))
+    if not os.path.exists(path) and attachment.get('file'):
+        return attachment['file']
+    return path
+
+
+def file_digest(path, algorithm='sha256', chunk_size=1 << 20):
+    """ Returns the hex digest of a file, read by chunks
+    """
+    digest = hashlib.new(algorithm)
+    with open(path, 'rb') as infile:
+        for chunk in iter(lambda: infile.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _load_shard(paths, transform=None):
+    if transform is None:
+        return [load_json_file(path) for path in paths]
+    return [transform(load_json_file(path)) for path in paths]
+
+
+def _shard(items, count):
+    size = max(1, -(-len(items) // count))
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def map_shards(func, items, jobs=None, threshold=SERIAL_THRESHOLD, args=()):
+    """ Applies ``func`` to shards of ``items`` across a process pool
+
+    :param func: picklable callable taking a list of items (plus ``args``)
+        and returning a list of results
+    :param items: list of items (usually file paths)
+    :param jobs: number of worker processes (default: number of CPUs)
+    :param threshold: minimal number of items to use the process pool
+    :param args: tuple of extra picklable arguments given to ``func``
+    :return: concatenated results, in the order of ``items``
+    """
+    jobs = jobs or default_jobs()
+    if jobs <= 1 or len(items) < threshold:
+        return func(items, *args)
+
+    shards = _shard(items, jobs * SHARDS_PER_JOB)
+    log.debug('Process {} item(s) using {} process(es)'.format(len(items), jobs))
+    try:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            return list(chain.from_iterable(executor.map(func, shards, *(repeat(i) for i in args))))
+    except (OSError, BrokenProcessPool) as e:
+        log.warning('Could not use a process pool ({}), fallback to serial processing'.format(e))
+        return func(items, *args)
+
+
+def load_json_files(path, jobs=None, transform=None, threshold=SERIAL_THRESHOLD):
+    """ Decodes all the json files of a cache directory
+
+    Files are sharded across a process pool and the shards are merged back in
+    id order. Small directories (or ``jobs=1``) are decoded serially.
+
+    :param path: a cache directory
+    :param jobs: number of worker processes (default: number of CPUs)
+    :param transform: optional picklable callable applied to each decoded
+        object inside the worker, so that only its result is sent back
+    :param threshold: minimal number of files to use the process pool
+    :return: list of decoded objects, in id order
+    """
+    return map_shards(_load_shard, list_json_files(path), jobs, threshold=threshold, args=(transform,))
+
+
+def _fsync_path(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class BatchedCacheWriter:
+    """ Writes cache files in batches on a background thread
+
+    Producers (possibly several fetch workers) queue records through a queue
+    bounded in records and in bytes, so they block when the disk falls behind
+    (a record larger than the byte bound is queued alone). Each file is
+    written to a temporary file then renamed, so a crash never leaves a
+    truncated record.
+
+    :param durability: one of :data:`DURABILITY_POLICIES`
+    :param max_pending: maximal number of queued records
+    :param max_pending_bytes: maximal size of the queued records
+    :param batch_size: maximal number of records written per batch
+    """
+
+    def __init__(self, durability=DURABILITY_PHASE, max_pending=1000, max_pending_bytes=64 << 20, batch_size=100):
+        if durability not in DURABILITY_POLICIES:
+            raise ValueError('Unknown durability policy {}'.format(durability))
+        self.durability = durability
+        self.batch_size = batch_size
+        self.max_pending_bytes = max_pending_bytes
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._lock = threading.Lock()
+        self._pending_bytes = 0
+        self._room = threading.Condition(self._lock)
+        self._thread = None
+        self._error = None
+        self._unsynced = []
+        self.written = 0
+
+    def write_json(self, path, data):
+        self.write_bytes(path, json.dumps(data).encode())
+
+    def write_bytes(self, path, content):
+        """ Queues a file write, blocking while the queue is full
+        """
+        self._raise_error()
+        self._start()
+        with self._room:
+            self._room.wait_for(lambda: self._pending_bytes == 0 or
+                                self._pending_bytes + len(content) <= self.max_pending_bytes)
+            self._pending_bytes += len(content)
+        self._queue.put((path, content))
+
+    def flush(self):
+        """ Waits until all queued records are written (and synced, for the phase policy)
+        """
+        if self._thread is not None:
+            self._queue.join()
+        if self.durability == DURABILITY_PHASE:
+            with self._lock:
+                paths, self._unsynced = self._unsynced, []
+            self._sync(paths)
+        self._raise_error()
+
+    def close(self):
+        if self._thread is None:
+            return
+        self.flush()
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+        atexit.unregister(self.close)
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='cache-writer', daemon=True)
+                self._thread.start()
+                # queued records are written even when the program ends without closing the writer
+                atexit.register(self.close)
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def _run(self):
+        while True:
+            batch, stop = self._next_batch()
+            try:
+                if batch:
+                    self._write_batch(batch)
+            except Exception as e:
+                log.error('Could not write cache batch: {}'.format(e))
+                self._error = e
+            finally:
+                with self._room:
+                    self._pending_bytes -= sum(len(content) for path, content in batch)
+                    self._room.notify_all()
+                for _ in range(len(batch) + stop):
+                    self._queue.task_done()
+            if stop:
+                return
+
+    def _next_batch(self):
+        """ Waits for a record, then takes all the available ones up to the batch size
+
+        :return: couple: list of records, whether the stop marker was reached
+        """
+        batch = []
+        item = self._queue.get()
+        while item is not None:
+            batch.append(item)
+            if len(batch) == self.batch_size:
+                return batch, False
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return batch, False
+        return batch, True
+
+    def _write_batch(self, batch):
+        paths = []
+        for path, content in batch:
+            tmp_path = '{}.tmp'.format(path)
+            with open(tmp_path, 'wb') as outfile:
+                outfile.write(content)
+                if self.durability == DURABILITY_BATCH:
+                    outfile.flush()
+                    os.fsync(outfile.fileno())
+            os.replace(tmp_path, path)
+            paths.append(path)
+
+        if self.durability == DURABILITY_BATCH:
+            self._sync_dirs(paths)
+        elif self.durability == DURABILITY_PHASE:
+            with self._lock:
+                self._unsynced += paths
+        with self._lock:
+            self.written += len(paths)
+        log.debug('Stored {} cache file(s)'.format(len(paths)))
+
+    def _sync(self, paths):
+        for path in paths:
+            _fsync_path(path)
+        self._sync_dirs(paths)
+
+    @staticmethod
+    def _sync_dirs(paths):
+        if os.name != 'posix':
+            return
+        for directory in set(os.path.dirname(i) for i in paths):
+            _fsync_path(directory)
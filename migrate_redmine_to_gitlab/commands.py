@@ -1,16 +1,35 @@
 #!/bin/env python3
 import argparse
+import json
 import logging
+import os
 import re
-
-import subprocess
-
-from migrate_redmine_to_gitlab import sql
-from migrate_redmine_to_gitlab.config import MigrationConfig
-from migrate_redmine_to_gitlab.converters import convert_issue, convert_version, convert_attachments
+import time
+from contextlib import nullcontext
+from functools import partial
+from urllib.parse import urlparse
+
+from migrate_redmine_to_gitlab import limit_host, sql
+from migrate_redmine_to_gitlab.archive import ProjectArchive
+from migrate_redmine_to_gitlab.batch import BATCH_LOG_FILE, BATCH_STEPS, DEFAULT_PROCESSES, DEFAULT_STEPS, \
+    PROJECT_DONE, PROJECT_FAILED, PROJECT_INCOMPLETE, format_status_table, project_status
+from migrate_redmine_to_gitlab.cache import DURABILITY_PHASE, DURABILITY_POLICIES
+from migrate_redmine_to_gitlab.config import BatchConfig, MigrationConfig
+from migrate_redmine_to_gitlab.converters import convert_issue, convert_version, convert_attachment, NOTES_BY_AUTHOR
 from migrate_redmine_to_gitlab.gitlab import GitlabClient, GitlabProject
+from migrate_redmine_to_gitlab.ledger import NOTE, Ledger
 from migrate_redmine_to_gitlab.logging import setup_module_logging
+from migrate_redmine_to_gitlab.parallel import DEFAULT_WORKERS, RateLimiter, SharedRateLimiter, Turnstile, \
+    run_concurrently, run_processes
+from migrate_redmine_to_gitlab.snapshot import GitlabSnapshot, REGEX_TITLE_MARKER
+from migrate_redmine_to_gitlab.uploads import AttachmentUploader, LARGE_FILE_SIZE, MB, is_uploaded
+from migrate_redmine_to_gitlab.relations import IssueLinker, RelationCheckpoint, iter_links
+from migrate_redmine_to_gitlab.scheduler import TaskGraph
 from migrate_redmine_to_gitlab.redmine import RedmineClient, RedmineProjectWithCache, RedmineProject, RedmineCacheWriter
+from migrate_redmine_to_gitlab.users import GitlabUserResolver, default_cache_path
+from migrate_redmine_to_gitlab.verify import verify_cache
+from migrate_redmine_to_gitlab.workqueue import ATTACHMENT, DONE, FAILED, ISSUE, ISSUE_LINK, MAX_ATTEMPTS, MILESTONE, \
+    VERSION_LINK, WorkQueue
 
 """Migration commands for issues and roadmaps from redmine to gitlab
 """
@@ -26,7 +45,32 @@ class CommandError(Exception):
         self.msg = msg
 
 
-def parse_args():
+def notes_group_by(value):
+    """ Parses the --merge-notes option
+    """
+    if value == NOTES_BY_AUTHOR:
+        return value
+    try:
+        count = int(value)
+    except ValueError:
+        count = 0
+    if count < 1:
+        raise argparse.ArgumentTypeError('expected "{}" or a positive number: {}'.format(NOTES_BY_AUTHOR, value))
+    return count
+
+
+def steps_list(value):
+    """ Parses the --steps option
+    """
+    steps = [i.strip() for i in value.split(',') if i.strip()]
+    unknown = [i for i in steps if i not in BATCH_STEPS]
+    if not steps or unknown:
+        raise argparse.ArgumentTypeError('expected steps among {}: {}'.format(', '.join(BATCH_STEPS), value))
+    # steps are run in their order
+    return [i for i in BATCH_STEPS if i in steps]
+
+
+def build_parser():
     parser = argparse.ArgumentParser(description=__doc__)
     subparsers = parser.add_subparsers(dest='command')
     commands = []
@@ -35,12 +79,30 @@ def parse_args():
     init.set_defaults(command=Init)
     commands.append(init)
 
+    verify = subparsers.add_parser('verify-cache', help=VerifyCache.__doc__)
+    verify.set_defaults(command=VerifyCache)
+    verify.add_argument('--report', required=False, default=None,
+                        help="write the json report to this file instead of standard output")
+    commands.append(verify)
+
+    export_archive = subparsers.add_parser('export-archive', help=ExportArchive.__doc__)
+    export_archive.set_defaults(command=ExportArchive)
+    export_archive.add_argument('--output', required=False, default=None,
+                                help="archive file to write (default: gitlab-export.tar.gz in --path)")
+    commands.append(export_archive)
+
     roadmap = subparsers.add_parser('roadmap', help=Versions.__doc__)
     roadmap.set_defaults(command=Versions)
     commands.append(roadmap)
 
     attachments = subparsers.add_parser('attachments', help=Attachments.__doc__)
     attachments.set_defaults(command=Attachments)
+    attachments.add_argument('--bandwidth', required=False, type=float, default=None,
+                             help="available upload bandwidth in MB/s, sizes the number of concurrent large uploads")
+    attachments.add_argument('--large-file-size', required=False, type=float, default=LARGE_FILE_SIZE / MB,
+                             help="size in MB above which files are uploaded in the large files lane")
+    attachments.add_argument('--link-above', required=False, type=float, default=None,
+                             help="size in MB above which files are not uploaded but linked to redmine")
     commands.append(attachments)
 
     issues = subparsers.add_parser('issues', help=Issues.__doc__)
@@ -49,12 +111,35 @@ def parse_args():
 
     issues_with_id = subparsers.add_parser('issues-with-id', help=IssuesWithId.__doc__)
     issues_with_id.set_defaults(command=IssuesWithId)
+    issues_with_id.add_argument('--any-order', required=False, action='store_true', default=False,
+                                help="create issues fully concurrently, in any order "
+                                     "(iids are then fixed by the iid command)")
     commands.append(issues_with_id)
 
+    migrate = subparsers.add_parser('migrate', help=Migrate.__doc__)
+    migrate.set_defaults(command=Migrate)
+    migrate.add_argument('--link-above', required=False, type=float, default=None,
+                         help="size in MB above which files are not uploaded but linked to redmine")
+    commands.append(migrate)
+
+    for i in (issues, issues_with_id, export_archive, migrate):
+        i.add_argument('--merge-notes', required=False, type=notes_group_by, default=None,
+                       help="merge journal entries into fewer notes: \"author\" for one note per run of entries "
+                            "of a same author, or a number of entries per note (default: one note per entry)")
+
     delete_issues = subparsers.add_parser('delete-issues', help=DeleteIssues.__doc__)
     delete_issues.set_defaults(command=DeleteIssues)
     commands.append(delete_issues)
 
+    rollback = subparsers.add_parser('rollback', help=Rollback.__doc__)
+    rollback.set_defaults(command=Rollback)
+    rollback.add_argument('--rate', required=False, type=float, default=None,
+                          help="maximum number of deletions per second (default: no limit)")
+    rollback.add_argument('--delete-duplicates', required=False, action='store_true', default=False,
+                          help="also delete the other gitlab issues mentioning the redmine id of a migrated issue "
+                               "(default: list them)")
+    commands.append(rollback)
+
     link_roadmap = subparsers.add_parser('link-roadmap', help=LinkRedmineRoadmap.__doc__)
     link_roadmap.set_defaults(command=LinkRedmineRoadmap)
     commands.append(link_roadmap)
@@ -63,17 +148,57 @@ def parse_args():
     link_issue.set_defaults(command=LinkRedmineIssue)
     commands.append(link_issue)
 
+    for i in (link_roadmap, link_issue):
+        i.add_argument('--rate', required=False, type=float, default=None,
+                       help="maximum number of redmine updates per second (default: no limit)")
+
     iid = subparsers.add_parser('iid', help=Iid.__doc__)
     iid.set_defaults(command=Iid)
     commands.append(iid)
 
+    relations = subparsers.add_parser('relations', help=Relations.__doc__)
+    relations.set_defaults(command=Relations)
+    commands.append(relations)
+
+    batch = subparsers.add_parser('batch', help=Batch.__doc__)
+    batch.set_defaults(command=Batch)
+    batch.add_argument('--steps', required=False, type=steps_list, default=list(DEFAULT_STEPS),
+                       help="commands run on each project, among {} (default: {})".format(
+                           ', '.join(BATCH_STEPS), ','.join(DEFAULT_STEPS)))
+    batch.add_argument('--processes', required=False, type=int, default=DEFAULT_PROCESSES,
+                       help="number of projects migrated at once (default: {})".format(DEFAULT_PROCESSES))
+    batch.add_argument('--redmine-rate', required=False, type=float, default=None,
+                       help="maximum number of requests per second to each redmine host, "
+                            "by all projects (default: no limit)")
+    batch.add_argument('--gitlab-rate', required=False, type=float, default=None,
+                       help="maximum number of requests per second to each gitlab host, "
+                            "by all projects (default: no limit)")
+    commands.append(batch)
+
     for i in commands:
         i.add_argument('--check', required=False, action='store_true', default=False,
                        help="do not perform any action, just check everything is ready")
         i.add_argument('--debug', required=False, action='store_true', default=False, help="More output")
         i.add_argument('--path', required=False, default=".", help="please set the path.")
+        i.add_argument('--jobs', required=False, type=int, default=None,
+                       help="number of processes used to read the cache (default: number of CPUs)")
+        i.add_argument('--durability', required=False, choices=DURABILITY_POLICIES, default=DURABILITY_PHASE,
+                       help="when cache writes are synced to disk: never, at the end of each phase, "
+                            "or after each batch (default: phase)")
+        i.add_argument('--users-cache', required=False, default=default_cache_path(),
+                       help="gitlab users cache file, shared by all projects (empty to disable)")
+        i.add_argument('--users-cache-ttl', required=False, type=int, default=GitlabUserResolver.DEFAULT_TTL,
+                       help="seconds after which a cached gitlab user is looked up again")
+        i.add_argument('--graphql', required=False, action='store_true', default=False,
+                       help="read gitlab issues, milestones and members through GraphQL (falls back to REST)")
+        i.add_argument('--workers', required=False, type=int, default=DEFAULT_WORKERS,
+                       help="number of concurrent requests to gitlab (default: {})".format(DEFAULT_WORKERS))
+
+    return parser
 
-    return parser.parse_args()
+
+def parse_args():
+    return build_parser().parse_args()
 
 
 def main():
@@ -87,7 +212,7 @@ def main():
     # Configure global logging
     setup_module_logging('migrate_redmine_to_gitlab', level=log_level)
 
-    config = MigrationConfig(args.path)
+    config = BatchConfig(args.path) if args.command is Batch else MigrationConfig(args.path)
 
     try:
         args.command(config, args).run()
@@ -100,13 +225,31 @@ class Command:
     def __init__(self, config, args):
         self.gitlab = None
         self.redmine = None
+        self.cache = None
+        self.snapshot = None
+        self.queue = None
+        self.ledger = None
         self.args = args
         self.config = config
         log.info('Init {}'.format(self))
 
     def run(self):
         log.info('Run {}'.format(self))
-        self.execute()
+        try:
+            self.execute()
+        finally:
+            if self.cache is not None:
+                self.cache.close()
+            if self.snapshot is not None:
+                self.snapshot.save()
+            if self.queue is not None:
+                self.queue.close()
+            if self.ledger is not None:
+                log.info('Migrated objects: {}'.format(self.ledger.summary()))
+                self.ledger.close()
+            for name, project in (('redmine', self.redmine), ('gitlab', self.gitlab)):
+                if project is not None:
+                    log.info('{} requests: {}'.format(name, project.api.stats.summary()))
         log.info('End {}'.format(self))
 
     def check(self, func, message):
@@ -119,19 +262,93 @@ class Command:
             exit(1)
 
     def redmine_project_with_cache(self):
-        redmine_client = RedmineClient(self.config.redmine_key)
-        return RedmineProjectWithCache(self.config.redmine_project_url, self.config.cache_dir, redmine_client)
+        redmine_client = RedmineClient(self.config.redmine_key, pool_size=self.args.workers)
+        return RedmineProjectWithCache(self.config.redmine_project_url, self.config.cache_dir, redmine_client,
+                                       jobs=self.args.jobs)
 
     def redmine_project(self):
-        redmine_client = RedmineClient(self.config.redmine_key)
+        redmine_client = RedmineClient(self.config.redmine_key, pool_size=self.args.workers)
         return RedmineProject(self.config.redmine_project_url, redmine_client)
 
     def gitlab_project(self):
-        gitlab_client = GitlabClient(self.config.gitlab_key)
-        return GitlabProject(self.config.gitlab_project_url, gitlab_client)
+        """ Returns the gitlab project, and brings its snapshot (``self.snapshot``) up to date
+        """
+        gitlab_client = GitlabClient(self.config.gitlab_key, pool_size=self.args.workers)
+        self.snapshot = GitlabSnapshot(self.config.cache_dir, self.config.gitlab_project_url)
+        # the project is fetched again, the snapshot is discarded if it was recreated meanwhile
+        gitlab = GitlabProject(self.config.gitlab_project_url, gitlab_client, use_graphql=self.args.graphql)
+        self.snapshot.refresh(gitlab)
+        return gitlab
+
+    def gitlab_user_resolver(self):
+        return GitlabUserResolver(self.gitlab.api, self.gitlab.instance_url,
+                                  cache_path=self.args.users_cache or None, ttl=self.args.users_cache_ttl)
+
+    def work_queue(self):
+        return WorkQueue(self.config.cache_dir)
+
+    def migration_ledger(self):
+        return Ledger(self.config.cache_dir)
+
+    def forget_issue(self, redmine_id):
+        """ Forgets the migration of a redmine issue whose gitlab issue was deleted, so that it is migrated again
+
+        Its state in the work queue, its issue and notes in the ledger and its
+        gitlab iid in the redmine cache are removed.
+        """
+        self.queue.forget(ISSUE, redmine_id)
+        self.ledger.forget(ISSUE, redmine_id)
+        full_issue = self.redmine.get_issue(redmine_id)
+        for journal in full_issue.get('journals', []):
+            self.ledger.forget(NOTE, journal['id'])
+        if full_issue.pop('gitlab_id', None) is not None:
+            self.cache.load_issue(full_issue)
+
+    def migrated_milestone(self, redmine_version):
+        """ Returns the gitlab milestone (from the snapshot) recorded as created for a redmine version, or None
+
+        Milestones are recorded in the ledger, or, when created before the
+        ledger, in the redmine cache.
+        """
+        milestone_id = self.ledger.gitlab_id(MILESTONE, redmine_version['id'])
+        if milestone_id is None:
+            milestone_id = redmine_version.get('gitlab_id')
+        return self.snapshot.milestones_by_id.get(milestone_id)
+
+    def milestone_pending(self, redmine_version, data, meta):
+        """ Whether the milestone of a redmine version is still to be created, or closed
+        """
+        milestone = self.migrated_milestone(redmine_version)
+        if milestone is None:
+            # milestones created by hand, or before their recording, are found by title
+            return data['title'] not in self.snapshot.milestones_by_title
+        return meta['must_close'] and milestone['state'] != 'closed'
+
+    def migrate_milestone(self, redmine_version, data, meta):
+        """ Creates the milestone of a redmine version and closes it, where a previous try (or run) stopped
+
+        The milestone is recorded (in the ledger, the snapshot and the redmine
+        cache) as soon as it is created, before being closed.
+
+        :return: the milestone
+        """
+        self.queue.start(MILESTONE, redmine_version['id'])
+        milestone = self.migrated_milestone(redmine_version)
+        if milestone is None:
+            milestone = self.gitlab.post_milestone(data)
+            self.snapshot.record_milestone(milestone)
+            self.ledger.record(MILESTONE, redmine_version['id'], milestone['id'], milestone.get('web_url'))
+            redmine_version['gitlab_id'] = milestone['id']
+            self.cache.load_version(redmine_version)
+        if meta['must_close'] and milestone['state'] != 'closed':
+            milestone = self.gitlab.close_milestone(milestone)
+            self.snapshot.record_milestone(milestone)
+        self.queue.done(MILESTONE, redmine_version['id'])
+        return milestone
 
     def redmine_cache(self, redmine_project):
-        return RedmineCacheWriter(self.config.cache_dir, redmine_project)
+        return RedmineCacheWriter(self.config.cache_dir, redmine_project, jobs=self.args.jobs,
+                                  durability=self.args.durability)
 
     def execute(self):
         pass
@@ -159,6 +376,39 @@ class Init(Command):
         log.info('{} attachment(s) loaded'.format(len(attachments)))
 
 
+class VerifyCache(Command):
+    """Verify that the redmine cache is complete and uncorrupted"""
+
+    def execute(self):
+        report = verify_cache(self.config.cache_dir, self.args.jobs)
+        output = json.dumps(report, indent=2)
+        if self.args.report:
+            with open(self.args.report, 'w') as outfile:
+                outfile.write(output)
+            log.info('Cache report written to {}'.format(self.args.report))
+        else:
+            print(output)
+
+        if not report['ok']:
+            raise CommandError('{} error(s) found in cache {}'.format(len(report['errors']), self.config.cache_dir))
+
+
+class ExportArchive(Command):
+    """Write a gitlab project import archive from the redmine cache, without any gitlab request"""
+
+    def __init__(self, config, args):
+        # noinspection PyCompatibility
+        super().__init__(config, args)
+        self.redmine = self.redmine_project_with_cache()
+
+    def execute(self):
+        output = self.args.output or os.path.join(self.args.path, 'gitlab-export.tar.gz')
+        if self.args.check:
+            log.info('Would write gitlab import archive {}'.format(output))
+            return
+        ProjectArchive(self.redmine, self.config.cache_dir, notes_group_by=self.args.merge_notes).write(output)
+
+
 class Versions(Command):
     def __init__(self, config, args):
         # noinspection PyCompatibility
@@ -166,9 +416,10 @@ class Versions(Command):
         self.redmine = self.redmine_project_with_cache()
         self.gitlab = self.gitlab_project()
         self.cache = self.redmine_cache(self.redmine)
+        self.queue = self.work_queue()
+        self.ledger = self.migration_ledger()
 
         checks = [
-            (self.check_no_milestone, 'Gitlab project has no pre-existing milestone'),
             (self.check_origin_milestone, 'Redmine project contains versions'),
         ]
         for i in checks:
@@ -176,38 +427,58 @@ class Versions(Command):
 
         self.redmine_versions = self.redmine.get_versions()
         log.info('Got {} version(s) from redmine.'.format(len(self.redmine_versions)))
+        if not self.check_no_milestone(self.redmine, self.gitlab):
+            log.info('Gitlab project already has {} milestone(s), they are kept'.format(
+                len(self.snapshot.milestones_by_id)))
 
     def execute(self):
 
-        existing_gitlab_versions = self.gitlab.get_milestones_index().keys()
+        versions_data = []
+        for redmine_version in self.redmine_versions:
+            data, meta = convert_version(redmine_version)
+            if not self.milestone_pending(redmine_version, data, meta):
+                log.info("skip existing milestone {}".format(data['title']))
+                continue
+            versions_data.append((redmine_version, data, meta))
 
-        versions_data = [convert_version(redmine_version) for redmine_version in self.redmine_versions]
         if self.args.check:
-            for data, meta in versions_data:
-                if not data['title'] in existing_gitlab_versions:
-                    log.info("Would create version {}".format(data))
+            for redmine_version, data, meta in versions_data:
+                log.info("Would create version {}".format(data))
             return
 
-        gitlab_versions = []
-        created_versions, bad_versions = self._create_versions(versions_data, [], existing_gitlab_versions)
-        gitlab_versions += created_versions
-        while len(bad_versions) > 0:
-            log.info('Some versions were not created: {}'.format(bad_versions))
-
-            created_versions, bad_versions = self._create_versions(versions_data,
-                                                                   bad_versions,
-                                                                   existing_gitlab_versions)
-            gitlab_versions += created_versions
+        self.queue.add(MILESTONE, [i[0]['id'] for i in versions_data])
+        created_count, bad_versions = self._create_versions(versions_data)
+        for attempt in range(1, MAX_ATTEMPTS):
+            if not bad_versions:
+                break
+            log.info('Some versions were not created: {}'.format([i[0]['id'] for i in bad_versions]))
+            count, bad_versions = self._create_versions(bad_versions)
+            created_count += count
 
-        versions_index = {str(redmine_version['id']): redmine_version for redmine_version in self.redmine_versions}
+        log.info('{} version(s) created on GitLab'.format(created_count))
+        self.queue.log_failures(MILESTONE, [i[0]['id'] for i in bad_versions])
 
-        for gitlab_version in gitlab_versions:
-            redmine_id = gitlab_version['redmine_id']
-            redmine_version = versions_index[redmine_id]
-            redmine_version['gitlab_id'] = gitlab_version['id']
-            self.cache.load_version(redmine_version)
+    def _create_versions(self, versions_data):
+        """ Creates milestones concurrently, storing their gitlab id in the cache as soon as created
 
-        log.info('{} version(s) created on GitLab'.format(len(gitlab_versions)))
+        :param versions_data: list of triples: redmine version, ``data`` and ``meta`` from ``convert_version``
+        :return: couple: number of created milestones, list of triples that could not be created
+        """
+        bad_versions = []
+        created_count = 0
+        for item, created_version, error in run_concurrently(self._create_version, versions_data, self.args.workers):
+            redmine_version = item[0]
+            if error is not None:
+                log.error('Could not create version {}: {}'.format(redmine_version['id'], error))
+                self.queue.fail(MILESTONE, redmine_version['id'], error)
+                bad_versions.append(item)
+                continue
+            log.info("Version {}".format(created_version['title']))
+            created_count += 1
+        return created_count, bad_versions
+
+    def _create_version(self, item):
+        return self.migrate_milestone(*item)
 
     # noinspection PyUnusedLocal
     @staticmethod
@@ -215,30 +486,8 @@ class Versions(Command):
         return len(redmine.get_versions()) > 0
 
     # noinspection PyUnusedLocal
-    @staticmethod
-    def check_no_milestone(redmine, gitlab):
-        return len(gitlab.get_milestones()) == 0
-
-    def _create_versions(self, versions_data, incoming_bad_versions, existing_gitlab_versions):
-        bad_versions = []
-        created_versions = []
-        for data, meta in versions_data:
-            if data['title'] in existing_gitlab_versions:
-                log.info("skip existing milestone {}".format(data['title']))
-                pass
-            log.debug(data)
-            data_id = str(data['redmine_id'])
-            if len(incoming_bad_versions) == 0 or data_id in incoming_bad_versions:
-                # noinspection PyBroadException
-                try:
-                    created_version = self.gitlab.create_milestone(data, meta)
-                    created_version['redmine_id'] = data_id
-                    created_versions.append(created_version)
-                    log.info("Version {}".format(created_version['title']))
-                except:
-                    log.error('Could not create version {}'.format(data_id))
-                    bad_versions.append(data_id)
-        return created_versions, bad_versions
+    def check_no_milestone(self, redmine, gitlab):
+        return len(self.snapshot.milestones_by_id) == 0
 
 
 class Attachments(Command):
@@ -248,8 +497,10 @@ class Attachments(Command):
         self.redmine = self.redmine_project_with_cache()
         self.gitlab = self.gitlab_project()
         self.cache = self.redmine_cache(self.redmine)
+        self.queue = self.work_queue()
+        self.ledger = self.migration_ledger()
 
-        self.redmine_issues = self.redmine.get_all_issues()
+        self.redmine_issues = self.redmine.get_issue_records()
         log.info('Got {} issue(s) from redmine.'.format(len(self.redmine_issues)))
 
         self.attachments_index = self.redmine.get_attachments_index()
@@ -262,49 +513,47 @@ class Attachments(Command):
         attachments_data = []
 
         for redmine_issue in self.redmine_issues:
-            attachments_data += convert_attachments(redmine_issue, self.attachments_index, gitlab_id)
+            attachments_data += [convert_attachment(gitlab_id, self.attachments_index[attachment_id])
+                                 for attachment_id in redmine_issue.attachment_ids
+                                 if not is_uploaded(self.attachments_index[attachment_id], gitlab_id)]
 
         if self.args.check:
             for data in attachments_data:
                 log.info('Would create attachment "{}"'.format(data['redmine']['filename']))
             return
 
-        gitlab_attachments = []
-        created_attachments, bad_attachments = self._create_attachments(attachments_data, [])
-        gitlab_attachments += created_attachments
-        while len(bad_attachments) > 0:
-            log.info('Some attachments were not created: {}'.format(bad_attachments))
-
-            created_attachments, bad_attachments = self._create_attachments(attachments_data, bad_attachments)
+        uploader = AttachmentUploader(
+            self.gitlab, self.cache, self.config.cache_dir, workers=self.args.workers,
+            bandwidth=None if self.args.bandwidth is None else self.args.bandwidth * MB,
+            large_file_size=self.args.large_file_size * MB,
+            link_above=None if self.args.link_above is None else self.args.link_above * MB)
+        self.queue.add(ATTACHMENT, [i['redmine']['id'] for i in attachments_data])
+        gitlab_attachments, bad_attachments = self._upload(uploader, attachments_data)
+        for attempt in range(1, MAX_ATTEMPTS):
+            if not bad_attachments:
+                break
+            log.info('Some attachments were not created: {}'.format([i['redmine']['id'] for i in bad_attachments]))
+
+            created_attachments, bad_attachments = self._upload(uploader, bad_attachments)
             gitlab_attachments += created_attachments
 
-        for attachment in gitlab_attachments:
-            redmine_attachment = attachment['redmine']
-            redmine_attachment['gitlab'] = attachment['gitlab']
-            self.cache.load_attachment(redmine_attachment)
-
         log.info('{} attachments(s) created on GitLab'.format(len(gitlab_attachments)))
+        self.queue.log_failures(ATTACHMENT, [i['redmine']['id'] for i in bad_attachments])
 
-    def _create_attachments(self, attachments_data, incoming_bad_attachments):
-        bad_attachments = []
-        created_attachments = []
+    def _upload(self, uploader, attachments_data):
+        for data in attachments_data:
+            self.queue.start(ATTACHMENT, data['redmine']['id'])
+        created, failed = uploader.upload(attachments_data)
+        failed_ids = set(i['redmine']['id'] for i in failed)
         for data in attachments_data:
-            data_redmine_ = data['redmine']
-            data_id = str(data_redmine_['id'])
-            if len(incoming_bad_attachments) == 0 or data_id in incoming_bad_attachments:
-                # noinspection PyBroadException
-                try:
-                    created_attachment = self.gitlab.create_attachment(data)
-                    data['gitlab'] = created_attachment
-                    created_attachments.append(data)
-                    log.info("Created attachment (was: {}) {}".format(data_id, created_attachment['markdown']))
-                except:
-                    bad_attachments.append(data_id)
-                    # noinspection SpellCheckingInspection
-                    log.error(
-                        'Could not create attachment {} {} (size: {})'.format(data_id, data_redmine_['filename'],
-                                                                              data_redmine_['filesize']))
-        return created_attachments, bad_attachments
+            # attachments linked to redmine are done too
+            if data['redmine']['id'] in failed_ids:
+                self.queue.fail(ATTACHMENT, data['redmine']['id'], uploader.errors.get(data['redmine']['id']))
+            else:
+                if 'gitlab' in data:
+                    self.ledger.record(ATTACHMENT, data['redmine']['id'], url=data['gitlab']['url'])
+                self.queue.done(ATTACHMENT, data['redmine']['id'])
+        return created, failed
 
 
 class Issues(Command):
@@ -315,40 +564,49 @@ class Issues(Command):
         self.gitlab = self.gitlab_project()
         self.cache = self.redmine_cache(self.redmine)
 
-        self.gitlab_users_index = self.gitlab.get_users_index()
-        log.info('Got {} users(s) from gitlab.'.format(len(self.gitlab_users_index.values())))
-
         self.redmine_users_index = self.redmine.get_users_index()
         log.info('Got {} users(s) from redmine.'.format(len(self.redmine_users_index.values())))
 
-        checks = [
-            (self.check_users, 'Required users presence'),
-            (self.check_no_issue, 'Project has no pre-existing issue'),
-        ]
-        for i in checks:
+        self.gitlab_users_index = self.gitlab_user_resolver()
+        gitlab_users = self.gitlab_users_index.resolve(self._redmine_logins())
+        log.info('Got {} users(s) from gitlab.'.format(len(gitlab_users)))
+
+        self.queue = self.work_queue()
+        self.ledger = self.migration_ledger()
+        for i in self.checks():
             self.check(*i)
 
-        self.redmine_issues = self.redmine.get_all_issues()
+        self.redmine_issues = self.redmine.get_issue_records()
         log.info('Got {} issue(s) from redmine.'.format(len(self.redmine_issues)))
 
         self.attachments_index = self.redmine.get_attachments_index()
         log.info('Got {} attachment(s) from redmine.'.format(len(self.attachments_index.values())))
 
-        self.milestones_index = self.gitlab.get_milestones_index()
+        self.milestones_index = self.snapshot.milestones_by_title
         log.info('Got {} milestone(s) from gitlab.'.format(len(self.milestones_index.values())))
 
         self.gitlab_id = self.gitlab.get_id()
 
-    def execute(self):
+    def checks(self):
+        return [
+            (self.check_users, 'Required users presence'),
+            (self.check_no_issue, 'Project has no pre-existing issue'),
+        ]
 
-        issues_data = self._convert_issues()
+    @property
+    def ordered(self):
+        """ Whether issues must be created in redmine id order, so that iids follow redmine ids
+        """
+        return True
+
+    def execute(self):
 
         if self.args.check:
-            for data, meta in issues_data:
+            for data, meta in self._convert_issues(self.redmine_issues):
                 milestone_id = data.get('milestone_id', None)
                 if milestone_id:
                     try:
-                        self.gitlab.get_milestone_by_id(milestone_id)
+                        self.snapshot.get_milestone_by_id(milestone_id)
                     except ValueError:
                         raise CommandError(
                             "issue \"{}\" points to unknown milestone_id \"{}\". "
@@ -361,64 +619,142 @@ class Issues(Command):
                                                                                        len(meta['attachments'])))
             return
 
-        gitlab_issues = []
-
-        created_issues, bad_issues = self._create_issues(issues_data, [])
-        gitlab_issues += created_issues
-        while len(bad_issues) > 0:
-            log.info('Some issues were not created: {}'.format(bad_issues))
-            created_issues, bad_issues = self._create_issues(issues_data, bad_issues)
-            gitlab_issues += created_issues
-
-        issues_by_index = {str(redmine_issue['id']): redmine_issue for redmine_issue in self.redmine_issues}
-
-        for gitlab_issue in gitlab_issues:
-            redmine_id = gitlab_issue['redmine_id']
-            redmine_issue = issues_by_index[redmine_id]
-            redmine_issue['gitlab_id'] = gitlab_issue['iid']
-            self.cache.load_issue(redmine_issue)
-        log.info('{} issue(s) created on GitLab'.format(len(gitlab_issues)))
+        done_ids = self.queue.done_ids(ISSUE)
+        redmine_issues = [i for i in self.redmine_issues if str(i.id) not in done_ids]
+        if len(redmine_issues) < len(self.redmine_issues):
+            log.info('{} issue(s) already created by a previous run'.format(
+                len(self.redmine_issues) - len(redmine_issues)))
+        self.queue.add(ISSUE, [i.id for i in redmine_issues])
+
+        created_count, bad_issues = self._create_issues(redmine_issues)
+        for attempt in range(1, MAX_ATTEMPTS):
+            if not bad_issues:
+                break
+            log.info('Some issues were not created: {}'.format([i.id for i in bad_issues]))
+            count, bad_issues = self._create_issues(bad_issues)
+            created_count += count
+
+        log.info('{} issue(s) created on GitLab'.format(created_count))
+        self.queue.log_failures(ISSUE, [i.id for i in bad_issues])
+
+    def _convert_issues(self, redmine_issues):
+        """ Lazily converts issue records, reading each full issue from the cache
+
+        :param redmine_issues: list of :class:`IssueRecord`
+        :return: yielded couples ``data``, ``meta`` as returned by ``convert_issue``
+        """
+        for redmine_issue in redmine_issues:
+            yield self._convert_issue(self.redmine.get_issue(redmine_issue.id))
 
-    def _convert_issues(self):
-        return [
-            convert_issue(redmine_issue,
-                          self.redmine_users_index,
-                          self.attachments_index,
-                          self.gitlab_id,
-                          self.gitlab_users_index,
-                          self.milestones_index) for redmine_issue in self.redmine_issues]
+    def _convert_issue(self, redmine_issue):
+        return convert_issue(redmine_issue,
+                             self.redmine_users_index,
+                             self.attachments_index,
+                             self.gitlab_id,
+                             self.gitlab_users_index,
+                             self.milestones_index,
+                             notes_group_by=self.args.merge_notes)
 
     # noinspection PyUnusedLocal
-    @staticmethod
-    def check_no_issue(redmine, gitlab):
-        return len(gitlab.get_issues()) == 0
+    def check_no_issue(self, redmine, gitlab):
+        # the issues of a previous run are resumed
+        return all(self.queue.get(ISSUE, i['redmine_id']) is not None for i in self.snapshot.issues_by_iid.values())
 
-    @staticmethod
-    def check_users(redmine, gitlab):
-        users = redmine.get_participants()
+    def _redmine_logins(self):
         # Filter out anonymous user
-        nicks = set([i['login'] for i in users if i['login'] != ''])
+        return set([i['login'] for i in self.redmine_users_index.values() if i['login'] != ''])
+
+    # noinspection PyUnusedLocal
+    def check_users(self, redmine, gitlab):
+        nicks = self._redmine_logins()
         log.info('Project users are: {}'.format(', '.join(nicks) + ' '))
 
-        gitlab_user_names = set([i['username'] for i in gitlab.get_all_users()])
-        return all((i in gitlab_user_names for i in nicks))
+        missing = sorted(i for i in nicks if i not in self.gitlab_users_index)
+        if missing:
+            log.error('Unknown gitlab user(s): {}'.format(', '.join(missing)))
+        return len(missing) == 0
+
+    def _create_issues(self, redmine_issues):
+        """ Creates the given issues concurrently, storing their gitlab iid in the cache as soon as created
 
-    def _create_issues(self, issues_data, incoming_bad_issues):
+        Unless ``ordered`` is false, issues are posted in the order of the
+        records, so that gitlab iids follow it, while notes and closing of
+        already posted issues go on in other threads. The notes of an issue are posted in journal order,
+        its closing last. An issue that fails is resumed where it stopped on
+        the next call.
+
+        :param redmine_issues: list of :class:`IssueRecord`
+        :return: couple: number of created issues, list of records that could not be created
+        """
         bad_issues = []
-        created_issues = []
-        for data, meta in issues_data:
-            data_id = str(data['redmine_id'])
-            if len(incoming_bad_issues) == 0 or data_id in incoming_bad_issues:
-                # noinspection PyBroadException
-                try:
-                    created_issue = self.gitlab.create_issue(data, meta)
-                    created_issue['redmine_id'] = data_id
-                    created_issues.append(created_issue)
-                    log.info("Created issue (was: {}) {}".format(data_id, created_issue['title']))
-                except:
-                    log.error('Could not create issue {}'.format(data_id))
-                    bad_issues.append(data_id)
-        return created_issues, bad_issues
+        created_count = 0
+        turnstile = Turnstile() if self.ordered else None
+        items = [(ticket, redmine_issue, turnstile) for ticket, redmine_issue in enumerate(redmine_issues)]
+        for (ticket, redmine_issue, turnstile), created_issue, error in run_concurrently(
+                self._create_issue, items, self.args.workers):
+            if isinstance(error, CommandError):
+                raise error
+            if error is not None:
+                log.error('Could not create issue {}: {}'.format(redmine_issue.id, error))
+                self.queue.fail(ISSUE, redmine_issue.id, error)
+                bad_issues.append(redmine_issue)
+                continue
+            log.info("Created issue (was: {}) {}".format(redmine_issue.id, created_issue['title']))
+            created_count += 1
+        return created_count, bad_issues
+
+    def _create_issue(self, item):
+        ticket, redmine_issue, turnstile = item
+        with turnstile.turn(ticket) if turnstile else nullcontext():
+            full_issue, meta, progress = self._post_issue(redmine_issue)
+        return self._complete_issue(redmine_issue, full_issue, meta, progress)
+
+    def _post_issue(self, redmine_issue):
+        """ Posts an issue, unless already posted by a previous try (or run)
+
+        :return: triple: the full redmine issue, the ``meta`` of its conversion, its progress
+        """
+        state = self.queue.get(ISSUE, redmine_issue.id)
+        progress = (state and state['progress']) or {'issue': None, 'notes': 0, 'closed': False}
+        self.queue.start(ISSUE, redmine_issue.id)
+        full_issue = self.redmine.get_issue(redmine_issue.id)
+        try:
+            data, meta = self._convert_issue(full_issue)
+        except Exception as e:
+            raise CommandError('Could not convert redmine issue {}: {}'.format(redmine_issue.id, e))
+        if progress['issue'] is None:
+            # a run killed between the post and the saving of the progress left the issue without notes
+            created_issue = self.snapshot.issues_by_redmine_id.get(redmine_issue.id) if state else None
+            if created_issue is None:
+                created_issue = self.gitlab.post_issue(data, meta)
+                self.snapshot.record_issue(dict(created_issue, redmine_id=redmine_issue.id))
+            self.ledger.record(ISSUE, redmine_issue.id, created_issue['iid'], created_issue.get('web_url'))
+            progress['issue'] = {'iid': created_issue['iid'], 'title': created_issue['title']}
+            self.queue.save_progress(ISSUE, redmine_issue.id, progress)
+        return full_issue, meta, progress
+
+    def _complete_issue(self, redmine_issue, full_issue, meta, progress):
+        """ Posts the notes of a posted issue and closes it, where a previous try (or run) stopped
+
+        :return: the created issue
+        """
+        created_issue = progress['issue']
+        for note_data, note_meta in meta['notes'][progress['notes']:]:
+            note = self.gitlab.post_note(created_issue, note_data)
+            if note_meta['journal_id'] is not None:
+                self.ledger.record(NOTE, note_meta['journal_id'], note.get('id'))
+            progress['notes'] += 1
+            self.queue.save_progress(ISSUE, redmine_issue.id, progress)
+        if meta['must_close'] and not progress['closed']:
+            self.gitlab.close_issue(created_issue)
+            progress['closed'] = True
+            self.queue.save_progress(ISSUE, redmine_issue.id, progress)
+
+        full_issue['gitlab_id'] = created_issue['iid']
+        self.cache.load_issue(full_issue)
+        redmine_issue.gitlab_id = created_issue['iid']
+        self.queue.done(ISSUE, redmine_issue.id)
+        return created_issue
 
 
 class IssuesWithId(Issues):
@@ -426,15 +762,149 @@ class IssuesWithId(Issues):
         # noinspection PyCompatibility
         super().__init__(config, args)
 
-    def _convert_issues(self):
-        return [
-            convert_issue(redmine_issue,
-                          self.redmine_users_index,
-                          self.attachments_index,
-                          self.gitlab_id,
-                          self.gitlab_users_index,
-                          self.milestones_index,
-                          with_id=True) for redmine_issue in self.redmine_issues]
+    @property
+    def ordered(self):
+        # the iid command gives issues their redmine id as iid whatever the creation order
+        return not self.args.any_order
+
+    def _convert_issue(self, redmine_issue):
+        return convert_issue(redmine_issue,
+                             self.redmine_users_index,
+                             self.attachments_index,
+                             self.gitlab_id,
+                             self.gitlab_users_index,
+                             self.milestones_index,
+                             with_id=True,
+                             notes_group_by=self.args.merge_notes)
+
+
+class Migrate(Issues):
+    """Migrate milestones, attachments, issues and issue links in a single run"""
+
+    def __init__(self, config, args):
+        # noinspection PyCompatibility
+        super().__init__(config, args)
+        self.redmine_versions = self.redmine.get_versions()
+        log.info('Got {} version(s) from redmine.'.format(len(self.redmine_versions)))
+
+        self.uploader = AttachmentUploader(
+            self.gitlab, self.cache, self.config.cache_dir, workers=self.args.workers,
+            link_above=None if self.args.link_above is None else self.args.link_above * MB)
+        self.linker = IssueLinker(self.gitlab, RelationCheckpoint(self.config.cache_dir))
+        # converted issues, by redmine id, from their posting to their completion
+        self._posted = {}
+
+    # work queue kind of the items of each kind of task
+    QUEUE_KINDS = {MILESTONE: MILESTONE, ATTACHMENT: ATTACHMENT, ISSUE: ISSUE, 'notes': ISSUE}
+
+    def checks(self):
+        # issues already migrated are skipped, so that the command can be run again
+        return [(self.check_users, 'Required users presence')]
+
+    def execute(self):
+        graph = self.task_graph()
+        counts = {}
+        for kind, _id in graph.tasks:
+            counts[kind] = counts.get(kind, 0) + 1
+        log.info('{} task(s) to run: {}'.format(len(graph), ', '.join(
+            '{} {}'.format(count, kind) for kind, count in sorted(counts.items()))))
+        if self.args.check:
+            return
+
+        for kind in (MILESTONE, ATTACHMENT, ISSUE):
+            self.queue.add(kind, [_id for task_kind, _id in graph.tasks if task_kind == kind])
+        failed = {}
+        try:
+            for (kind, _id), result, error in graph.run(self.args.workers):
+                if isinstance(error, CommandError):
+                    raise error
+                if error is not None:
+                    log.error('Could not {} {}: {}'.format(kind, _id, error))
+                    failed.setdefault(kind, []).append(_id)
+                    if kind in self.QUEUE_KINDS:
+                        self.queue.fail(self.QUEUE_KINDS[kind], _id, error)
+                else:
+                    log.debug('Done {} {}'.format(kind, _id))
+        finally:
+            self.uploader.index.save()
+        log.info('Done: {}'.format(', '.join('{} {} ({} failed)'.format(
+            count - len(failed.get(kind, [])), kind, len(failed.get(kind, [])))
+            for kind, count in sorted(counts.items()))))
+        for kind in (MILESTONE, ATTACHMENT, ISSUE):
+            self.queue.log_failures(kind, failed.get(kind, []) + (failed.get('notes', []) if kind == ISSUE else []))
+
+    def task_graph(self):
+        """ Returns the tasks of the migration, with their prerequisites
+
+        Tasks are keyed by couples: kind, redmine id. A milestone (unless it
+        already exists, or is only left to close) and each attachment (unless
+        already uploaded) are created by a task. Issues done by a previous run are skipped, others
+        are resumed where they stopped. An issue is posted once its milestone and
+        attachments are, and after the previous issue, so that iids follow
+        redmine ids; its notes are posted (and it is closed) by another task,
+        so that the next issue does not wait for them. A link is created once
+        both its issues are.
+        """
+        graph = TaskGraph()
+
+        version_ids = {}
+        for redmine_version in self.redmine_versions:
+            data, meta = convert_version(redmine_version)
+            version_ids[data['title']] = redmine_version['id']
+            if self.milestone_pending(redmine_version, data, meta):
+                graph.add((MILESTONE, redmine_version['id']),
+                          partial(self.migrate_milestone, redmine_version, data, meta))
+
+        previous = None
+        for redmine_issue in self.redmine_issues:
+            state = self.queue.get(ISSUE, redmine_issue.id)
+            # issues migrated by another command, before the work queue, are known from the snapshot
+            if (state['state'] == DONE) if state else redmine_issue.id in self.snapshot.issues_by_redmine_id:
+                continue
+            requires = []
+            if redmine_issue.fixed_version in version_ids:
+                requires.append((MILESTONE, version_ids[redmine_issue.fixed_version]))
+            for attachment_id in redmine_issue.attachment_ids:
+                attachment = self.attachments_index[attachment_id]
+                key = (ATTACHMENT, attachment_id)
+                if not is_uploaded(attachment, self.gitlab_id) and key not in graph:
+                    graph.add(key, partial(self._upload_task, convert_attachment(self.gitlab_id, attachment)))
+                requires.append(key)
+            key = (ISSUE, redmine_issue.id)
+            graph.add(key, partial(self._post_issue_task, redmine_issue), requires=requires,
+                      after=[previous] if previous else [])
+            graph.add(('notes', redmine_issue.id), partial(self._complete_issue_task, redmine_issue), requires=[key])
+            previous = key
+
+        redmine_ids = set(i.id for i in self.redmine_issues)
+        for link in iter_links(self.redmine, sorted(redmine_ids)):
+            if link not in self.linker.checkpoint and link[0] in redmine_ids and link[1] in redmine_ids:
+                graph.add(('link', link), partial(self._link_task, link),
+                          requires=[(ISSUE, link[0]), (ISSUE, link[1])])
+        return graph
+
+    def _upload_task(self, data):
+        self.queue.start(ATTACHMENT, data['redmine']['id'])
+        upload = self.uploader.upload_one(data)
+        if upload is not None:
+            self.ledger.record(ATTACHMENT, data['redmine']['id'], url=upload['url'])
+        self.queue.done(ATTACHMENT, data['redmine']['id'])
+        return upload
+
+    def _post_issue_task(self, redmine_issue):
+        full_issue, meta, progress = self._posted[redmine_issue.id] = self._post_issue(redmine_issue)
+        return progress['issue']
+
+    def _complete_issue_task(self, redmine_issue):
+        return self._complete_issue(redmine_issue, *self._posted.pop(redmine_issue.id))
+
+    def _link_task(self, link):
+        return self.linker.link(self._iid(link[0]), self._iid(link[1]), link)
+
+    def _iid(self, redmine_id):
+        iid = self.ledger.gitlab_id(ISSUE, redmine_id)
+        # issues migrated before the ledger are known from the snapshot
+        return iid if iid is not None else self.snapshot.issues_by_redmine_id[redmine_id]['iid']
 
 
 class Iid(Command):
@@ -444,6 +914,7 @@ class Iid(Command):
         self.redmine = self.redmine_project_with_cache()
         self.gitlab = self.gitlab_project()
         self.cache = self.redmine_cache(self.redmine)
+        self.ledger = self.migration_ledger()
 
     def execute(self):
 
@@ -472,21 +943,91 @@ class Iid(Command):
                 "you already migrated iid or you haven't migrated issues yet.")
             exit(1)
 
+        collisions = sql.parse_rows(sql.run_query(sql.FIND_IID_COLLISIONS.format(
+            regex=regex_saved_iid, project_id=gitlab_project_id)))
+        if collisions:
+            for iid, title in collisions:
+                log.error('Issue #{} "{}" collides with a migrated issue'.format(iid, title))
+            raise CommandError('{} issue(s) hold iids needed by migrated issues, or were migrated twice: '
+                               'delete them and run again'.format(len(collisions)))
+
         if not self.args.check:
             sql_cmd = sql.MIGRATE_IID_ISSUES.format(
                 regex=regex_saved_iid, project_id=gitlab_project_id)
+            marked = [redmine_id for redmine_id, issue in self.snapshot.issues_by_redmine_id.items()
+                      if REGEX_TITLE_MARKER.match(issue['title'])]
             out = sql.run_query(sql_cmd)
             log.info(out)
-            try:
-                m = re.match(
-                    r'\s*(\d+)\s*', output,
-                    re.DOTALL | re.MULTILINE)
-                migrated_count = int(m.group(1))
-                log.info('Migrated successfully iid for {} issues'.format(
-                    migrated_count))
-            except (IndexError, AttributeError):
+            # titles and iids were changed behind the API, without touching updated_at
+            self.snapshot.clear_issues()
+            counts = sql.parse_update_counts(out)
+            if len(counts) < 2:
                 raise ValueError(
-                    'Invalid output from postgres command: "{}"'.format(output))
+                    'Invalid output from postgres command: "{}"'.format(out))
+            log.info('Migrated successfully iid for {} issues'.format(counts[1]))
+            self.verify(marked)
+
+    def verify(self, redmine_ids):
+        """ Checks, through the API, that the given migrated issues have their redmine id as iid and no title marker
+        """
+        self.snapshot.refresh(self.gitlab)
+        wrong = []
+        for redmine_id in sorted(redmine_ids):
+            issue = self.snapshot.issues_by_redmine_id.get(redmine_id)
+            if issue is None or issue['iid'] != redmine_id or REGEX_TITLE_MARKER.match(issue['title']):
+                log.error('Redmine issue {} was not migrated to the expected iid: {}'.format(redmine_id, issue))
+                wrong.append(redmine_id)
+        if wrong:
+            raise CommandError('{} issue(s) do not have the expected iid or title'.format(len(wrong)))
+        for redmine_id in redmine_ids:
+            issue = self.snapshot.issues_by_redmine_id[redmine_id]
+            self.ledger.record(ISSUE, redmine_id, issue['iid'], issue.get('web_url'))
+        log.info('Checked iid of {} issue(s)'.format(len(redmine_ids)))
+
+
+class Relations(Command):
+    """Link gitlab issues as their redmine issues are related (once issues are created)"""
+
+    def __init__(self, config, args):
+        # noinspection PyCompatibility
+        super().__init__(config, args)
+        self.redmine = self.redmine_project_with_cache()
+        self.gitlab = self.gitlab_project()
+        self.ledger = self.migration_ledger()
+        self.checkpoint = RelationCheckpoint(self.config.cache_dir)
+        self.linker = IssueLinker(self.gitlab, self.checkpoint)
+
+    def execute(self):
+        # the snapshot knows the issues migrated before the ledger, the ledger is kept up to date by the iid command
+        iids = {redmine_id: i['iid'] for redmine_id, i in self.snapshot.issues_by_redmine_id.items()}
+        iids.update(self.ledger.mapping(ISSUE))
+        log.info('Got {} migrated issue(s).'.format(len(iids)))
+
+        links = []
+        unmapped_count = 0
+        for link in iter_links(self.redmine, sorted(iids)):
+            if link in self.checkpoint:
+                continue
+            if link[0] not in iids or link[1] not in iids:
+                log.debug('Relation {} {} #{} is not between migrated issues'.format(link[0], link[2], link[1]))
+                unmapped_count += 1
+                continue
+            links.append((iids[link[0]], iids[link[1]], link))
+        log.info('{} link(s) to create, {} already created, {} with an issue out of the project'.format(
+            len(links), len(self.checkpoint), unmapped_count))
+
+        if self.args.check:
+            for iid, target_iid, link in links:
+                log.info('Would link #{} {} #{}'.format(iid, link[2], target_iid))
+            return
+
+        failed_count = 0
+        for (iid, target_iid, link), result, error in run_concurrently(
+                lambda i: self.linker.link(*i), links, self.args.workers):
+            if error is not None:
+                log.error('Could not link #{} {} #{}: {}'.format(iid, link[2], target_iid, error))
+                failed_count += 1
+        log.info('{} link(s) created, {} failed'.format(len(links) - failed_count, failed_count))
 
 
 class DeleteIssues(Command):
@@ -494,71 +1035,238 @@ class DeleteIssues(Command):
         # noinspection PyCompatibility
         super().__init__(config, args)
         self.gitlab = self.gitlab_project()
+        # without a redmine cache (init not run), no issue was migrated, there is nothing to forget
+        if os.path.exists(os.path.join(self.config.cache_dir, 'project.json')):
+            self.redmine = self.redmine_project_with_cache()
+            self.cache = self.redmine_cache(self.redmine)
+            self.queue = self.work_queue()
+            self.ledger = self.migration_ledger()
 
     def execute(self):
         log.info('Start {}'.format(self))
 
-        gitlab_issues = self.gitlab.get_issues()
+        gitlab_issues = list(self.snapshot.issues_by_iid.values())
         log.info('Got {} issue(s) from gitlab.'.format(len(gitlab_issues)))
+        redmine_ids = set(i.id for i in self.redmine.get_issue_records()) if self.redmine else set()
+
+        for issue, result, error in run_concurrently(
+                lambda i: self.gitlab.delete_issue(i['iid']), gitlab_issues, self.args.workers):
+            if error is not None:
+                log.error('Could not delete issue {}: {}'.format(issue['iid'], error))
+                continue
+            log.info('delete issue {}'.format(issue['iid']))
+            self.snapshot.forget_issue(issue['iid'])
+            redmine_id = self.ledger.redmine_id(ISSUE, issue['iid']) if self.ledger else None
+            if redmine_id is None:
+                redmine_id = issue.get('redmine_id')
+            if redmine_id in redmine_ids:
+                self.forget_issue(redmine_id)
 
-        for issue in gitlab_issues:
-            log.info('delete issue {}'.format(issue['id']))
-            self.gitlab.delete_issue(issue['id'])
 
+class Rollback(Command):
+    """Delete the issues and milestones created by this tool in the gitlab project"""
 
-class LinkRedmineRoadmap(Command):
     def __init__(self, config, args):
         # noinspection PyCompatibility
         super().__init__(config, args)
         self.redmine = self.redmine_project_with_cache()
         self.gitlab = self.gitlab_project()
         self.cache = self.redmine_cache(self.redmine)
+        self.queue = self.work_queue()
+        self.ledger = self.migration_ledger()
 
     def execute(self):
-        log.info('Start {}'.format(self))
-
-        redmine_versions = self.redmine.get_versions()
-        log.info('Got {} version(s) from redmine.'.format(len(redmine_versions)))
+        issues = self.created_issues()
+        versions = self.created_milestones()
 
-        gitlab_milestones = self.gitlab.get_milestones()
-        log.info('Got {} milestone(s) from gitlab.'.format(len(gitlab_milestones)))
-        gitlab_milestones_index = {i['title']: i for i in gitlab_milestones}
-
-        for redmine_version in redmine_versions:
+        if self.args.check:
+            log.info('Would delete {} issue(s) and {} milestone(s)'.format(len(issues), len(versions)))
+            return
 
-            name = redmine_version['name']
-            gitlab_milestone = gitlab_milestones_index[name]
-            log.debug(gitlab_milestone)
-            gitlab_milestone_iid = gitlab_milestone['iid']
-            self.redmine.link_roadmap(redmine_version, gitlab_milestone_iid, self.gitlab.project_url, self.cache)
-
-            redmine_version_id = redmine_version['id']
-            json_file_path = self.cache.get_version2_path(redmine_version_id)
-
-            action = ['curl', '-v', '-X', 'PUT',
-                      '-H', 'Content-Type: application/json',
-                      '-H', 'X-Redmine-API-Key:{}'.format(self.config.redmine_key),
-                      '--data-binary', '@{}'.format(json_file_path),
-                      '{}/versions/{}.json'.format(self.config.redmine_host, redmine_version_id)]
-            if self.args.check:
-                log.info(
-                    'Would link redmine version {} ({}) to gitlab milestone {}'.format(redmine_version_id, name,
-                                                                                       gitlab_milestone_iid))
-                log.info('using command: {}'.format(action))
-            else:
-                log.info('Link redmine version {} ({}) to gitlab milestone {}'.format(redmine_version_id, name,
-                                                                                      gitlab_milestone_iid))
-                log.debug('using command: {}'.format(action))
-                subprocess.run(action, stdout=subprocess.PIPE)
+        limiter = RateLimiter(self.args.rate)
+
+        deleted_count = 0
+        kept_ids = set()
+        delete_issue = limiter.limited(self.gitlab.delete_issue)
+        for (redmine_id, issue), result, error in run_concurrently(
+                lambda i: delete_issue(i[1]['iid']), issues, self.args.workers):
+            if error is not None:
+                log.error('Could not delete issue {} (was: {}): {}'.format(issue['iid'], redmine_id, error))
+                kept_ids.add(redmine_id)
+                continue
+            self.snapshot.forget_issue(issue['iid'])
+            deleted_count += 1
+        # an issue is migrated again once all its gitlab issues are deleted
+        for redmine_id in set(i[0] for i in issues) - kept_ids:
+            self.forget_issue(redmine_id)
+        log.info('{} issue(s) deleted'.format(deleted_count))
+
+        deleted_count = 0
+        delete_milestone = limiter.limited(self.gitlab.delete_milestone)
+        for (version, milestone_id), result, error in run_concurrently(
+                lambda i: delete_milestone(i[1]), versions, self.args.workers):
+            if error is not None:
+                log.error('Could not delete milestone {} (was: {}): {}'.format(milestone_id, version['id'], error))
+                continue
+            self.snapshot.forget_milestone(milestone_id)
+            self.queue.forget(MILESTONE, version['id'])
+            self.ledger.forget(MILESTONE, version['id'])
+            if version.pop('gitlab_id', None) is not None:
+                self.cache.load_version(version)
+            deleted_count += 1
+        log.info('{} milestone(s) deleted'.format(deleted_count))
+
+    def created_issues(self):
+        """ Returns the gitlab issues created by this tool, as couples: redmine id, gitlab issue
+
+        Issues are those recorded in the ledger, or, when migrated before the
+        ledger, in the redmine cache (if the gitlab issue still carries their
+        redmine id). Other gitlab issues carrying the redmine id of a migrated
+        issue (see GitlabSnapshot) may be duplicates created by this tool, or
+        issues quoting it: they are only listed, unless
+        ``--delete-duplicates`` is given.
+        """
+        iids = self.ledger.mapping(ISSUE)
+        migrated_ids = set(iids)
+        for record in self.redmine.get_issue_records():
+            if record.gitlab_id is None or record.id in iids:
+                continue
+            migrated_ids.add(record.id)
+            issue = self.snapshot.issues_by_iid.get(record.gitlab_id)
+            # the iid of the cache may be outdated, once moved by the iid command
+            if issue is not None and issue['redmine_id'] == record.id:
+                iids[record.id] = record.gitlab_id
+        issues = [(redmine_id, self.snapshot.issues_by_iid[iid]) for redmine_id, iid in iids.items()
+                  if iid in self.snapshot.issues_by_iid]
+
+        selected = set(i[1]['iid'] for i in issues)
+        duplicates = [(issue['redmine_id'], issue) for iid, issue in self.snapshot.issues_by_iid.items()
+                      if issue['redmine_id'] in migrated_ids and iid not in selected]
+        for redmine_id, issue in duplicates:
+            log.warning('Gitlab issue {} mentions migrated redmine issue {}, {}'.format(
+                issue['iid'], redmine_id, 'delete it' if self.args.delete_duplicates else 'check it by hand'))
+        if self.args.delete_duplicates:
+            issues += duplicates
+        return issues
+
+    def created_milestones(self):
+        """ Returns the gitlab milestones created by this tool, as couples: redmine version, gitlab milestone id
+
+        Milestones are those recorded in the ledger, or, when created before
+        the ledger, in the redmine cache.
+        """
+        milestone_ids = self.ledger.mapping(MILESTONE)
+        versions = []
+        for version in self.redmine.get_versions():
+            milestone_id = milestone_ids.get(version['id'], version.get('gitlab_id'))
+            if milestone_id in self.snapshot.milestones_by_id:
+                versions.append((version, milestone_id))
+        return versions
+
+
+class LinkRedmine(Command):
+    """ Base of the commands adding links to gitlab on redmine, concurrently, each redmine object once
+    """
 
+    # work queue kind of the linked redmine objects
+    kind = None
 
-class LinkRedmineIssue(Command):
     def __init__(self, config, args):
         # noinspection PyCompatibility
         super().__init__(config, args)
         self.redmine = self.redmine_project_with_cache()
         self.gitlab = self.gitlab_project()
         self.cache = self.redmine_cache(self.redmine)
+        self.queue = self.work_queue()
+        self.ledger = self.migration_ledger()
+
+    def link_all(self, links):
+        """ Links redmine objects to gitlab ones, at most ``--rate`` per second, skipping those linked by a previous run
+
+        :param links: list of couples: redmine object, gitlab iid
+        """
+        done_ids = self.queue.done_ids(self.kind)
+        todo = [i for i in links if str(i[0]['id']) not in done_ids]
+        log.info('{} {}(s) to create, {} already created'.format(len(todo), self.kind, len(links) - len(todo)))
+
+        if self.args.check:
+            for redmine_object, gitlab_iid in todo:
+                log.info('Would link redmine {} to gitlab {}'.format(redmine_object['id'], gitlab_iid))
+            return
+
+        self.queue.add(self.kind, [i[0]['id'] for i in todo])
+        link = RateLimiter(self.args.rate).limited(self._link)
+        failed_ids = []
+        for (redmine_object, gitlab_iid), result, error in run_concurrently(lambda i: link(*i), todo,
+                                                                             self.args.workers):
+            if error is not None:
+                log.error('Could not link redmine {} to gitlab {}: {}'.format(redmine_object['id'], gitlab_iid, error))
+                self.queue.fail(self.kind, redmine_object['id'], error)
+                failed_ids.append(redmine_object['id'])
+                continue
+            log.info('Linked redmine {} to gitlab {}'.format(redmine_object['id'], gitlab_iid))
+        log.info('{} {}(s) created'.format(len(todo) - len(failed_ids), self.kind))
+        self.queue.log_failures(self.kind, failed_ids)
+
+    def _link(self, redmine_object, gitlab_iid):
+        state = self.queue.get(self.kind, redmine_object['id'])
+        self.queue.start(self.kind, redmine_object['id'])
+        # a previous attempt may have updated redmine, then failed or been killed before being recorded
+        if state and state['attempts'] and self.is_linked(redmine_object, gitlab_iid):
+            log.info('Redmine {} was linked by a previous run'.format(redmine_object['id']))
+        else:
+            self.link(redmine_object, gitlab_iid)
+        self.queue.done(self.kind, redmine_object['id'])
+
+    def link(self, redmine_object, gitlab_iid):
+        """ Method to be overloaded by child classes
+
+        Adds a link to the gitlab object of iid ``gitlab_iid`` on a redmine object.
+        """
+
+    def is_linked(self, redmine_object, gitlab_iid):
+        """ Whether redmine already links to gitlab, checked only for objects attempted by a previous run
+
+        Linking again must then be harmless unless overloaded.
+        """
+        return False
+
+
+class LinkRedmineRoadmap(LinkRedmine):
+    """Add a link to its gitlab milestone to the description of each redmine version"""
+
+    kind = VERSION_LINK
+
+    def execute(self):
+        log.info('Start {}'.format(self))
+
+        redmine_versions = self.redmine.get_versions()
+        log.info('Got {} version(s) from redmine.'.format(len(redmine_versions)))
+
+        milestone_ids = self.ledger.mapping(MILESTONE)
+        log.info('Got {} migrated milestone(s).'.format(len(milestone_ids)))
+
+        links = []
+        for redmine_version in redmine_versions:
+            name = redmine_version['name']
+            # milestones created before the ledger are found by title
+            gitlab_milestone = self.snapshot.milestones_by_id.get(milestone_ids.get(redmine_version['id'])) or \
+                self.snapshot.milestones_by_title.get(name)
+            if gitlab_milestone is None:
+                log.warning('Redmine version {} ({}) was not migrated'.format(redmine_version['id'], name))
+                continue
+            links.append((redmine_version, gitlab_milestone['iid']))
+        self.link_all(links)
+
+    def link(self, redmine_version, gitlab_iid):
+        if self.redmine.link_roadmap(redmine_version, gitlab_iid, self.gitlab.project_url):
+            self.cache.load_version(redmine_version)
+
+
+class LinkRedmineIssue(LinkRedmine):
+    """Add a note with a link to its gitlab issue to each redmine issue"""
+
+    kind = ISSUE_LINK
 
     def execute(self):
         log.info('Start {}'.format(self))
@@ -567,29 +1275,120 @@ class LinkRedmineIssue(Command):
 
         log.info('Got {} issue(s) from redmine.'.format(len(redmine_issues)))
 
-        gitlab_issues = self.gitlab.get_issues()
-        gitlab_issues_index = {i['title']: i for i in gitlab_issues}
+        # issues migrated before the ledger are known from the snapshot
+        iids = {redmine_id: i['iid'] for redmine_id, i in self.snapshot.issues_by_redmine_id.items()}
+        iids.update(self.ledger.mapping(ISSUE))
 
-        log.info('Got {} issue(s) from gitlab.'.format(len(gitlab_issues)))
+        log.info('Got {} migrated issue(s).'.format(len(iids)))
 
+        links = []
         for redmine_issue in redmine_issues:
-            subject = redmine_issue['subject'].strip()
-            gitlab_issue = gitlab_issues_index[subject]
-            redmine_issue_id = redmine_issue['id']
-            self.redmine.link_issue(redmine_issue, gitlab_issue['iid'], self.gitlab.project_url, self.cache)
-
-            json_file_path = self.cache.get_issue2_path(redmine_issue_id)
-
-            action = ['curl', '-X', 'PUT',
-                      '-H', 'Content-Type: application/json',
-                      '-H', 'X-Redmine-API-Key:{}'.format(self.config.redmine_key),
-                      '--data-binary', '@{}'.format(json_file_path),
-                      '{}/issues/{}.json'.format(self.config.redmine_host, redmine_issue_id)]
-            if self.args.check:
-                log.info(
-                    'Would link redmine issue {} ({}) to {}'.format(redmine_issue_id, subject, gitlab_issue['iid']))
-                log.info('using command: {}'.format(action))
-            else:
-                log.info('Link redmine issue {} ({}) to {}'.format(redmine_issue_id, subject, gitlab_issue['iid']))
-                log.debug('using command: {}'.format(action))
-                subprocess.run(action, shell=True, check=True)
+            if redmine_issue['id'] not in iids:
+                log.warning('Redmine issue {} ({}) was not migrated'.format(redmine_issue['id'],
+                                                                             redmine_issue['subject'].strip()))
+                continue
+            links.append((redmine_issue, iids[redmine_issue['id']]))
+        self.link_all(links)
+
+    def link(self, redmine_issue, gitlab_iid):
+        self.redmine.link_issue(redmine_issue, gitlab_iid, self.gitlab.project_url)
+
+    def is_linked(self, redmine_issue, gitlab_iid):
+        # each link adds a note, unlike versions whose description is set again from the cache
+        return self.redmine.is_issue_linked(redmine_issue, self.gitlab.project_url)
+
+
+# options of the batch command given to the command of each step
+BATCH_OPTIONS = ('check', 'debug', 'jobs', 'durability', 'users_cache', 'users_cache_ttl', 'graphql', 'workers')
+
+
+def init_batch_worker(limiters):
+    """ Starts a process of a batch, with the request limiters shared by all the processes, by host
+    """
+    for host, limiter in limiters.items():
+        limit_host(host, limiter)
+
+
+def migrate_project(item):
+    """ Runs the steps of the migration of a project, from a process of a batch
+
+    The log of the project is also written to migration.log, in its directory.
+
+    :param item: quadruple: project name, project directory, steps, dict of options (see ``BATCH_OPTIONS``)
+    :return: the status of the project (see ``project_status``)
+    """
+    name, path, steps, options = item
+    handler = logging.FileHandler(os.path.join(path, BATCH_LOG_FILE))
+    handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s: %(message)s'))
+    package_log = logging.getLogger('migrate_redmine_to_gitlab')
+    package_log.addHandler(handler)
+    start = time.time()
+    config = None
+    step = None
+    error = None
+    try:
+        config = MigrationConfig(path)
+        for step in steps:
+            args = build_parser().parse_args([step, '--path', path])
+            vars(args).update(options)
+            args.command(config, args).run()
+    except SystemExit:
+        # a check failed
+        error = 'check failed, see {}'.format(os.path.join(path, BATCH_LOG_FILE))
+    except Exception as e:
+        log.error('Project {} failed at step {}: {}'.format(name, step, e))
+        error = e
+    finally:
+        package_log.removeHandler(handler)
+        handler.close()
+
+    failed_items = 0
+    objects = ''
+    if config is not None:
+        queue = WorkQueue(config.cache_dir)
+        failed_items = sum(queue.counts(kind).get(FAILED, 0) for kind in (MILESTONE, ATTACHMENT, ISSUE))
+        queue.close()
+        ledger = Ledger(config.cache_dir)
+        objects = ledger.summary()
+        ledger.close()
+    if error is not None:
+        status = PROJECT_FAILED
+    elif failed_items:
+        status = PROJECT_INCOMPLETE
+    else:
+        status = PROJECT_DONE
+    return project_status(name, status, step, time.time() - start, failed_items, objects, error)
+
+
+class Batch(Command):
+    """Migrate the projects listed in batch.json, several at once"""
+
+    def execute(self):
+        projects = self.config.projects
+        options = {i: getattr(self.args, i) for i in BATCH_OPTIONS}
+        if options['jobs'] is None:
+            # projects are already migrated in parallel
+            options['jobs'] = 1
+
+        limiters = {}
+        for hosts, rate in ((self.config.redmine_hosts, self.args.redmine_rate),
+                            (self.config.gitlab_hosts, self.args.gitlab_rate)):
+            if rate:
+                limiters.update((urlparse(i).netloc, SharedRateLimiter(rate)) for i in hosts)
+
+        log.info('Migrate {} project(s), {} at once, steps: {}'.format(
+            len(projects), self.args.processes, ', '.join(self.args.steps)))
+        statuses = {}
+        items = [(name, path, self.args.steps, options) for name, path in projects]
+        for (name, path, steps, options), status, error in run_processes(
+                migrate_project, items, self.args.processes, init_batch_worker, (limiters,)):
+            if error is not None:
+                # the process died
+                status = project_status(name, PROJECT_FAILED, error=error)
+            statuses[name] = status
+            log.info('[{}/{}] Project {}: {}'.format(len(statuses), len(projects), name, status['status']))
+
+        print(format_status_table([statuses[name] for name, path in projects]))
+        not_done = [name for name, status in statuses.items() if status['status'] != PROJECT_DONE]
+        if not_done:
+            raise CommandError('{} project(s) not fully migrated, run the batch again'.format(len(not_done)))
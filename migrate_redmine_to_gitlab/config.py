@@ -7,14 +7,21 @@ import json
 log = logging.getLogger(__name__)
 
 
+CONFIG_FILE = 'config.json'
+BATCH_CONFIG_FILE = 'batch.json'
+
+
+def _load(path, config_file):
+    config_path = os.path.join(path, config_file)
+    if not os.path.exists(config_path):
+        raise FileNotFoundError
+    with open(config_path, 'r') as outfile:
+        return json.load(outfile)
+
+
 class MigrationConfig:
     def __init__(self, path):
-        config_file = 'config.json'
-        config_path = os.path.join(path, config_file)
-        if not os.path.exists(config_path):
-            raise FileNotFoundError
-        with open(config_path, 'r') as outfile:
-            data = json.load(outfile)
+        data = _load(path, CONFIG_FILE)
         log.debug('config: {}'.format(data))
         self.redmine_host = data['redmine']['host']
         self.redmine_project_url = self.redmine_host + '/' + data['redmine']['path']
@@ -26,3 +33,64 @@ class MigrationConfig:
         if not os.path.exists(self.cache_dir):
             os.makedirs(self.cache_dir)
             log.info('Create cache dir: {}'.format(self.cache_dir))
+
+
+class BatchConfig:
+    """ Migrations of many projects, from a batch.json file listing couples of redmine and gitlab projects
+
+    Hosts and keys are given once, under ``redmine`` and ``gitlab`` (a
+    project may override them). Each project is migrated in its own
+    directory, named after the project (or its ``name``), where its
+    config.json is written, so that the usual commands can be run on it.
+
+    ::
+
+        {
+          "redmine": { "host": "https://forge.codelutin.com", "key": "XXX" },
+          "gitlab": { "host": "https://gitlab.com", "key": "XXX" },
+          "projects": [
+            { "redmine": "projects/observe", "gitlab": "ultreia.io/ird-observe" },
+            { "redmine": "projects/t3", "gitlab": "ultreia.io/t3", "name": "t3-legacy" }
+          ]
+        }
+
+    :param path: the batch directory
+    """
+
+    def __init__(self, path):
+        data = _load(path, BATCH_CONFIG_FILE)
+        self.path = path
+        # couples: project name, project directory
+        self.projects = []
+        self.redmine_hosts = set()
+        self.gitlab_hosts = set()
+        names = set()
+        for project in data['projects']:
+            project_data = {}
+            for side in ('redmine', 'gitlab'):
+                value = project[side]
+                project_data[side] = dict(data.get(side, {}), **(value if isinstance(value, dict) else {'path': value}))
+            name = project.get('name') or project_data['redmine']['path'].strip('/').split('/')[-1]
+            if name in names:
+                raise ValueError('Project {} is listed twice in {}, give them a distinct name'.format(
+                    name, BATCH_CONFIG_FILE))
+            names.add(name)
+            project_path = os.path.join(path, name)
+            self._write_project_config(project_path, project_data)
+            self.projects.append((name, project_path))
+            self.redmine_hosts.add(project_data['redmine']['host'])
+            self.gitlab_hosts.add(project_data['gitlab']['host'])
+        log.debug('batch config: {} project(s)'.format(len(self.projects)))
+
+    @staticmethod
+    def _write_project_config(project_path, project_data):
+        if not os.path.exists(project_path):
+            os.makedirs(project_path)
+            log.info('Create project dir: {}'.format(project_path))
+        config_path = os.path.join(project_path, CONFIG_FILE)
+        if os.path.exists(config_path):
+            with open(config_path, 'r') as infile:
+                if json.load(infile) == project_data:
+                    return
+        with open(config_path, 'w') as outfile:
+            json.dump(project_data, outfile, indent=2)
@@ -2,6 +2,11 @@ import logging
 
 log = logging.getLogger(__name__)
 
+NOTES_BY_AUTHOR = 'author'
+NOTES_SEPARATOR = '\n\n---\n\n'
+# gitlab rejects notes longer than 1,000,000 characters
+NOTE_MAX_SIZE = 1000000
+
 
 def redmine_uid_to_login(redmine_id, redmine_user_index):
     return redmine_user_index[redmine_id]['login']
@@ -9,29 +14,24 @@ def redmine_uid_to_login(redmine_id, redmine_user_index):
 
 def redmine_uid_to_gitlab_uid(redmine_id,
                               redmine_user_index, gitlab_user_index):
+    """ Returns the gitlab user id of a redmine user, matched by login
+
+    :param gitlab_user_index: gitlab users by username, either a dict or a
+        :class:`GitlabUserResolver`
+    """
     username = redmine_uid_to_login(redmine_id, redmine_user_index)
     return gitlab_user_index[username]['id']
 
 
-def convert_notes(redmine_issue_journals, redmine_user_index):
-    """ Convert a list of redmine journal entries to gitlab notes
-
-    Filters out the empty notes (ex: bare status change)
-    Adds metadata as comment
-
-    :param redmine_issue_journals: list of redmine "journals"
-    :param redmine_user_index: dictionary of redmine users
-    :return: yielded couple ``data``, ``meta``. ``data`` is the API payload for
-        an issue note and meta a dict (containing, at the moment, only a "sudo_user" key).
+def _kept_journals(redmine_issue_journals, redmine_user_index):
+    """ Yields the non-empty journal entries, as tuples ``notes``, ``created_on``, ``author`` (login or None),
+    ``journal_id``
     """
-
     for entry in redmine_issue_journals:
         journal_notes = entry.get('notes', '')
         if not 'Migrated to https' in journal_notes \
                 and not 'Moved to https' in journal_notes \
                 and len(journal_notes) > 0:
-            body = "{}\n\n*(from redmine: written on {})*".format(
-                journal_notes, entry['created_on'][:10])
             try:
                 author = redmine_uid_to_login(
                     entry['user']['id'], redmine_user_index)
@@ -42,7 +42,71 @@ def convert_notes(redmine_issue_journals, redmine_user_index):
                     'Redmine user {} is unknown, attribute note '
                     'to current admin\n'.format(entry['user']))
                 author = None
-            yield {'body': body}, {'sudo_user': author}
+            yield journal_notes, entry['created_on'], author, entry.get('id')
+
+
+def _note_text(journal_notes, created_on, author=None, with_author=False):
+    if with_author:
+        return "{}\n\n*(from redmine: written on {} by {})*".format(
+            journal_notes, created_on[:10], author or 'anonymous')
+    return "{}\n\n*(from redmine: written on {})*".format(journal_notes, created_on[:10])
+
+
+def _consolidate(journals, group_by, max_size):
+    """ Splits journal entries into groups, each group becoming one note
+    """
+    group = []
+    size = 0
+    for journal in journals:
+        # the "by ..." footer may be added, count it
+        journal_size = len(_note_text(*journal[:3], with_author=True)) + len(NOTES_SEPARATOR)
+        if group and (
+                (group_by == NOTES_BY_AUTHOR and journal[2] != group[-1][2]) or
+                (isinstance(group_by, int) and len(group) >= group_by) or
+                size + journal_size > max_size):
+            yield group
+            group = []
+            size = 0
+        group.append(journal)
+        size += journal_size
+    if group:
+        yield group
+
+
+def convert_notes(redmine_issue_journals, redmine_user_index, group_by=None, max_size=NOTE_MAX_SIZE):
+    """ Convert a list of redmine journal entries to gitlab notes
+
+    Filters out the empty notes (ex: bare status change)
+    Adds metadata as comment
+
+    Journal entries may be merged, to post fewer notes: ``group_by`` is
+    either :data:`NOTES_BY_AUTHOR`, to merge consecutive entries of a same
+    author, or a number of entries per note. A merged note does not exceed
+    ``max_size`` characters, unless a single entry does. When its entries
+    have several authors, a merged note is posted by the current admin and
+    names the author of each entry.
+
+    :param redmine_issue_journals: list of redmine "journals"
+    :param redmine_user_index: dictionary of redmine users
+    :param group_by: how to merge entries (default: one note per entry)
+    :param max_size: maximum size of a merged note body
+    :return: yielded couple ``data``, ``meta``. ``data`` is the API payload for
+        an issue note and meta a dict with "sudo_user", "created_on" and
+        "journal_id" (of the first entry) keys.
+    """
+    journals = _kept_journals(redmine_issue_journals, redmine_user_index)
+    if group_by is None:
+        for journal_notes, created_on, author, journal_id in journals:
+            yield {'body': _note_text(journal_notes, created_on)}, {
+                'sudo_user': author, 'created_on': created_on, 'journal_id': journal_id}
+        return
+
+    for group in _consolidate(journals, group_by, max_size):
+        authors = set(i[2] for i in group)
+        single_author = len(authors) == 1
+        body = NOTES_SEPARATOR.join(_note_text(*i[:3], with_author=not single_author) for i in group)
+        yield {'body': body}, {'sudo_user': authors.pop() if single_author else None, 'created_on': group[0][1],
+                               'journal_id': group[0][3]}
 
 
 def relations_to_string(relations, issue_id):
@@ -71,7 +135,8 @@ def convert_issue(redmine_issue,
                   gitlab_project_id,
                   gitlab_user_index,
                   gitlab_milestones_index,
-                  with_id=False):
+                  with_id=False,
+                  notes_group_by=None):
     if redmine_issue.get('closed_on', None):
         # quick'n dirty extract date
         close_text = ', closed on {}'.format(redmine_issue['closed_on'][:10])
@@ -91,10 +156,6 @@ def convert_issue(redmine_issue,
         title = redmine_issue['subject']
 
     labels = 'From Redmine, ' + redmine_issue['tracker']['name'] + ', ' + redmine_issue['priority']['name']
-    
-    #作成日時と有効期限追加
-    created_at = redmine_issue['start_date']
-    due_date = redmine_issue['due_date']
 
     data = {
         'title': title,
@@ -107,11 +168,14 @@ def convert_issue(redmine_issue,
             relations_text
         ),
         'labels': labels,
-        #作成日時と有効期限追加
-        'created_at': closed_at,
-        'due_date': due_date
     }
 
+    #作成日時と有効期限追加
+    if redmine_issue.get('start_date'):
+        data['created_at'] = redmine_issue['start_date']
+    if redmine_issue.get('due_date'):
+        data['due_date'] = redmine_issue['due_date']
+
     version = redmine_issue.get('fixed_version', None)
     if version:
         data['milestone_id'] = gitlab_milestones_index[version['name']]['id']
@@ -133,7 +197,7 @@ def convert_issue(redmine_issue,
 
     meta = {
         'sudo_user': author_login,
-        'notes': list(convert_notes(redmine_issue['journals'], redmine_user_index)),
+        'notes': list(convert_notes(redmine_issue['journals'], redmine_user_index, group_by=notes_group_by)),
         'must_close': closed,
         'attachments': attachments
     }
@@ -178,5 +242,27 @@ def convert_attachments(redmine_issue, redmine_attachments_index, gitlab_project
     return attachments
 
 
+def attachments_to_markdown(attachments):
+    """ Returns the list of files appended to an issue description
+
+    Attachments uploaded to gitlab (with a ``gitlab`` key) link to the
+    upload, the others to redmine.
+
+    :param attachments: list of attachments, as returned by ``convert_attachment``
+    """
+    if len(attachments) == 0:
+        return ''
+    attachment_log = '\n\n### Files'
+    for attachment in attachments:
+        redmine_attachment = attachment['redmine']
+        gitlab_attachment = redmine_attachment.get('gitlab', None)
+        if gitlab_attachment is None:
+            attachment_log += '\n  * [{}]({})'.format(redmine_attachment['filename'],
+                                                       redmine_attachment['content_url'])
+        else:
+            attachment_log += '\n  * [{}]({})'.format(gitlab_attachment['alt'], gitlab_attachment['url'])
+    return attachment_log
+
+
 def convert_attachment(gitlab_project_id, redmine_attachment):
     return {"redmine": redmine_attachment, "request": {"id": gitlab_project_id, "file": redmine_attachment['filename']}}
@@ -1,14 +1,84 @@
 import re
 import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
 from . import APIClient, Project
+from .converters import attachments_to_markdown
+from .multipart import MultipartFileBody
 
 log = logging.getLogger(__name__)
 
+# GraphQL queries for the state read by the migration, with only the fields it uses
+GRAPHQL_ISSUES = """
+query($fullPath: ID!, $first: Int, $after: String, $updatedAfter: Time) {
+  project(fullPath: $fullPath) {
+    issues(first: $first, after: $after, updatedAfter: $updatedAfter) {
+      pageInfo { hasNextPage endCursor }
+      nodes { id iid title description state updatedAt }
+    }
+  }
+}
+"""
+
+GRAPHQL_MILESTONES = """
+query($fullPath: ID!, $first: Int, $after: String) {
+  project(fullPath: $fullPath) {
+    milestones(first: $first, after: $after, includeAncestors: false) {
+      pageInfo { hasNextPage endCursor }
+      nodes { id iid title state updatedAt }
+    }
+  }
+}
+"""
+
+GRAPHQL_MEMBERS = """
+query($fullPath: ID!, $first: Int, $after: String) {
+  project(fullPath: $fullPath) {
+    projectMembers(first: $first, after: $after) {
+      pageInfo { hasNextPage endCursor }
+      nodes { user { id username name state } }
+    }
+  }
+}
+"""
+
+
+# keys of converted data that are not gitlab fields
+LOCAL_FIELDS = ('redmine_id',)
+
+
+def _payload(data):
+    """ Returns the fields of converted data that are sent to gitlab
+    """
+    return {key: value for key, value in data.items() if key not in LOCAL_FIELDS}
+
+
+class GraphQLError(Exception):
+    """ Errors returned by the GraphQL API
+    """
+
+
+def graphql_id(gid):
+    """ Returns the numeric id of a GraphQL global id (ex: gid://gitlab/Issue/43)
+    """
+    return int(gid.rsplit('/', 1)[-1])
+
 
 class GitlabClient(APIClient):
     # see http://doc.gitlab.com/ce/api/#pagination
     MAX_PER_PAGE = 100
 
+    # Number of pages fetched concurrently when the number of pages is known
+    PAGE_WORKERS = 4
+
+    def __init__(self, api_key, page_workers=PAGE_WORKERS, **kwargs):
+        # noinspection PyCompatibility
+        super().__init__(api_key, **kwargs)
+        self.page_workers = page_workers
+
     def get(self, *args, **kwargs):
         # Note that we do not handle pagination, but as we rely on list data
         # only for milestones, we assume that we have < 100 milestones. Could
@@ -21,6 +91,108 @@ class GitlabClient(APIClient):
     def get_auth_headers(self):
         return {"PRIVATE-TOKEN": self.api_key}
 
+    def request_kind(self, url):
+        return 'graphql' if url.endswith('/api/graphql') else 'rest'
+
+    def graphql(self, url, query, variables=None):
+        """ Runs a GraphQL query
+
+        :return: the ``data`` of the response
+        :raise GraphQLError: if the response holds errors
+        """
+        ret = self.post(url, json={'query': query, 'variables': variables or {}})
+        if ret.get('errors'):
+            raise GraphQLError('; '.join(i.get('message', str(i)) for i in ret['errors']))
+        return ret['data']
+
+    def graphql_nodes(self, url, query, path, variables=None):
+        """ Yields all the nodes of a GraphQL connection, following its cursor
+
+        :param path: keys of the connection in the query data (ex: ``('project', 'issues')``)
+        """
+        variables = dict(variables or {}, first=self.MAX_PER_PAGE)
+        while True:
+            connection = self.graphql(url, query, variables)
+            for key in path:
+                if connection is None:
+                    raise GraphQLError('No {} in GraphQL response'.format(key))
+                connection = connection[key]
+            for node in connection['nodes']:
+                yield node
+            if not connection['pageInfo']['hasNextPage']:
+                break
+            variables = dict(variables, after=connection['pageInfo']['endCursor'])
+
+    def get_page(self, url, params=None, per_page=None):
+        """ Gets one page of a list resource
+
+        :return: the response, whose ``headers`` and ``links`` hold pagination data
+        """
+        params = dict(params or {})
+        params['per_page'] = per_page or self.MAX_PER_PAGE
+        return self._request(self.session.get, url, params=params)
+
+    def get_all_pages(self, url, params=None, keyset=False):
+        """ Yields all the objects of a list resource, page after page
+
+        When GitLab gives the number of pages (``X-Total-Pages``), the
+        remaining pages are fetched concurrently, otherwise the ``Link`` (or
+        ``X-Next-Page``) header is followed. No request is made past the last
+        page.
+
+        :param params: query parameters
+        :param keyset: use keyset pagination (only for resources supporting it)
+        """
+        params = dict(params or {})
+        if keyset:
+            params.update({'pagination': 'keyset', 'order_by': 'id', 'sort': 'asc'})
+
+        resp = self.get_page(url, params)
+        yield from resp.json()
+
+        total_pages = resp.headers.get('X-Total-Pages')
+        if total_pages and not keyset:
+            first_page = int(resp.headers.get('X-Page') or 1)
+            yield from self._get_pages_concurrently(url, params, range(first_page + 1, int(total_pages) + 1))
+            return
+
+        # The total is omitted by GitLab for large collections
+        while True:
+            if 'next' in resp.links:
+                resp = self._request(self.session.get, resp.links['next']['url'])
+            elif resp.headers.get('X-Next-Page'):
+                resp = self.get_page(url, dict(params, page=resp.headers['X-Next-Page']))
+            else:
+                return
+            yield from resp.json()
+
+    def _get_pages_concurrently(self, url, params, pages):
+        # Only a window of pages is in flight, so that pages are yielded in
+        # order without holding the whole collection in memory.
+        with ThreadPoolExecutor(max_workers=self.page_workers) as executor:
+            pending = deque()
+            for page in pages:
+                pending.append(executor.submit(lambda p: self.get_page(url, dict(params, page=p)).json(), page))
+                if len(pending) >= 2 * self.page_workers:
+                    yield from pending.popleft().result()
+            while pending:
+                yield from pending.popleft().result()
+
+    def count(self, url, params=None):
+        """ Returns the number of objects of a list resource, fetching a single object
+        """
+        resp = self.get_page(url, params, per_page=1)
+        total = resp.headers.get('X-Total')
+        if total is not None:
+            return int(total)
+        # The total is omitted by GitLab for large collections
+        return sum(1 for _ in self.get_all_pages(url, params))
+
+    def exists(self, url, params=None):
+        """ Returns whether a list resource contains any object, fetching at most one
+        """
+        return len(self.get_page(url, params, per_page=1).json()) > 0
+
     def check_is_admin(self):
         pass
 
@@ -29,73 +201,91 @@ class GitlabProject(Project):
     REGEX_PROJECT_URL = re.compile(
         r'^(?P<base_url>https?://.*/)(?P<namespace>[^/]+)/(?P<project_name>[\w_-]+)$')
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, project=None, use_graphql=False, **kwargs):
+        """
+        :param project: the already known gitlab project (ex: from a snapshot), fetched otherwise
+        :param use_graphql: read issues, milestones and members through GraphQL, falling back to REST
+        """
         # noinspection PyCompatibility
         super().__init__(*args, **kwargs)
         self.api_url0 = ('{base_url}api/v4/projects/{namespace}%2F{project_name}'.format(**self._url_match.groupdict()))
-        self.project = self.get_project()
+        self.project = project or self.get_project()
         self.project_id = str(self.project['id'])
         self.project_url = '{base_url}{namespace}/{project_name}'.format(**self._url_match.groupdict())
         log.info('Go gitlab project {}'.format(self.project_id))
         self.api_url = (('{base_url}api/v4/projects/' + self.project_id).format(**self._url_match.groupdict()))
-        self.instance_url = '{}/api/v4'.format(self._url_match.group('base_url'))
+        self.instance_url = '{}api/v4'.format(self._url_match.group('base_url'))
+        self.graphql_url = '{}api/graphql'.format(self._url_match.group('base_url'))
+        self.full_path = '{namespace}/{project_name}'.format(**self._url_match.groupdict())
+        self.use_graphql = use_graphql
 
     def is_repository_empty(self):
         """ Heuristic to check if repository is empty
         """
         return self.api.get(self.api_url)['default_branch'] is None
 
-    def create_attachment(self, data):
+    def create_attachment(self, data, path=None):
         """ High-level attachment creation
 
         :param data: dict formatted as the gitlab API expects it
+        :param path: the attachment content file (default: the ``file`` of the redmine attachment)
         :return: the created attachment
         """
         attachment_url = '{}/uploads'.format(self.api_url)
         data_redmine_ = data['redmine']
         content_type = data_redmine_.get('content_type', 'application/text')
-        files = {'file': (data_redmine_['filename'], open(data_redmine_['file'], 'rb'), content_type)}
-
-        return self.api.post(attachment_url, data['request'], files=files)
+        # the body is streamed from the file, never held in memory
+        with MultipartFileBody(data['request'], 'file', data_redmine_['filename'], path or data_redmine_['file'],
+                               content_type) as body:
+            return self.api.post(attachment_url, data=body, headers={'Content-Type': body.content_type})
 
     def create_issue(self, data, meta):
         """ High-level issue creation
 
+        Costs one request for the issue, one per note, and one to close it if
+        needed (gitlab does not create closed issues).
+
         :param meta: dict with "sudo_user", "should_close", "attachments" and "notes" keys
         :param data: dict formatted as the gitlab API expects it
         :return: the created issue (without notes)
         """
-        if len(meta['attachments']) > 0:
-            attachment_log = '\n\n### Files'
-            for attachment in meta['attachments']:
-                redmine_attachment = attachment['redmine']
-                gitlab_attachment = redmine_attachment.get('gitlab', None)
-                if gitlab_attachment is None:
-                    attachment_log += '\n  * [{}]({})'.format(redmine_attachment['filename'],
-                                                               redmine_attachment['content_url'])
-                else:
-                    attachment_log += '\n  * [{}]({})'.format(gitlab_attachment['alt'], gitlab_attachment['url'])
-            data['description'] += attachment_log
-
-        issues_url = '{}/issues'.format(self.api_url)
-        issue = self.api.post(issues_url, data=data)
-	#����iid��
-        issue_url = '{}/{}'.format(issues_url, issue['iid'])
+        issue = self.post_issue(data, meta)
 
         # Handle issues notes
-        issue_notes_url = '{}/notes'.format(issue_url, 'notes')
         for note_data, note_meta in meta['notes']:
-            self.api.post(issue_notes_url, data=note_data)
+            self.post_note(issue, note_data)
 
         # Handle closed status
         if meta['must_close']:
-            altered_issue = issue.copy()
-            altered_issue['labels'] = data['labels']
-            altered_issue['state_event'] = 'close'
-            self.api.put(issue_url, data=altered_issue)
+            self.close_issue(issue)
 
         return issue
 
+    def post_issue(self, data, meta):
+        """ Creates an issue, without its notes, with the list of its attachments in its description
+
+        :return: the created issue
+        """
+        payload = _payload(data)
+        payload['description'] = data['description'] + attachments_to_markdown(meta['attachments'])
+
+        issues_url = '{}/issues'.format(self.api_url)
+        return self.api.post(issues_url, json=payload)
+
+    def post_note(self, issue, note_data):
+        """ Adds a note to an issue
+        """
+        issue_notes_url = '{}/issues/{}/notes'.format(self.api_url, issue['iid'])
+        return self.api.post(issue_notes_url, json=note_data)
+
+    def close_issue(self, issue):
+        """ Closes an issue, leaving its other fields as they are
+
+        :param issue: the issue, as returned by gitlab
+        """
+        issue_url = '{}/issues/{}'.format(self.api_url, issue['iid'])
+        return self.api.put(issue_url, json={'state_event': 'close'})
+
     def create_milestone(self, data, meta):
         """ High-level milestone creation
 
@@ -103,45 +293,115 @@ class GitlabProject(Project):
         :param data: dict formatted as the gitlab API expects it
         :return: the created milestone
         """
-        milestones_url = '{}/milestones'.format(self.api_url)
-        milestone = self.api.post(milestones_url, data=data)
+        milestone = self.post_milestone(data)
 
         if meta['must_close']:
-            milestone_url = '{}/{}'.format(milestones_url, milestone['id'])
-            altered_milestone = milestone.copy()
-            altered_milestone['state_event'] = 'close'
-
-            self.api.put(milestone_url, data=altered_milestone)
+            milestone = self.close_milestone(milestone)
         return milestone
 
-    def delete_issue(self, issue_id):
-        self.api.delete('{}/issues/{}'.format(self.api_url, issue_id))
+    def post_milestone(self, data):
+        """ Creates an active milestone
+
+        :return: the created milestone
+        """
+        return self.api.post('{}/milestones'.format(self.api_url), json=_payload(data))
+
+    def close_milestone(self, milestone):
+        """ Closes a milestone, leaving its other fields as they are
+
+        :param milestone: the milestone, as returned by gitlab
+        :return: the closed milestone
+        """
+        milestone_url = '{}/milestones/{}'.format(self.api_url, milestone['id'])
+        return self.api.put(milestone_url, json={'state_event': 'close'})
+
+    def create_issue_link(self, iid, target_iid, link_type):
+        """ Links an issue to another issue of the project
+
+        :param link_type: "relates_to", "blocks" or "is_blocked_by"
+        """
+        links_url = '{}/issues/{}/links'.format(self.api_url, iid)
+        return self.api.post(links_url, json={
+            'target_project_id': self.project_id,
+            'target_issue_iid': target_iid,
+            'link_type': link_type,
+        })
+
+    def delete_issue(self, iid):
+        self.api.delete('{}/issues/{}'.format(self.api_url, iid))
+
+    def delete_milestone(self, milestone_id):
+        self.api.delete('{}/milestones/{}'.format(self.api_url, milestone_id))
 
     def get_issues(self):
-        issues = []
-        page = 1
-        found_issues = self.api.get('{}/issues?page={}&per_page=100'.format(self.api_url, page))
-        while len(found_issues) > 0:
-            issues += found_issues
-            page += 1
-            found_issues = self.api.get('{}/issues?page={}&per_page=100'.format(self.api_url, page))
-        return issues
+        return list(self.iter_issues())
+
+    def iter_issues(self, params=None):
+        """ Yields the issues, with at least id, iid, title, description, state and updated_at
+
+        :param params: REST filters, only ``updated_after`` is supported with GraphQL
+        """
+        def graphql():
+            variables = {'fullPath': self.full_path, 'updatedAfter': (params or {}).get('updated_after')}
+            for node in self.api.graphql_nodes(self.graphql_url, GRAPHQL_ISSUES, ('project', 'issues'), variables):
+                yield {'id': graphql_id(node['id']), 'iid': int(node['iid']), 'title': node['title'],
+                       'description': node['description'], 'state': node['state'], 'updated_at': node['updatedAt']}
+
+        return self._read(graphql, lambda: self.api.get_all_pages('{}/issues'.format(self.api_url), params))
+
+    def count_issues(self):
+        return self.api.count('{}/issues'.format(self.api_url))
 
     def get_members(self):
-        return self.api.get('{}/members'.format(self.api_url))
+        def graphql():
+            for node in self.api.graphql_nodes(self.graphql_url, GRAPHQL_MEMBERS, ('project', 'projectMembers'),
+                                               {'fullPath': self.full_path}):
+                user = node['user']
+                # members of deleted users have no user
+                if user is not None:
+                    yield dict(user, id=graphql_id(user['id']))
+
+        return list(self._read(graphql, lambda: self.api.get_all_pages('{}/members'.format(self.api_url))))
 
     def get_milestones(self):
         if not hasattr(self, '_cache_milestones'):
             # noinspection PyAttributeOutsideInit
-            self._cache_milestones = []
-            page = 1
-            found_issues = self.api.get('{}/milestones?page={}&per_page=100'.format(self.api_url, page))
-            while len(found_issues) > 0:
-                self._cache_milestones += found_issues
-                page += 1
-                found_issues = self.api.get('{}/milestones?page={}&per_page=100'.format(self.api_url, page))
+            self._cache_milestones = list(self.iter_milestones())
         return self._cache_milestones
 
+    def iter_milestones(self, params=None):
+        """ Yields the milestones, with at least id, iid, title, state and updated_at
+
+        :param params: REST filters, only ``updated_after`` is supported with GraphQL
+        """
+        def graphql():
+            updated_after = (params or {}).get('updated_after')
+            for node in self.api.graphql_nodes(self.graphql_url, GRAPHQL_MILESTONES, ('project', 'milestones'),
+                                               {'fullPath': self.full_path}):
+                # milestones can not be filtered by date in GraphQL, there are few anyway
+                if updated_after is None or node['updatedAt'] >= updated_after:
+                    yield {'id': graphql_id(node['id']), 'iid': int(node['iid']), 'title': node['title'],
+                           'state': node['state'], 'updated_at': node['updatedAt']}
+
+        return self._read(graphql, lambda: self.api.get_all_pages('{}/milestones'.format(self.api_url), params))
+
+    def _read(self, graphql, rest):
+        """ Returns an iterator on objects read through GraphQL if enabled, through REST otherwise
+
+        GraphQL results are read entirely before being returned, so that a
+        failure falls back to REST without yielding an object twice.
+        """
+        if self.use_graphql:
+            try:
+                return iter(list(graphql()))
+            except (GraphQLError, requests.RequestException) as e:
+                log.warning('GraphQL read failed, falling back to REST: {}'.format(e))
+                self.use_graphql = False
+        return rest()
+
+    def count_milestones(self):
+        return self.api.count('{}/milestones'.format(self.api_url))
+
     def get_milestones_index(self):
         return {i['title']: i for i in self.get_milestones()}
 
@@ -164,7 +424,7 @@ class GitlabProject(Project):
         return self.project_id
 
     def get_all_users(self):
-        return self.api.get('{}/users'.format(self.api_url))
+        return list(self.api.get_all_pages('{}/users'.format(self.api_url)))
 
     def get_users_index(self):
         """ Returns dict index of users (by login)
@@ -0,0 +1,83 @@
+import logging
+import os
+import time
+
+from .store import SQLiteStore
+from .workqueue import ATTACHMENT, ISSUE, MILESTONE
+
+""" Durable mapping of redmine objects to the gitlab objects created from them
+"""
+
+log = logging.getLogger(__name__)
+
+LEDGER_FILE = 'ledger.sqlite'
+
+# redmine journal entries become notes (the first entry, for merged entries)
+NOTE = 'note'
+KINDS = (MILESTONE, ATTACHMENT, ISSUE, NOTE)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS objects (
+    kind TEXT NOT NULL,
+    redmine_id INTEGER NOT NULL,
+    gitlab_id INTEGER,
+    url TEXT,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (kind, redmine_id)
+);
+CREATE INDEX IF NOT EXISTS objects_gitlab_id ON objects (kind, gitlab_id);
+"""
+
+
+class Ledger(SQLiteStore):
+    """ Gitlab objects created by the migration, by redmine object, stored with the redmine cache
+
+    Each object is recorded as soon as it is created: issues by iid,
+    milestones and notes by id, uploads by url. Lookups are indexed both
+    ways. Safe to use from several threads.
+
+    :param cache_dir: the redmine cache directory
+    """
+
+    def __init__(self, cache_dir):
+        # noinspection PyCompatibility
+        super().__init__(os.path.join(cache_dir, LEDGER_FILE), SCHEMA)
+
+    def record(self, kind, redmine_id, gitlab_id=None, url=None):
+        """ Records (or replaces) the gitlab object created from a redmine object
+        """
+        self._execute('INSERT OR REPLACE INTO objects (kind, redmine_id, gitlab_id, url, created_at) '
+                      'VALUES (?, ?, ?, ?, ?)', (kind, redmine_id, gitlab_id, url, time.time()))
+
+    def forget(self, kind, redmine_id):
+        self._execute('DELETE FROM objects WHERE kind = ? AND redmine_id = ?', (kind, redmine_id))
+
+    def gitlab_id(self, kind, redmine_id):
+        """ Returns the gitlab id (iid for issues) created from a redmine object, None if unknown
+        """
+        rows = self._execute('SELECT gitlab_id FROM objects WHERE kind = ? AND redmine_id = ?', (kind, redmine_id))
+        return rows[0][0] if rows else None
+
+    def url(self, kind, redmine_id):
+        rows = self._execute('SELECT url FROM objects WHERE kind = ? AND redmine_id = ?', (kind, redmine_id))
+        return rows[0][0] if rows else None
+
+    def redmine_id(self, kind, gitlab_id):
+        """ Returns the id of the redmine object a gitlab object was created from, None if unknown
+        """
+        rows = self._execute('SELECT redmine_id FROM objects WHERE kind = ? AND gitlab_id = ?', (kind, gitlab_id))
+        return rows[0][0] if rows else None
+
+    def mapping(self, kind):
+        """ Returns the gitlab ids of all the objects of a kind, by redmine id
+        """
+        return dict(self._execute('SELECT redmine_id, gitlab_id FROM objects WHERE kind = ?', (kind,)))
+
+    def counts(self):
+        """ Returns the number of objects recorded, by kind
+        """
+        return dict(self._execute('SELECT kind, COUNT(*) FROM objects GROUP BY kind'))
+
+    def summary(self):
+        counts = self.counts()
+        return ', '.join('{} {}(s)'.format(counts[i], i) for i in KINDS if i in counts) or 'nothing'
@@ -0,0 +1,107 @@
+import binascii
+import os
+
+from urllib3.fields import RequestField
+
+""" Streamed multipart/form-data bodies
+"""
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def choose_boundary():
+    return binascii.hexlify(os.urandom(16)).decode('ascii')
+
+
+def _part_header(boundary, field):
+    return '--{}\r\n{}'.format(boundary, field.render_headers()).encode('utf-8')
+
+
+class MultipartFileBody:
+    """ A multipart/form-data body with one file, read from disk while it is sent
+
+    ``requests`` builds the whole body in memory when given ``files=``. This
+    body is a file-like object of known length instead: ``requests`` sends it
+    with a ``Content-Length`` header and reads the file by chunks, so memory
+    use does not depend on the file size. The bytes sent are the same as
+    with ``files=``.
+
+    :param fields: dict of the form fields sent before the file
+    :param name: name of the file field
+    :param filename: name of the file, as sent to the server
+    :param path: path of the file content
+    :param content_type: content type of the file
+    :param boundary: multipart boundary (default: random)
+    """
+
+    def __init__(self, fields, name, filename, path, content_type, boundary=None, chunk_size=CHUNK_SIZE):
+        self.boundary = boundary or choose_boundary()
+        self.content_type = 'multipart/form-data; boundary={}'.format(self.boundary)
+        self.path = path
+        self.chunk_size = chunk_size
+
+        head = b''
+        for key, value in fields.items():
+            field = RequestField(name=key, data=str(value))
+            field.make_multipart()
+            head += _part_header(self.boundary, field) + str(value).encode('utf-8') + b'\r\n'
+        field = RequestField(name=name, data=b'', filename=filename)
+        field.make_multipart(content_type=content_type)
+        head += _part_header(self.boundary, field)
+        self._head = head
+        self._tail = '\r\n--{}--\r\n'.format(self.boundary).encode('latin-1')
+        self._file_size = os.path.getsize(path)
+        self.size = len(self._head) + self._file_size + len(self._tail)
+
+        self._position = 0
+        self._file = None
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        while True:
+            chunk = self.read(self.chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def read(self, size=-1):
+        """ Reads at most ``size`` bytes of the body (all the remaining ones when negative)
+        """
+        if size is None or size < 0:
+            size = self.size - self._position
+        chunks = []
+        while size > 0 and self._position < self.size:
+            chunk = self._read_segment(size)
+            self._position += len(chunk)
+            size -= len(chunk)
+            chunks.append(chunk)
+        return b''.join(chunks)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _read_segment(self, size):
+        file_start = len(self._head)
+        file_end = file_start + self._file_size
+        if self._position < file_start:
+            return self._head[self._position:min(file_start, self._position + size)]
+        if self._position < file_end:
+            if self._file is None:
+                self._file = open(self.path, 'rb')
+            chunk = self._file.read(min(size, file_end - self._position))
+            if not chunk:
+                raise IOError('{} was truncated while it was uploaded'.format(self.path))
+            return chunk
+        self.close()
+        offset = self._position - file_end
+        return self._tail[offset:offset + size]
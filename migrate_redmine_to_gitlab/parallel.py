@@ -0,0 +1,223 @@
+import logging
+import multiprocessing
+import multiprocessing.connection
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+
+""" Concurrent execution of API requests
+"""
+
+log = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 4
+
+
+def run_concurrently(func, items, workers=DEFAULT_WORKERS):
+    """ Calls ``func`` on each item from a pool of threads
+
+    Failures are isolated: an exception raised for an item is returned along
+    with it instead of stopping the other items. If the caller stops (or is
+    interrupted), pending items are cancelled.
+
+    :param func: callable taking an item
+    :param items: iterable of items
+    :param workers: number of threads, items are processed serially with 1
+    :return: yielded triples ``item``, ``result``, ``error`` (the raised
+        exception or None), in completion order
+    """
+    if workers <= 1:
+        for item in items:
+            # noinspection PyBroadException
+            try:
+                result = func(item)
+            except Exception as e:
+                yield item, None, e
+            else:
+                yield item, result, None
+        return
+
+    executor = ThreadPoolExecutor(max_workers=workers)
+    futures = {}
+    try:
+        for item in items:
+            futures[executor.submit(func, item)] = item
+        for future in as_completed(futures):
+            error = future.exception()
+            yield futures[future], None if error else future.result(), error
+    finally:
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=True)
+
+
+class ProcessDied(Exception):
+    """ The process running an item exited without a result (ex: killed for lack of memory)
+    """
+
+
+def _run_in_process(func, item, initializer, initargs, connection):
+    if initializer is not None:
+        initializer(*initargs)
+    # noinspection PyBroadException
+    try:
+        message = func(item), None
+    except Exception as e:
+        message = None, e
+    try:
+        connection.send(message)
+    except Exception as e:
+        # unpicklable result or error
+        connection.send((None, ProcessDied('Could not send back the result: {!r}'.format(message[1] or e))))
+    connection.close()
+
+
+def run_processes(func, items, processes, initializer=None, initargs=()):
+    """ Calls ``func`` on each item, each one in its own process, ``processes`` at once
+
+    As :func:`run_concurrently`, but ``func``, the items and the results
+    must be picklable. A process that dies (killed, segfault...) fails its
+    item only, with a :class:`ProcessDied` error.
+
+    :param initializer: callable run at the start of each process, with ``initargs``
+    :return: yielded triples ``item``, ``result``, ``error``, in completion order
+    """
+    pending = deque(items)
+    # process and item, by result connection
+    running = {}
+    try:
+        while pending or running:
+            while pending and len(running) < max(1, processes):
+                item = pending.popleft()
+                receiver, sender = multiprocessing.Pipe(duplex=False)
+                process = multiprocessing.Process(target=_run_in_process,
+                                                  args=(func, item, initializer, initargs, sender))
+                process.start()
+                sender.close()
+                running[receiver] = process, item
+            for receiver in multiprocessing.connection.wait(list(running)):
+                process, item = running.pop(receiver)
+                try:
+                    result, error = receiver.recv()
+                except EOFError:
+                    # the process exited before sending its result
+                    process.join()
+                    result, error = None, ProcessDied('Process exited with code {}'.format(process.exitcode))
+                receiver.close()
+                process.join()
+                yield item, result, error
+    finally:
+        for process, item in running.values():
+            process.terminate()
+            process.join()
+
+
+def run_lanes(func, lanes):
+    """ Calls ``func`` on the items of several lanes, each with its own pool of threads
+
+    Within a lane, items are started in the given order.
+
+    :param func: callable taking an item
+    :param lanes: iterable of couples: items, number of threads
+    :return: yielded triples, as :func:`run_concurrently`
+    """
+    executors = []
+    futures = {}
+    try:
+        for items, workers in lanes:
+            executor = ThreadPoolExecutor(max_workers=max(1, workers))
+            executors.append(executor)
+            for item in items:
+                futures[executor.submit(func, item)] = item
+        for future in as_completed(futures):
+            error = future.exception()
+            yield futures[future], None if error else future.result(), error
+    finally:
+        for future in futures:
+            future.cancel()
+        for executor in executors:
+            executor.shutdown(wait=True)
+
+
+class Turnstile:
+    """ Lets threads through one at a time, in the order of their tickets
+
+    Tickets are numbered from 0; a ticket whose thread fails is still
+    consumed, so the next ones are not blocked. With items submitted in
+    order to :func:`run_concurrently`, the tickets are their index.
+    """
+
+    def __init__(self):
+        self._next = 0
+        self._condition = threading.Condition()
+
+    @contextmanager
+    def turn(self, ticket):
+        with self._condition:
+            self._condition.wait_for(lambda: self._next == ticket)
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._next += 1
+                self._condition.notify_all()
+
+
+class RateLimiter:
+    """ Spaces calls out to at most ``rate`` per second, across threads
+
+    :param rate: calls per second, None or 0 for no limit
+    """
+
+    def __init__(self, rate=None):
+        self.interval = 1.0 / rate if rate else 0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        """ Blocks until the next call is allowed
+        """
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            at = max(self._next, now)
+            self._next = at + self.interval
+        if at > now:
+            time.sleep(at - now)
+
+    def limited(self, func):
+        """ Returns ``func``, waiting for its turn before each call
+        """
+        def wrapper(*args, **kwargs):
+            self.wait()
+            return func(*args, **kwargs)
+        return wrapper
+
+
+class SharedRateLimiter(RateLimiter):
+    """ A :class:`RateLimiter` shared by processes
+
+    It must be created before the processes, and given to them at their
+    start (ex: as ``initargs`` of :func:`run_processes`).
+
+    :param rate: calls per second, None or 0 for no limit
+    """
+
+    # noinspection PyMissingConstructor
+    def __init__(self, rate=None):
+        self.interval = 1.0 / rate if rate else 0
+        self._shared_next = multiprocessing.Value('d', time.time(), lock=False)
+        self._lock = multiprocessing.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.time()
+            at = max(self._shared_next.value, now)
+            self._shared_next.value = at + self.interval
+        if at > now:
+            time.sleep(at - now)
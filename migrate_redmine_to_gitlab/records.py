@@ -0,0 +1,83 @@
+import sys
+
+""" Compact in-memory representations of cached redmine objects
+"""
+
+
+def _intern(value):
+    return sys.intern(value) if value is not None else None
+
+
+def _ref_id(ref):
+    return ref['id'] if ref else None
+
+
+def _ref_name(ref):
+    return ref['name'] if ref else None
+
+
+class IssueRecord:
+    """ Index-level data of a redmine issue
+
+    Commands iterate over these records and read the full issue (description,
+    journals, attachments...) back from the cache only when they convert it,
+    see :meth:`RedmineProjectWithCache.get_issue`.
+
+    Repeated names (tracker, status, priority, users, version) are interned, so
+    that all records share a single copy of each of them.
+    """
+    __slots__ = ('id', 'subject', 'tracker', 'status', 'priority',
+                 'author_id', 'author', 'assigned_to_id', 'assigned_to',
+                 'fixed_version', 'closed_on', 'attachment_ids', 'gitlab_id')
+
+    def __init__(self, id, subject, tracker, status, priority,
+                 author_id, author, assigned_to_id, assigned_to,
+                 fixed_version, closed_on, attachment_ids, gitlab_id):
+        self.id = id
+        self.subject = subject
+        self.tracker = _intern(tracker)
+        self.status = _intern(status)
+        self.priority = _intern(priority)
+        self.author_id = author_id
+        self.author = _intern(author)
+        self.assigned_to_id = assigned_to_id
+        self.assigned_to = _intern(assigned_to)
+        self.fixed_version = _intern(fixed_version)
+        self.closed_on = closed_on
+        self.attachment_ids = attachment_ids
+        self.gitlab_id = gitlab_id
+
+    @classmethod
+    def from_dict(cls, issue):
+        """ Builds a record from a redmine-api-style issue dict
+        """
+        return cls(
+            issue['id'],
+            issue['subject'],
+            _ref_name(issue.get('tracker')),
+            _ref_name(issue.get('status')),
+            _ref_name(issue.get('priority')),
+            _ref_id(issue.get('author')),
+            _ref_name(issue.get('author')),
+            _ref_id(issue.get('assigned_to')),
+            _ref_name(issue.get('assigned_to')),
+            _ref_name(issue.get('fixed_version')),
+            issue.get('closed_on'),
+            tuple(i['id'] for i in issue.get('attachments', [])),
+            issue.get('gitlab_id'))
+
+    def __reduce__(self):
+        # Rebuild through __init__ so names are interned again once unpickled
+        # from a loader worker process.
+        return self.__class__, tuple(getattr(self, i) for i in self.__slots__)
+
+    def __eq__(self, other):
+        if not isinstance(other, IssueRecord):
+            return NotImplemented
+        return all(getattr(self, i) == getattr(other, i) for i in self.__slots__)
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __repr__(self):
+        return '<IssueRecord #{} {!r}>'.format(self.id, self.subject)
@@ -5,6 +5,8 @@ import logging
 import json
 from requests.exceptions import HTTPError
 from . import APIClient, Project
+from .cache import BatchedCacheWriter, DURABILITY_PHASE, load_json_file, load_json_files
+from .records import IssueRecord
 
 ANONYMOUS_USER_ID = 2
 
@@ -93,18 +95,20 @@ class RedmineProject(Project):
             return url
 
     def get_all_issues(self):
+        return list(self.iter_all_issues())
+
+    def iter_all_issues(self):
+        """ Yields detailed issues one by one, as soon as they are fetched
+        """
         issues = self.api.get_all_pages(
             '{}/issues.json?status_id=*'.format(self.public_url))
-        detailed_issues = []
         # It's impossible to get issue history from list view, so get it from
         # detail view...
 
         for issue_id in (i['id'] for i in issues):
             issue_url = '{}/issues/{}.json?include=journals,watchers,relations,childrens,attachments'.format(
                 self.instance_url, issue_id)
-            detailed_issues.append(self.api.get(issue_url))
-
-        return detailed_issues
+            yield self.api.get(issue_url)
 
     def get_participants(self):
         """Get participating users (issues authors/owners)
@@ -156,12 +160,13 @@ class RedmineProjectWithCache(Project):
     REGEX_PROJECT_URL = re.compile(
         r'^(?P<base_url>https?://.*)/projects/(?P<project_name>[\w_-]+)$')
 
-    def __init__(self, url, cache_dir, *args, **kwargs):
+    def __init__(self, url, cache_dir, *args, jobs=None, **kwargs):
         # noinspection PyCompatibility
         super().__init__(url, *args, **kwargs)
         self.api_url = '{}.json'.format(self.public_url)
         self.instance_url = self._url_match.group('base_url')
         self.path = cache_dir
+        self.jobs = jobs
         with open(os.path.join(self.path, 'project.json'), 'r') as outfile:
             self.project = json.load(outfile)
         log.info('Got redmine project: {}'.format(self.get_id()))
@@ -176,6 +181,18 @@ class RedmineProjectWithCache(Project):
         data = self._load_data(os.path.join(self.path, 'issues'))
         return sorted(data, key=lambda issue: issue['id'])
 
+    def get_issue_records(self):
+        """ Returns compact records of all cached issues, sorted by id
+
+        Use :meth:`get_issue` to get the full issue of a record.
+        """
+        return load_json_files(os.path.join(self.path, 'issues'), self.jobs, transform=IssueRecord.from_dict)
+
+    def get_issue(self, issue_id):
+        """ Returns the full cached issue (with journals, attachments...)
+        """
+        return load_json_file(os.path.join(self.path, 'issues', '{}.json'.format(issue_id)))
+
     def get_participants(self):
         return self._load_data(os.path.join(self.path, 'users'))
 
@@ -192,33 +209,58 @@ class RedmineProjectWithCache(Project):
     def get_attachments_index(self):
         return {i['id']: i for i in self.get_attachments()}
 
-    def link_roadmap(self, version, gitlab_id, gitlab_url, cache):
-        if not '/milestones/' in version['description']:
-            version['description'] += "Moved to {}/milestones/{}".format(gitlab_url, gitlab_id)
-        cache.load_version2(version)
+    def link_roadmap(self, version, gitlab_id, gitlab_url):
+        """ Adds a link to its gitlab milestone at the end of the description of a redmine version
 
-    def link_issue(self, issue, gitlab_id, gitlab_url, cache):
-        issue['note'] = "Moved to {}/issues/{}".format(gitlab_url, gitlab_id)
-        cache.load_issue2(issue)
+        :return: whether the version was updated (False if it already links to a milestone)
+        """
+        description = version['description'] or ''
+        if '/milestones/' in description:
+            return False
+        description += "Moved to {}/milestones/{}".format(gitlab_url, gitlab_id)
+        self.api.put('{}/versions/{}.json'.format(self.instance_url, version['id']),
+                     json={'version': {'name': version['name'], 'description': description}})
+        version['description'] = description
+        return True
+
+    def link_issue(self, issue, gitlab_id, gitlab_url):
+        """ Adds a note to a redmine issue, with a link to its gitlab issue
+        """
+        self.api.put('{}/issues/{}.json'.format(self.instance_url, issue['id']),
+                     json={'issue': {'notes': "Moved to {}/issues/{}".format(gitlab_url, gitlab_id)}})
 
-    @staticmethod
-    def _load_data(path):
-        result = []
-        for entry in os.scandir(path):
-            if entry.is_file() and str(entry.path).endswith('.json'):
-                with open(entry.path, 'r') as outfile:
-                    data = json.load(outfile)
-                    result.append(data)
-        return result
+    def is_issue_linked(self, issue, gitlab_url):
+        """ Whether a redmine issue has a note with a link to a gitlab issue, read from redmine (not the cache)
+        """
+        journals = self.api.get('{}/issues/{}.json'.format(self.instance_url, issue['id']),
+                                params={'include': 'journals'}).get('journals', [])
+        prefix = 'Moved to {}/issues/'.format(gitlab_url)
+        return any((i.get('notes') or '').startswith(prefix) for i in journals)
+
+    def _load_data(self, path):
+        return load_json_files(path, self.jobs)
 
 
 class RedmineCacheWriter:
-    def __init__(self, cache_dir, project):
+    def __init__(self, cache_dir, project, jobs=None, durability=DURABILITY_PHASE):
         self.path = cache_dir
+        self.jobs = jobs
         log.info('Redmine Cache dir: {}'.format(self.path))
         self.project = project
+        self.writer = BatchedCacheWriter(durability=durability)
         self._create_dir(self.path)
         self._store_data(self.path, project.get_project(), 'project', 'Project file')
+        self.flush()
+
+    def flush(self):
+        """ Waits until every stored object is written to the cache
+        """
+        self.writer.flush()
+
+    def close(self):
+        """ Writes every stored object to the cache, and stops the writer thread
+        """
+        self.writer.close()
 
     def load_versions(self):
         path = os.path.join(self.path, 'versions')
@@ -231,6 +273,8 @@ class RedmineCacheWriter:
             versions = self.project.get_versions()
             for version in versions:
                 self._store_data(path, version, version['id'], 'Version')
+            self.flush()
+            log.info('{} version(s) stored to {}'.format(len(versions), path))
         return versions
 
     def load_issues(self):
@@ -241,9 +285,12 @@ class RedmineCacheWriter:
         else:
             self._create_dir(path)
             log.info('Loading issues')
-            issues = self.project.get_all_issues()
-            for issue in issues:
+            issues = []
+            for issue in self.project.iter_all_issues():
                 self._store_data(path, issue, issue['id'], 'Issue')
+                issues.append(issue)
+            self.flush()
+            log.info('{} issue(s) stored to {}'.format(len(issues), path))
         return issues
 
     def load_users(self, issues):
@@ -257,6 +304,8 @@ class RedmineCacheWriter:
             users = self.project.get_participants0(issues)
             for user in users:
                 self._store_data(path, user, user['id'], 'User')
+            self.flush()
+            log.info('{} user(s) stored to {}'.format(len(users), path))
         return users
 
     def load_attachments(self, issues):
@@ -275,10 +324,11 @@ class RedmineCacheWriter:
                         attachments.append(a)
                         a_content = self.project.load_attachment_file(a)
                         file = os.path.join(path, '{}.data'.format(a['id']))
-                        with open(file, 'wb') as outfile:
-                            outfile.write(a_content)
+                        self.writer.write_bytes(file, a_content)
                         a['file'] = file
                         self._store_data(path, a, a['id'], 'Attachment')
+            self.flush()
+            log.info('{} attachment(s) stored to {}'.format(len(attachments), path))
         return attachments
 
     def load_attachment(self, attachment):
@@ -293,53 +343,16 @@ class RedmineCacheWriter:
         path = os.path.join(self.path, 'versions')
         self._store_data(path, version, version['id'], 'Version')
 
-    def load_version2(self, version):
-        path = os.path.join(self.path, 'versions2')
-        self._create_dir(path)
-        v = {
-            "version": {
-                "name": version['name'],
-                "description": version['description']
-            }
-        }
-        self._store_data(path, v, version['id'], 'Version')
-
-    def load_issue2(self, issue):
-        path = os.path.join(self.path, 'issues2')
-        self._create_dir(path)
-        v = {
-            "issue": {
-                "notes": issue['note']
-            }
-        }
-        self._store_data(path, v, issue['id'], 'Issue')
-
-    def get_version2_path(self, version_id):
-        return os.path.join(self.path, 'versions2', '{}.json'.format(version_id))
-
-    def get_issue2_path(self, issue_id):
-        return os.path.join(self.path, 'issues2', '{}.json'.format(issue_id))
-
     @staticmethod
     def _create_dir(path):
         if not os.path.exists(path):
             os.makedirs(path)
             log.info('Create cache dir: {}'.format(path))
 
-    @staticmethod
-    def _store_data(path, data, data_id, msg):
+    def _store_data(self, path, data, data_id, msg):
         file = os.path.join(path, '{}.json'.format(data_id))
-        with open(file, 'w') as outfile:
-            json.dump(data, outfile)
-        log.info('{} {} to {}'.format(msg, data_id, file))
-        log.debug('{} {} = {}'.format(msg, data_id, data))
+        self.writer.write_json(file, data)
+        log.debug('{} {} to {}'.format(msg, data_id, file))
 
-    @staticmethod
-    def _load_data(path):
-        result = []
-        for entry in os.scandir(path):
-            if entry.is_file() and str(entry.path).endswith('.json'):
-                with open(entry.path, 'r') as outfile:
-                    data = json.load(outfile)
-                    result.append(data)
-        return result
+    def _load_data(self, path):
+        return load_json_files(path, self.jobs)
@@ -0,0 +1,137 @@
+import logging
+import os
+import threading
+
+from requests.exceptions import HTTPError
+
+""" Redmine issue relations as gitlab issue links
+"""
+
+log = logging.getLogger(__name__)
+
+CHECKPOINT_FILE = 'relations.log'
+
+RELATES_TO = 'relates_to'
+BLOCKS = 'blocks'
+
+# redmine relation type: (gitlab link type, whether source and target are swapped)
+LINK_TYPES = {
+    'relates': (RELATES_TO, False),
+    'duplicates': (RELATES_TO, False),
+    'duplicated': (RELATES_TO, True),
+    'copied_to': (RELATES_TO, False),
+    'copied_from': (RELATES_TO, True),
+    'blocks': (BLOCKS, False),
+    'blocked': (BLOCKS, True),
+    # the preceding issue must be done first, as a blocking one
+    'precedes': (BLOCKS, False),
+    'follows': (BLOCKS, True),
+}
+
+
+def relation_link(relation):
+    """ Returns the gitlab link of a redmine relation, as a hashable triple ``source_id``, ``target_id``,
+    ``link_type`` (redmine ids), or None if the relation type is unknown
+
+    The triple is the same for both sides of a relation, and for redmine
+    relations that state the same link (ex: ``a blocks b``, ``b blocked a``,
+    ``b relates a`` and ``a relates b``).
+    """
+    try:
+        link_type, swapped = LINK_TYPES[relation['relation_type']]
+    except KeyError:
+        return None
+    source, target = relation['issue_id'], relation['issue_to_id']
+    if swapped:
+        source, target = target, source
+    if link_type == RELATES_TO and source > target:
+        source, target = target, source
+    return source, target, link_type
+
+
+def iter_links(redmine, issue_ids):
+    """ Yields the distinct links of the relations of the given redmine issues, reading issues one at a time
+
+    :param redmine: the :class:`RedmineProjectWithCache`
+    :param issue_ids: ids of the redmine issues
+    """
+    seen = set()
+    for issue_id in issue_ids:
+        for relation in redmine.get_issue(issue_id).get('relations', []):
+            link = relation_link(relation)
+            if link is None:
+                log.warning('Unknown relation type {} in issue {}'.format(relation['relation_type'], issue_id))
+            elif link not in seen:
+                seen.add(link)
+                yield link
+
+
+class RelationCheckpoint:
+    """ Links already created, appended to a file of the redmine cache as soon as created
+
+    :param cache_dir: the redmine cache directory
+    """
+
+    def __init__(self, cache_dir):
+        self.path = os.path.join(cache_dir, CHECKPOINT_FILE)
+        self.done = set()
+        self._lock = threading.Lock()
+        if os.path.exists(self.path):
+            with open(self.path, 'rb+') as infile:
+                content = infile.read()
+                # an interrupted run may leave a partial last line, removed so that the next link gets its own line
+                complete = content[:content.rfind(b'\n') + 1]
+                if len(complete) < len(content):
+                    log.warning('Dropping partial last line of {}'.format(self.path))
+                    infile.truncate(len(complete))
+            for line in complete.decode().splitlines():
+                fields = line.split()
+                if len(fields) == 3:
+                    self.done.add((int(fields[0]), int(fields[1]), fields[2]))
+
+    def __contains__(self, link):
+        return link in self.done
+
+    def __len__(self):
+        return len(self.done)
+
+    def add(self, link):
+        with self._lock:
+            self.done.add(link)
+            with open(self.path, 'a') as outfile:
+                outfile.write('{} {} {}\n'.format(*link))
+
+
+class IssueLinker:
+    """ Creates gitlab issue links, from any thread
+
+    Blocking links need a paid gitlab tier: after a first refusal, related
+    links are created instead. An existing link counts as created.
+
+    :param gitlab: the :class:`GitlabProject`
+    :param checkpoint: the :class:`RelationCheckpoint` recording created links
+    """
+
+    def __init__(self, gitlab, checkpoint):
+        self.gitlab = gitlab
+        self.checkpoint = checkpoint
+        self.blocks_supported = True
+
+    def link(self, iid, target_iid, link):
+        """ Links two issues, as ``link`` (see :func:`relation_link`) states
+        """
+        link_type = link[2] if self.blocks_supported else RELATES_TO
+        try:
+            self.gitlab.create_issue_link(iid, target_iid, link_type)
+        except HTTPError as e:
+            # an existing link is answered with a conflict
+            if e.response.status_code == 409:
+                pass
+            elif link_type != RELATES_TO and e.response.status_code in (403, 404, 422):
+                if self.blocks_supported:
+                    log.warning('Blocking links are not available ({}), using related links'.format(e))
+                    self.blocks_supported = False
+                self.gitlab.create_issue_link(iid, target_iid, RELATES_TO)
+            else:
+                raise
+        self.checkpoint.add(link)
@@ -0,0 +1,111 @@
+import logging
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from .parallel import DEFAULT_WORKERS
+
+""" Scheduling of tasks as soon as their prerequisites are done
+"""
+
+log = logging.getLogger(__name__)
+
+
+class DependencyError(Exception):
+    """ A task was not run because one of its prerequisites failed
+    """
+
+
+class TaskGraph:
+    """ Tasks run from a pool of threads, each one as soon as its prerequisites are done
+
+    A task has two kinds of prerequisites: ``requires``, tasks that must
+    succeed (if one fails, the task is not run and fails with a
+    :class:`DependencyError`), and ``after``, tasks that must be over, whether
+    they succeeded or not (to order tasks). Prerequisites that are not tasks
+    of the graph are considered done.
+
+    Ready tasks are started in the order they became ready, then in the order
+    they were added.
+    """
+
+    def __init__(self):
+        self.tasks = {}
+
+    def __len__(self):
+        return len(self.tasks)
+
+    def __contains__(self, key):
+        return key in self.tasks
+
+    def add(self, key, func, requires=(), after=()):
+        """ Adds a task
+
+        :param key: hashable task key, prerequisites refer to it
+        :param func: callable without argument, its return value is the task result
+        :param requires: keys of the tasks that must succeed first
+        :param after: keys of the tasks that must be over first
+        """
+        if key in self.tasks:
+            raise ValueError('Task {} added twice'.format(key))
+        self.tasks[key] = (func, tuple(requires), tuple(after))
+
+    def run(self, workers=DEFAULT_WORKERS):
+        """ Runs all the tasks
+
+        Failures are isolated, as with :func:`run_concurrently`. If the
+        caller stops (or is interrupted), tasks not started are cancelled.
+
+        :return: yielded triples ``key``, ``result``, ``error`` (the raised
+            exception or None), in completion order
+        """
+        # number of prerequisites not over, by task not started
+        pending = {}
+        dependents = {}
+        for key, (func, requires, after) in self.tasks.items():
+            pending[key] = 0
+            for prerequisite, required in [(i, True) for i in requires] + [(i, False) for i in after]:
+                if prerequisite in self.tasks:
+                    pending[key] += 1
+                    dependents.setdefault(prerequisite, []).append((key, required))
+
+        executor = ThreadPoolExecutor(max_workers=max(1, workers))
+        futures = {}
+
+        def submit(task_key):
+            del pending[task_key]
+            futures[executor.submit(self.tasks[task_key][0])] = task_key
+
+        def over(task_key, succeeded):
+            """ Updates the dependents of a task, returns the triples of the tasks that can not run
+            """
+            skipped = []
+            for dependent, required in dependents.get(task_key, ()):
+                if dependent not in pending:
+                    continue
+                if required and not succeeded:
+                    del pending[dependent]
+                    skipped.append((dependent, None, DependencyError('{} failed'.format(task_key))))
+                    skipped += over(dependent, False)
+                    continue
+                pending[dependent] -= 1
+                if pending[dependent] == 0:
+                    submit(dependent)
+            return skipped
+
+        try:
+            for key in [i for i, count in pending.items() if count == 0]:
+                submit(key)
+            while futures:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    key = futures.pop(future)
+                    error = future.exception()
+                    yield key, None if error else future.result(), error
+                    yield from over(key, error is None)
+            # tasks left are prerequisites of each other
+            for key in list(pending):
+                del pending[key]
+                yield key, None, DependencyError('circular prerequisites')
+        finally:
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=True)
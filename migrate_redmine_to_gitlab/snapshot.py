@@ -0,0 +1,221 @@
+import json
+import logging
+import os
+import re
+import threading
+
+""" Persisted state of the gitlab project
+"""
+
+log = logging.getLogger(__name__)
+
+SNAPSHOT_FILE = 'gitlab.json'
+
+ISSUE_FIELDS = ('id', 'iid', 'title', 'state', 'updated_at')
+MILESTONE_FIELDS = ('id', 'iid', 'title', 'state', 'updated_at')
+MEMBER_FIELDS = ('id', 'username', 'name', 'state')
+
+# Issues created by this tool carry the redmine id either in their title
+# (issues-with-id) or in their description footer.
+REGEX_TITLE_MARKER = re.compile(r'^-RM-([0-9]+)-MR-')
+REGEX_DESCRIPTION_MARKER = re.compile(r'\*\(from redmine issue ([0-9]+) created on')
+
+
+def redmine_id_of(issue):
+    """ Returns the redmine id recorded by this tool in a gitlab issue, or None
+    """
+    m = REGEX_TITLE_MARKER.match(issue.get('title') or '')
+    if m is None:
+        m = REGEX_DESCRIPTION_MARKER.search(issue.get('description') or '')
+    return int(m.group(1)) if m else None
+
+
+def _slim(data, fields):
+    return {i: data.get(i) for i in fields}
+
+
+class GitlabSnapshot:
+    """ Gitlab-side state of the migration, fetched once and persisted next to the redmine cache
+
+    Holds the project, its milestones, members and issues, with dict indexes
+    (milestone by id and title, issue by iid and redmine id, member by
+    username). On later runs, the project is fetched again, and only the
+    issues and milestones updated since the previous snapshot are: all of
+    them are fetched again when the project was recreated, or when some
+    were deleted.
+
+    :param cache_dir: the redmine cache directory
+    :param project_url: the gitlab project URL, the snapshot is discarded when it changes
+    """
+
+    def __init__(self, cache_dir, project_url):
+        self.path = os.path.join(cache_dir, SNAPSHOT_FILE)
+        self.project_url = project_url
+        self.project = None
+        self.issues_updated_at = None
+        self.milestones_updated_at = None
+        self.milestones_by_id = {}
+        self.milestones_by_title = {}
+        self.issues_by_iid = {}
+        self.issues_by_redmine_id = {}
+        self.members_by_username = {}
+        self._lock = threading.Lock()
+        self._load()
+
+    def refresh(self, gitlab):
+        """ Brings the snapshot up to date with the gitlab project
+
+        :param gitlab: the :class:`GitlabProject`
+        """
+        if self.project is not None and self.project['id'] != gitlab.project['id']:
+            log.info('Gitlab project was recreated, fetch it all again')
+            self.clear_issues()
+            self._clear_milestones()
+        self.project = gitlab.project
+
+        # once the updated objects are fetched, the snapshot holds as many objects as gitlab
+        # unless some were deleted, whatever the number of objects created meanwhile
+        incremental = self.issues_updated_at is not None
+        count = self._fetch_issues(gitlab)
+        if incremental and gitlab.count_issues() != len(self.issues_by_iid):
+            log.info('Some gitlab issues were deleted, fetch them all again')
+            self.clear_issues()
+            count = self._fetch_issues(gitlab)
+            incremental = False
+        log.info('Got {} {}issue(s) from gitlab.'.format(count, 'updated ' if incremental else ''))
+
+        incremental = self.milestones_updated_at is not None
+        count = self._fetch_milestones(gitlab)
+        if incremental and gitlab.count_milestones() != len(self.milestones_by_id):
+            log.info('Some gitlab milestones were deleted, fetch them all again')
+            self._clear_milestones()
+            count = self._fetch_milestones(gitlab)
+        log.info('Got {} milestone(s) from gitlab.'.format(count))
+
+        self.members_by_username = {i['username']: _slim(i, MEMBER_FIELDS) for i in gitlab.get_members()}
+        self.save()
+
+    def _fetch_issues(self, gitlab):
+        params = {'updated_after': self.issues_updated_at} if self.issues_updated_at else None
+        count = 0
+        for issue in gitlab.iter_issues(params):
+            self.record_issue(issue)
+            count += 1
+        return count
+
+    def _fetch_milestones(self, gitlab):
+        params = {'updated_after': self.milestones_updated_at} if self.milestones_updated_at else None
+        count = 0
+        for milestone in gitlab.iter_milestones(params):
+            self.record_milestone(milestone)
+            count += 1
+        return count
+
+    def record_issue(self, issue):
+        """ Adds (or updates) a gitlab issue, as returned by the API
+        """
+        slim = _slim(issue, ISSUE_FIELDS)
+        slim['redmine_id'] = issue.get('redmine_id', redmine_id_of(issue))
+        with self._lock:
+            self._index_issue(slim)
+            if slim['updated_at'] and (self.issues_updated_at or '') < slim['updated_at']:
+                self.issues_updated_at = slim['updated_at']
+
+    def record_milestone(self, milestone):
+        """ Adds (or updates) a gitlab milestone, as returned by the API
+        """
+        slim = _slim(milestone, MILESTONE_FIELDS)
+        with self._lock:
+            self._index_milestone(slim)
+            if slim['updated_at'] and (self.milestones_updated_at or '') < slim['updated_at']:
+                self.milestones_updated_at = slim['updated_at']
+
+    def forget_issue(self, iid):
+        with self._lock:
+            issue = self.issues_by_iid.pop(iid, None)
+            if issue and self.issues_by_redmine_id.get(issue['redmine_id']) is issue:
+                del self.issues_by_redmine_id[issue['redmine_id']]
+
+    def forget_milestone(self, _id):
+        with self._lock:
+            milestone = self.milestones_by_id.pop(_id, None)
+            if milestone and self.milestones_by_title.get(milestone['title']) is milestone:
+                del self.milestones_by_title[milestone['title']]
+
+    def get_milestone_by_id(self, _id):
+        try:
+            return self.milestones_by_id[_id]
+        except KeyError:
+            raise ValueError('Could not get milestone')
+
+    def save(self):
+        with self._lock:
+            data = {
+                'project_url': self.project_url,
+                'project': self.project,
+                'issues_updated_at': self.issues_updated_at,
+                'milestones_updated_at': self.milestones_updated_at,
+                'issues': list(self.issues_by_iid.values()),
+                'milestones': list(self.milestones_by_id.values()),
+                'members': list(self.members_by_username.values()),
+            }
+        tmp_path = '{}.tmp'.format(self.path)
+        with open(tmp_path, 'w') as outfile:
+            json.dump(data, outfile)
+        os.replace(tmp_path, self.path)
+        log.debug('Gitlab snapshot saved to {}'.format(self.path))
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r') as infile:
+                data = json.load(infile)
+        except ValueError as e:
+            log.warning('Ignoring invalid gitlab snapshot {}: {}'.format(self.path, e))
+            return
+        if data.get('project_url') != self.project_url:
+            log.info('Gitlab project changed, ignoring snapshot {}'.format(self.path))
+            return
+        self.project = data['project']
+        self.issues_updated_at = data['issues_updated_at']
+        self.milestones_updated_at = data['milestones_updated_at']
+        for issue in data['issues']:
+            self._index_issue(issue)
+        for milestone in data['milestones']:
+            self._index_milestone(milestone)
+        self.members_by_username = {i['username']: i for i in data['members']}
+        log.info('Loaded gitlab snapshot {}'.format(self.path))
+
+    def clear_issues(self):
+        """ Forgets all issues, so that they are all fetched again on next refresh
+        """
+        with self._lock:
+            self.issues_by_iid = {}
+            self.issues_by_redmine_id = {}
+            self.issues_updated_at = None
+
+    def _clear_milestones(self):
+        with self._lock:
+            self.milestones_by_id = {}
+            self.milestones_by_title = {}
+            self.milestones_updated_at = None
+
+    def _index_issue(self, issue):
+        previous = self.issues_by_iid.get(issue['iid'])
+        if previous:
+            if issue['redmine_id'] is None:
+                # the title marker is removed once iids are migrated
+                issue['redmine_id'] = previous['redmine_id']
+            if self.issues_by_redmine_id.get(previous['redmine_id']) is previous:
+                del self.issues_by_redmine_id[previous['redmine_id']]
+        self.issues_by_iid[issue['iid']] = issue
+        if issue['redmine_id'] is not None:
+            self.issues_by_redmine_id[issue['redmine_id']] = issue
+
+    def _index_milestone(self, milestone):
+        previous = self.milestones_by_id.get(milestone['id'])
+        if previous and self.milestones_by_title.get(previous['title']) is previous:
+            del self.milestones_by_title[previous['title']]
+        self.milestones_by_id[milestone['id']] = milestone
+        self.milestones_by_title[milestone['title']] = milestone
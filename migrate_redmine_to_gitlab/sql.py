@@ -1,4 +1,5 @@
 import logging
+import re
 import subprocess
 
 """ SQL-related work for gitlab DB
@@ -14,14 +15,56 @@ WHERE title ~* '{regex}' AND project_id={project_id};
 """
 
 
+# Issues which hold an iid needed by a migrated issue, or migrated twice
+FIND_IID_COLLISIONS = r"""
+SELECT iid, title
+FROM issues
+WHERE project_id={project_id} AND title !~* '{regex}' AND iid IN (
+  SELECT regexp_replace(title, '{regex}', '\1')::integer
+  FROM issues
+  WHERE title ~* '{regex}' AND project_id={project_id})
+UNION ALL
+SELECT MIN(iid), MIN(title)
+FROM issues
+WHERE title ~* '{regex}' AND project_id={project_id}
+GROUP BY regexp_replace(title, '{regex}', '\1')
+HAVING COUNT(*) > 1;
+"""
+
+
+# Iids are unique per project: migrated issues first get temporary negative
+# iids, so that two of them can swap their iids. The internal id sequence of
+# the project is moved past the highest iid, so that next issues created in
+# gitlab do not collide.
 MIGRATE_IID_ISSUES = r"""
+BEGIN;
+UPDATE issues SET
+  iid = -iid
+WHERE title ~* '{regex}' AND project_id={project_id};
 UPDATE issues SET
   title = regexp_replace(issues.title, '{regex}','\2'),
   iid = regexp_replace(issues.title, '{regex}', '\1')::integer
 WHERE title ~* '{regex}' AND project_id={project_id};
+UPDATE internal_ids SET
+  last_value = (SELECT MAX(iid) FROM issues WHERE project_id={project_id})
+WHERE project_id={project_id} AND usage=0
+  AND last_value < (SELECT MAX(iid) FROM issues WHERE project_id={project_id});
+COMMIT;
 """
 
 
+def parse_rows(output):
+    """ Returns the rows of an unaligned psql output, as lists of strings
+    """
+    return [i.split('|') for i in output.splitlines() if i.strip()]
+
+
+def parse_update_counts(output):
+    """ Returns the number of rows of each UPDATE command of a psql output
+    """
+    return [int(i) for i in re.findall(r'^UPDATE (\d+)$', output, re.MULTILINE)]
+
+
 def run_query(
         cmd,
         unix_user='gitlab-psql',
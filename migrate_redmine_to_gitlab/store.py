@@ -0,0 +1,35 @@
+import logging
+import sqlite3
+import threading
+
+""" SQLite databases stored with the redmine cache
+"""
+
+log = logging.getLogger(__name__)
+
+
+class SQLiteStore:
+    """ A SQLite database, in autocommit mode, safe to use from several threads
+
+    Statements are serialized by a lock on a single connection. The write
+    ahead log lets a reader (ex: another command) run while a command writes.
+
+    :param path: the database file, created if missing
+    :param schema: SQL script creating the tables (if they do not exist)
+    """
+
+    def __init__(self, path, schema):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.executescript(schema)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            return self._db.execute(sql, params).fetchall()
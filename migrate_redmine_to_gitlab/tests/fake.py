@@ -159,6 +159,31 @@ REDMINE_ISSUE_1439 = {
 
 
 class FakeGitlabClient:
+    def __init__(self):
+        self.requests = []
+        self.last_iid = 0
+
+    def post(self, url, data=None, json=None, **kwargs):
+        data = json if json is not None else data
+        self.requests.append(('POST', url, data))
+        if url.endswith('/issues'):
+            self.last_iid += 1
+            return dict(data, id=100 + self.last_iid, iid=self.last_iid)
+        if url.endswith('/milestones'):
+            return dict(data, id=200 + len(self.requests))
+        return dict(data or {})
+
+    def put(self, url, data=None, json=None, **kwargs):
+        data = json if json is not None else data
+        self.requests.append(('PUT', url, data))
+        return dict(data or {})
+
+    def get_all_pages(self, url, params=None):
+        return iter(self.get(url))
+
+    def count(self, url, params=None):
+        return len(self.get(url))
+
     def get(self, url):
         if url.endswith('/users'):
             return [JOHN, JACK]
@@ -220,9 +245,7 @@ class FakeGitlabClient:
                 "http://example.com/uploads/project/avatar/3/uploads/avr.png"
             }
 
-        elif url.endswith('/projects/3/issues?page=2&per_page=100'):
-            return []
-        elif url.endswith('/projects/3/issues?page=1&per_page=100'):
+        elif url.endswith('/projects/3/issues'):
             return [
                 {
                     "id": 43,
@@ -332,7 +355,7 @@ class FakeGitlabClient:
                 "archived": False,
                 "avatar_url": None
             }
-        elif url.endswith('/projects/6/issues?page=1&per_page=100'):
+        elif url.endswith('/projects/6/issues'):
             return []
 
         elif url.endswith('/projects/6/members'):
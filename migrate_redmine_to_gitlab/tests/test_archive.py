@@ -0,0 +1,113 @@
+import copy
+import json
+import os
+import tarfile
+import tempfile
+import unittest
+
+from .fake import REDMINE_ISSUE_1439, REDMINE_ISSUE_1732
+from migrate_redmine_to_gitlab.archive import ProjectArchive
+from migrate_redmine_to_gitlab.converters import NOTES_BY_AUTHOR
+from migrate_redmine_to_gitlab.redmine import RedmineProjectWithCache
+
+SCHEMA_PATH = os.path.join(os.path.dirname(__file__), 'fixtures', 'import_export_schema.json')
+
+TYPES = {'string': str, 'integer': int, 'boolean': bool, 'array': list, 'object': dict, 'null': type(None)}
+
+
+def schema_errors(value, schema, path=''):
+    """ Validates a value against the small subset of json schema used by the fixture
+    """
+    errors = []
+    if 'enum' in schema and value not in schema['enum']:
+        errors.append('{}: {!r} not in {}'.format(path, value, schema['enum']))
+    if 'type' in schema:
+        types = schema['type'] if isinstance(schema['type'], list) else [schema['type']]
+        if not any(type(value) is TYPES[i] for i in types):
+            return errors + ['{}: {!r} is not {}'.format(path, value, schema['type'])]
+    if isinstance(value, dict):
+        errors += ['{}: missing {}'.format(path, i) for i in schema.get('required', []) if i not in value]
+        for key, sub_schema in schema.get('properties', {}).items():
+            if key in value:
+                errors += schema_errors(value[key], sub_schema, '{}.{}'.format(path, key))
+    if isinstance(value, list) and 'items' in schema:
+        for i, item in enumerate(value):
+            errors += schema_errors(item, schema['items'], '{}[{}]'.format(path, i))
+    return errors
+
+
+class ProjectArchiveTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'cache')
+        issue = copy.deepcopy(REDMINE_ISSUE_1732)
+        issue['attachments'] = [{'id': 10, 'filename': 'doc.txt'}, {'id': 11, 'filename': 'lost.txt'}]
+        self._store('issues', issue)
+        self._store('issues', REDMINE_ISSUE_1439)
+        self._store('users', {'id': 3, 'login': 'jack_smith', 'mail': 'jack@example.com'})
+        self._store('users', {'id': 83, 'login': 'john_smith', 'mail': 'john@example.com'})
+        self._store('versions', {'id': 66, 'name': 'v0.11', 'status': 'open', 'description': 'First',
+                                 'created_on': '2015-11-16T10:11:44Z', 'updated_on': '2015-11-16T10:11:44Z'})
+        for _id, filename in ((10, 'doc.txt'), (11, 'lost.txt')):
+            self._store('attachments', {'id': _id, 'filename': filename, 'filesize': 7,
+                                        'content_url': 'http://localhost:9000/attachments/download/{}'.format(_id)})
+        with open(os.path.join(self.path, 'attachments', '10.data'), 'wb') as outfile:
+            outfile.write(b'content')
+        with open(os.path.join(self.path, 'project.json'), 'w') as outfile:
+            json.dump({'id': 196, 'description': 'Diaspora site'}, outfile)
+        self.redmine = RedmineProjectWithCache('http://localhost:9000/projects/diaspora-site', self.path, None)
+        self.archive_path = os.path.join(self.tmp.name, 'export.tar.gz')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _store(self, kind, data):
+        path = os.path.join(self.path, kind)
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, '{}.json'.format(data['id'])), 'w') as outfile:
+            json.dump(data, outfile)
+
+    def _read(self):
+        contents = {}
+        with tarfile.open(self.archive_path, 'r:gz') as tar:
+            for member in tar.getmembers():
+                contents[member.name] = tar.extractfile(member).read().decode()
+        return contents
+
+    def test_matches_schema(self):
+        counts = ProjectArchive(self.redmine, self.path).write(self.archive_path)
+        self.assertEqual(counts, {'issues': 2, 'milestones': 1, 'labels': 4, 'project_members': 2, 'uploads': 1})
+
+        with open(SCHEMA_PATH) as infile:
+            schema = json.load(infile)
+        contents = self._read()
+        self.assertEqual(contents['VERSION'], schema['version'])
+        for name, file_schema in schema['files'].items():
+            self.assertIn(name, contents)
+            if name.endswith('.ndjson'):
+                values = [json.loads(i) for i in contents[name].splitlines()]
+            else:
+                values = [json.loads(contents[name])]
+            for value in values:
+                self.assertEqual(schema_errors(value, file_schema, name), [])
+        self.assertFalse(os.path.exists('{}.tmp'.format(self.archive_path)))
+
+    def test_issues(self):
+        ProjectArchive(self.redmine, self.path, notes_group_by=NOTES_BY_AUTHOR).write(self.archive_path)
+        contents = self._read()
+        issues = {i['iid']: i for i in map(json.loads, contents['tree/project/issues.ndjson'].splitlines())}
+
+        self.assertEqual(sorted(issues), [1439, 1732])
+        self.assertEqual(issues[1439]['milestone']['title'], 'v0.11')
+        self.assertEqual(issues[1439]['state'], 'opened')
+        self.assertEqual(issues[1732]['state'], 'closed')
+        self.assertEqual(issues[1732]['author_id'], 3)
+        self.assertEqual(issues[1732]['issue_assignees'], [{'user_id': 83}])
+        self.assertEqual([i['author_id'] for i in issues[1732]['notes']], [83])
+
+        # the cached attachment is in the uploads, the missing one links to redmine
+        uploads = [i for i in contents if i.startswith('uploads/')]
+        self.assertEqual(len(uploads), 1)
+        self.assertEqual(contents[uploads[0]], 'content')
+        self.assertIn('[doc](/{})'.format(uploads[0]), issues[1732]['description'])
+        self.assertIn('[lost.txt](http://localhost:9000/attachments/download/11)', issues[1732]['description'])
@@ -0,0 +1,63 @@
+import json
+import os
+import tempfile
+import unittest
+
+from migrate_redmine_to_gitlab.batch import MAX_CELL_WIDTH, PROJECT_DONE, PROJECT_FAILED, format_status_table, \
+    project_status
+from migrate_redmine_to_gitlab.config import BATCH_CONFIG_FILE, BatchConfig, MigrationConfig
+
+
+class BatchConfigTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, data):
+        with open(os.path.join(self.tmp.name, BATCH_CONFIG_FILE), 'w') as outfile:
+            json.dump(data, outfile)
+
+    def test_projects(self):
+        self.write({
+            'redmine': {'host': 'https://forge.codelutin.com', 'key': 'R'},
+            'gitlab': {'host': 'https://gitlab.com', 'key': 'G'},
+            'projects': [
+                {'redmine': 'projects/observe', 'gitlab': 'ultreia.io/ird-observe'},
+                {'redmine': 'projects/t3', 'gitlab': {'path': 'ultreia.io/t3', 'host': 'https://gitlab.local'},
+                 'name': 't3-legacy'},
+            ]})
+        config = BatchConfig(self.tmp.name)
+        self.assertEqual([i[0] for i in config.projects], ['observe', 't3-legacy'])
+        self.assertEqual(config.gitlab_hosts, {'https://gitlab.com', 'https://gitlab.local'})
+
+        # each project can be migrated on its own
+        project = MigrationConfig(config.projects[1][1])
+        self.assertEqual(project.redmine_project_url, 'https://forge.codelutin.com/projects/t3')
+        self.assertEqual(project.gitlab_project_url, 'https://gitlab.local/ultreia.io/t3')
+        self.assertEqual(project.gitlab_key, 'G')
+
+    def test_duplicate_name(self):
+        self.write({
+            'redmine': {'host': 'https://forge.codelutin.com', 'key': 'R'},
+            'gitlab': {'host': 'https://gitlab.com', 'key': 'G'},
+            'projects': [
+                {'redmine': 'projects/observe', 'gitlab': 'a/observe'},
+                {'redmine': 'projects/observe', 'gitlab': 'b/observe'},
+            ]})
+        self.assertRaises(ValueError, BatchConfig, self.tmp.name)
+
+
+class StatusTableTestCase(unittest.TestCase):
+    def test_format(self):
+        table = format_status_table([
+            project_status('observe', PROJECT_DONE, 'migrate', 65.2, objects='3 issue(s)'),
+            project_status('t3', PROJECT_FAILED, 'init', 1, error=ValueError('x' * 200)),
+        ])
+        lines = table.splitlines()
+        self.assertEqual(len(lines), 5)
+        self.assertTrue(lines[0].startswith('project  status  step     time'))
+        self.assertIn('observe  done    migrate  65s', lines[2])
+        self.assertTrue(lines[3].endswith('x' * (MAX_CELL_WIDTH - 3) + '...'))
+        self.assertEqual(lines[4], '2 project(s): 1 done, 1 failed')
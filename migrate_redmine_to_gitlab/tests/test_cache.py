@@ -0,0 +1,141 @@
+import json
+import os
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from migrate_redmine_to_gitlab.cache import (
+    BatchedCacheWriter, DURABILITY_BATCH, DURABILITY_NONE, DURABILITY_PHASE, list_json_files, load_json_files)
+
+
+def _subject(issue):
+    return issue['subject']
+
+
+class LoadJsonFilesTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = self.tmp.name
+        for issue_id in (3, 12, 1, 100, 25):
+            with open(os.path.join(self.path, '{}.json'.format(issue_id)), 'w') as outfile:
+                json.dump({'id': issue_id, 'subject': 'issue {}'.format(issue_id)}, outfile)
+        # not part of the cache
+        with open(os.path.join(self.path, '3.data'), 'wb') as outfile:
+            outfile.write(b'data')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_list_json_files_in_id_order(self):
+        names = [os.path.basename(i) for i in list_json_files(self.path)]
+        self.assertEqual(names, ['1.json', '3.json', '12.json', '25.json', '100.json'])
+
+    def test_serial_load(self):
+        data = load_json_files(self.path, jobs=1)
+        self.assertEqual([i['id'] for i in data], [1, 3, 12, 25, 100])
+
+    def test_parallel_load_matches_serial(self):
+        serial = load_json_files(self.path, jobs=1)
+        parallel = load_json_files(self.path, jobs=2, threshold=0)
+        self.assertEqual(parallel, serial)
+
+    def test_parallel_load_with_transform(self):
+        subjects = load_json_files(self.path, jobs=2, transform=_subject, threshold=0)
+        self.assertEqual(subjects, ['issue 1', 'issue 3', 'issue 12', 'issue 25', 'issue 100'])
+
+
+class BlockingCacheWriter(BatchedCacheWriter):
+    """ A writer whose disk is stuck until ``release`` is set """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.release = threading.Event()
+
+    def _write_batch(self, batch):
+        self.release.wait()
+        super()._write_batch(batch)
+
+
+class BatchedCacheWriterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = self.tmp.name
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def test_write_and_flush(self):
+        writer = BatchedCacheWriter(batch_size=3)
+        for i in range(10):
+            writer.write_json(self._file('{}.json'.format(i)), {'id': i})
+        writer.write_bytes(self._file('1.data'), b'content')
+        writer.flush()
+        self.assertEqual(writer.written, 11)
+        self.assertEqual([i['id'] for i in load_json_files(self.path, jobs=1)], list(range(10)))
+        with open(self._file('1.data'), 'rb') as infile:
+            self.assertEqual(infile.read(), b'content')
+        self.assertEqual(sorted(os.listdir(self.path))[-1], '9.json')
+        writer.close()
+
+    def test_durability_policies(self):
+        for durability, fsync_after_writes, fsync_after_flush in ((DURABILITY_NONE, False, False),
+                                                                   (DURABILITY_BATCH, True, True),
+                                                                   (DURABILITY_PHASE, False, True)):
+            writer = BatchedCacheWriter(durability=durability)
+            with mock.patch('os.fsync') as fsync:
+                writer.write_json(self._file('1.json'), {'id': 1})
+                writer._queue.join()
+                self.assertEqual(fsync.called, fsync_after_writes, durability)
+                writer.flush()
+                self.assertEqual(fsync.called, fsync_after_flush, durability)
+            writer.close()
+
+    def test_backpressure(self):
+        writer = BlockingCacheWriter(max_pending=2, batch_size=1)
+        producer = threading.Thread(
+            target=lambda: [writer.write_json(self._file('{}.json'.format(i)), {'id': i}) for i in range(5)])
+        producer.start()
+        producer.join(0.2)
+        self.assertTrue(producer.is_alive())
+        writer.release.set()
+        producer.join(5)
+        self.assertFalse(producer.is_alive())
+        writer.close()
+        self.assertEqual(writer.written, 5)
+
+    def test_backpressure_in_bytes(self):
+        writer = BlockingCacheWriter(max_pending_bytes=10, batch_size=1)
+        producer = threading.Thread(
+            target=lambda: [writer.write_bytes(self._file('{}.data'.format(i)), b'x' * 6) for i in range(3)])
+        producer.start()
+        producer.join(0.2)
+        # the first record is being written, the second one waits for it
+        self.assertTrue(producer.is_alive())
+        self.assertEqual(writer._pending_bytes, 6)
+        writer.release.set()
+        producer.join(5)
+        self.assertFalse(producer.is_alive())
+        # larger than the bound, queued alone
+        writer.write_bytes(self._file('big.data'), b'x' * 20)
+        writer.close()
+        self.assertEqual((writer.written, writer._pending_bytes), (4, 0))
+
+    def test_close_at_exit(self):
+        with mock.patch('atexit.register') as register, mock.patch('atexit.unregister') as unregister:
+            writer = BatchedCacheWriter()
+            self.assertFalse(register.called)
+            writer.write_json(self._file('1.json'), {'id': 1})
+            writer.write_json(self._file('2.json'), {'id': 2})
+            register.assert_called_once_with(writer.close)
+            writer.close()
+            unregister.assert_called_once_with(writer.close)
+
+    def test_write_error_is_raised(self):
+        writer = BatchedCacheWriter()
+        writer.write_json(self._file(os.path.join('missing', '1.json')), {'id': 1})
+        self.assertRaises(OSError, writer.flush)
+        writer.close()
@@ -2,7 +2,7 @@ import unittest
 
 from .fake import JOHN, JACK, REDMINE_ISSUE_1439, REDMINE_ISSUE_1732
 from migrate_redmine_to_gitlab.converters import (
-    convert_issue, convert_version, relations_to_string)
+    convert_issue, convert_notes, convert_version, relations_to_string, NOTES_BY_AUTHOR)
 
 
 class ConvertorTestCase(unittest.TestCase):
@@ -43,6 +43,7 @@ class ConvertorTestCase(unittest.TestCase):
             'labels': 'From Redmine, Evolution, Urgent',
             'redmine_id': 1732,
             'assignee_id': JOHN['id'],
+            'created_at': '2015-08-21',
         })
         self.assertEqual(meta, {
             'sudo_user': JACK['username'],
@@ -51,7 +52,7 @@ class ConvertorTestCase(unittest.TestCase):
                 ({'body': 'Appliqué par commit '
                           'commit:66cbf9571ed501c6d38a5978f8a27e7b1aa35268.'
                           '\n\n*(from redmine: written on 2015-09-09)*'},
-                 {'sudo_user': 'john_smith'})
+                 {'sudo_user': 'john_smith', 'created_on': '2015-09-09T13:31:16Z', 'journal_id': 3995})
                 # empty notes should not be kept
             ],
             'must_close': True
@@ -70,6 +71,7 @@ class ConvertorTestCase(unittest.TestCase):
             'labels': 'From Redmine, Evolution, Normal',
             'redmine_id': 1439,
             'milestone_id': 3,
+            'created_at': '2015-04-03',
         })
         self.assertEqual(meta, {
             'sudo_user': JOHN['username'],
@@ -128,3 +130,48 @@ class ConvertorTestCase(unittest.TestCase):
         self.assertEqual(
             relations_to_string([simple_oneway, simple_otherway], 2),
             'relates #3, ref #3')
+
+    def _journals(self):
+        return [
+            {'id': 1, 'notes': 'first', 'created_on': '2015-09-01T10:00:00Z', 'user': {'id': 83}},
+            {'id': 2, 'notes': 'second', 'created_on': '2015-09-02T10:00:00Z', 'user': {'id': 83}},
+            {'id': 3, 'notes': '', 'created_on': '2015-09-03T10:00:00Z', 'user': {'id': 3}},
+            {'id': 4, 'notes': 'third', 'created_on': '2015-09-04T10:00:00Z', 'user': {'id': 3}},
+            {'id': 5, 'notes': 'fourth', 'created_on': '2015-09-05T10:00:00Z', 'user': {'id': 12}},
+        ]
+
+    def test_notes_one_per_entry(self):
+        notes = list(convert_notes(self._journals(), self.redmine_user_index))
+        self.assertEqual(notes[0], ({'body': 'first\n\n*(from redmine: written on 2015-09-01)*'},
+                                    {'sudo_user': 'john_smith', 'created_on': '2015-09-01T10:00:00Z',
+                                     'journal_id': 1}))
+        self.assertEqual([i[1]['sudo_user'] for i in notes], ['john_smith', 'john_smith', 'jack_smith', None])
+
+    def test_notes_by_author(self):
+        notes = list(convert_notes(self._journals(), self.redmine_user_index, group_by=NOTES_BY_AUTHOR))
+        self.assertEqual(notes, [
+            ({'body': 'first\n\n*(from redmine: written on 2015-09-01)*\n\n---\n\n'
+                      'second\n\n*(from redmine: written on 2015-09-02)*'},
+             {'sudo_user': 'john_smith', 'created_on': '2015-09-01T10:00:00Z', 'journal_id': 1}),
+            ({'body': 'third\n\n*(from redmine: written on 2015-09-04)*'},
+             {'sudo_user': 'jack_smith', 'created_on': '2015-09-04T10:00:00Z', 'journal_id': 4}),
+            ({'body': 'fourth\n\n*(from redmine: written on 2015-09-05)*'},
+             {'sudo_user': None, 'created_on': '2015-09-05T10:00:00Z', 'journal_id': 5}),
+        ])
+
+    def test_notes_by_count(self):
+        notes = list(convert_notes(self._journals(), self.redmine_user_index, group_by=3))
+        self.assertEqual(len(notes), 2)
+        # several authors: the note names them, and is posted by the admin
+        self.assertEqual(notes[0], ({'body': 'first\n\n*(from redmine: written on 2015-09-01 by john_smith)*'
+                                             '\n\n---\n\n'
+                                             'second\n\n*(from redmine: written on 2015-09-02 by john_smith)*'
+                                             '\n\n---\n\n'
+                                             'third\n\n*(from redmine: written on 2015-09-04 by jack_smith)*'},
+                                    {'sudo_user': None, 'created_on': '2015-09-01T10:00:00Z', 'journal_id': 1}))
+        self.assertEqual(notes[1][0]['body'], 'fourth\n\n*(from redmine: written on 2015-09-05)*')
+
+    def test_notes_size_limit(self):
+        notes = list(convert_notes(self._journals(), self.redmine_user_index, group_by=100, max_size=140))
+        self.assertEqual(len(notes), 2)
+        self.assertTrue(all(len(i[0]['body']) <= 140 for i in notes))
@@ -1,7 +1,174 @@
+import json
+import threading
 import unittest
+from unittest import mock
+from urllib.parse import parse_qsl, urlsplit
 
-from .fake import FakeGitlabClient
-from migrate_redmine_to_gitlab.gitlab import  GitlabProject
+from .fake import FakeGitlabClient, JACK, JOHN
+from migrate_redmine_to_gitlab.gitlab import GitlabClient, GitlabProject, GraphQLError
+
+
+class FakeResponse:
+    def __init__(self, data, headers=None, links=None):
+        self.data = data
+        self.headers = headers or {}
+        self.links = links or {}
+        self.content = json.dumps(data).encode()
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.data
+
+
+class PaginatedServer:
+    """ Serves ``items`` through GitLab-like paginated responses """
+
+    def __init__(self, items, with_totals=True, with_links=False):
+        self.items = items
+        self.with_totals = with_totals
+        self.with_links = with_links
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def get(self, url, params=None, headers=None):
+        params = dict(params or {})
+        split = urlsplit(url)
+        params.update(parse_qsl(split.query))
+        url = url.split('?')[0]
+        with self.lock:
+            self.requests.append(dict(params))
+        page = int(params.get('page', 1))
+        per_page = int(params['per_page'])
+        total_pages = max(1, -(-len(self.items) // per_page))
+        response_headers = {'X-Page': str(page)}
+        links = {}
+        if page < total_pages:
+            response_headers['X-Next-Page'] = str(page + 1)
+            if self.with_links:
+                links['next'] = {'url': '{}?page={}&per_page={}'.format(url, page + 1, per_page)}
+        if self.with_totals:
+            response_headers['X-Total'] = str(len(self.items))
+            response_headers['X-Total-Pages'] = str(total_pages)
+        return FakeResponse(self.items[(page - 1) * per_page:page * per_page], response_headers, links)
+
+
+class GitlabClientTestCase(unittest.TestCase):
+    URL = 'http://localhost:3000/api/v4/projects/3/issues'
+
+    def setUp(self):
+        self.client = GitlabClient('token')
+        self.client.MAX_PER_PAGE = 10
+
+    def test_concurrent_pages_with_totals(self):
+        server = PaginatedServer(list(range(95)))
+        with mock.patch.object(self.client.session, 'get', side_effect=server.get):
+            items = list(self.client.get_all_pages(self.URL))
+        self.assertEqual(items, list(range(95)))
+        # 10 pages of 10 items, no extra empty page
+        self.assertEqual(sorted(int(i.get('page', 1)) for i in server.requests), list(range(1, 11)))
+
+    def test_pages_follow_headers(self):
+        for server in (PaginatedServer(list(range(250)), with_totals=False),
+                       PaginatedServer(list(range(250)), with_totals=False, with_links=True),
+                       PaginatedServer(list(range(250)))):
+            with mock.patch.object(self.client.session, 'get', side_effect=server.get):
+                items = list(self.client.get_all_pages(self.URL))
+            self.assertEqual(items, list(range(250)))
+            self.assertEqual(len(server.requests), 25)
+
+    def test_count_and_exists(self):
+        server = PaginatedServer(list(range(250)))
+        with mock.patch.object(self.client.session, 'get', side_effect=server.get):
+            self.assertEqual(self.client.count(self.URL), 250)
+            self.assertTrue(self.client.exists(self.URL))
+        self.assertEqual([i['per_page'] for i in server.requests], [1, 1])
+
+        server = PaginatedServer([])
+        with mock.patch.object(self.client.session, 'get', side_effect=server.get):
+            self.assertEqual(self.client.count(self.URL), 0)
+            self.assertFalse(self.client.exists(self.URL))
+
+    def test_connection_pool(self):
+        client = GitlabClient('token', pool_size=16)
+        # noinspection PyProtectedMember
+        self.assertEqual(client.session.get_adapter(self.URL)._pool_maxsize, 16)
+
+    def test_delete_without_content(self):
+        response = FakeResponse(None)
+        response.content = b''
+        with mock.patch.object(self.client.session, 'delete', return_value=response) as delete:
+            self.assertIsNone(self.client.delete('{}/3'.format(self.URL)))
+        self.assertEqual(delete.call_args[0], ('{}/3'.format(self.URL),))
+
+    def test_graphql_nodes(self):
+        pages = [
+            {'data': {'project': {'issues': {'pageInfo': {'hasNextPage': True, 'endCursor': 'c1'},
+                                             'nodes': [{'iid': '1'}, {'iid': '2'}]}}}},
+            {'data': {'project': {'issues': {'pageInfo': {'hasNextPage': False, 'endCursor': 'c2'},
+                                             'nodes': [{'iid': '3'}]}}}},
+        ]
+        url = 'http://localhost:3000/api/graphql'
+        with mock.patch.object(self.client.session, 'post', side_effect=[FakeResponse(i) for i in pages]) as post:
+            nodes = list(self.client.graphql_nodes(url, 'query', ('project', 'issues'), {'fullPath': 'a/b'}))
+        self.assertEqual(nodes, [{'iid': '1'}, {'iid': '2'}, {'iid': '3'}])
+        self.assertEqual([i[1]['json']['variables'].get('after') for i in post.call_args_list], [None, 'c1'])
+        self.assertEqual(self.client.stats.requests, {'graphql': 2})
+        self.assertEqual(self.client.stats.bytes['graphql'], sum(len(json.dumps(i)) for i in pages))
+
+        with mock.patch.object(self.client.session, 'post', return_value=FakeResponse({'errors': [{'message': 'denied'}]})):
+            self.assertRaises(GraphQLError, list, self.client.graphql_nodes(url, 'query', ('project', 'issues')))
+        with mock.patch.object(self.client.session, 'post', return_value=FakeResponse({'data': {'project': None}})):
+            self.assertRaises(GraphQLError, list, self.client.graphql_nodes(url, 'query', ('project', 'issues')))
+
+
+class FakeGraphQLClient(FakeGitlabClient):
+    def __init__(self, nodes):
+        # noinspection PyCompatibility
+        super().__init__()
+        self.nodes = nodes
+        self.queries = []
+
+    def graphql_nodes(self, url, query, path, variables=None):
+        self.queries.append((url, path, variables))
+        if self.nodes is None:
+            raise GraphQLError('not available')
+        return iter(self.nodes[path[-1]])
+
+
+class GitlabProjectGraphQLTestCase(unittest.TestCase):
+    URL = 'http://localhost:3000/diaspora/diaspora-project-site'
+
+    def test_reads(self):
+        client = FakeGraphQLClient({
+            'issues': [{'id': 'gid://gitlab/Issue/43', 'iid': '3', 'title': 'Update doc', 'description': '',
+                        'state': 'closed', 'updatedAt': '2019-01-02T10:00:00Z'}],
+            'milestones': [{'id': 'gid://gitlab/Milestone/7', 'iid': '1', 'title': 'v0.11', 'state': 'active',
+                            'updatedAt': '2019-01-01T10:00:00Z'}],
+            'projectMembers': [{'user': {'id': 'gid://gitlab/User/{}'.format(JOHN['id']), 'username': 'john_smith',
+                                         'name': 'John Smith', 'state': 'active'}},
+                               {'user': None}],
+        })
+        project = GitlabProject(self.URL, client, use_graphql=True)
+        self.assertEqual(list(project.iter_issues({'updated_after': '2019-01-01T00:00:00Z'})), [
+            {'id': 43, 'iid': 3, 'title': 'Update doc', 'description': '', 'state': 'closed',
+             'updated_at': '2019-01-02T10:00:00Z'}])
+        self.assertEqual(client.queries[0], ('http://localhost:3000/api/graphql', ('project', 'issues'),
+                                             {'fullPath': 'diaspora/diaspora-project-site',
+                                              'updatedAfter': '2019-01-01T00:00:00Z'}))
+        self.assertEqual([i['id'] for i in project.iter_milestones()], [7])
+        self.assertEqual(list(project.iter_milestones({'updated_after': '2019-01-01T11:00:00Z'})), [])
+        self.assertEqual(project.get_members(), [{'id': JOHN['id'], 'username': 'john_smith',
+                                                  'name': 'John Smith', 'state': 'active'}])
+
+    def test_fallback_to_rest(self):
+        client = FakeGraphQLClient(None)
+        project = GitlabProject(self.URL, client, use_graphql=True)
+        self.assertEqual(len(list(project.iter_issues())), 2)
+        self.assertFalse(project.use_graphql)
+        self.assertEqual(sorted(i['username'] for i in project.get_members()), [JACK['username'], JOHN['username']])
+        self.assertEqual(len(client.queries), 1)
 
 
 class GitlabprojectTestCase(unittest.TestCase):
@@ -35,3 +202,48 @@ class GitlabprojectTestCase(unittest.TestCase):
         self.assertEqual(
             self.project_1.has_members([]),
             True)
+
+    def test_create_issue(self):
+        data = {'title': 'Support SSL', 'description': 'ssl', 'labels': 'Feature'}
+        meta = {'sudo_user': 'john_smith', 'must_close': True, 'attachments': [],
+                'notes': [({'body': 'first'}, {}), ({'body': 'second'}, {})]}
+        issue = self.project_1.create_issue(data, meta)
+        self.assertEqual(issue['iid'], 1)
+        issue_url = 'http://localhost:3000/api/v4/projects/3/issues/1'
+        self.assertEqual([(i[0], i[1], i[2].get('body')) for i in self.client.requests], [
+            ('POST', 'http://localhost:3000/api/v4/projects/3/issues', None),
+            ('POST', '{}/notes'.format(issue_url), 'first'),
+            ('POST', '{}/notes'.format(issue_url), 'second'),
+            ('PUT', issue_url, None),
+        ])
+        # closing sends only the state event
+        self.assertEqual(self.client.requests[-1][2], {'state_event': 'close'})
+
+    def test_create_issue_request_count(self):
+        data = {'title': 'Support SSL', 'description': 'ssl', 'labels': 'Feature', 'redmine_id': 1439,
+                'assignee_id': 2, 'milestone_id': 3, 'created_at': '2015-04-03'}
+        meta = {'sudo_user': 'john_smith', 'must_close': False, 'attachments': [], 'notes': []}
+        self.project_1.create_issue(data, meta)
+        # everything is set by the creation request
+        self.assertEqual(len(self.client.requests), 1)
+        self.assertEqual(self.client.requests[0][2], {
+            'title': 'Support SSL', 'description': 'ssl', 'labels': 'Feature', 'assignee_id': 2,
+            'milestone_id': 3, 'created_at': '2015-04-03'})
+        # the converted data is left as is
+        self.assertEqual(data['redmine_id'], 1439)
+
+    def test_create_milestone(self):
+        self.project_1.create_milestone({'title': 'v0.11', 'redmine_id': 66}, {'must_close': False})
+        self.project_1.create_milestone({'title': 'v0.10'}, {'must_close': True})
+        milestones_url = 'http://localhost:3000/api/v4/projects/3/milestones'
+        self.assertEqual([i[:2] for i in self.client.requests], [
+            ('POST', milestones_url), ('POST', milestones_url), ('PUT', '{}/202'.format(milestones_url))])
+        self.assertEqual(self.client.requests[0][2], {'title': 'v0.11'})
+        # closing sends only the state event
+        self.assertEqual(self.client.requests[-1][2], {'state_event': 'close'})
+
+    def test_create_issue_link(self):
+        self.project_1.create_issue_link(4, 7, 'blocks')
+        self.assertEqual(self.client.requests, [
+            ('POST', 'http://localhost:3000/api/v4/projects/3/issues/4/links',
+             {'target_project_id': '3', 'target_issue_iid': 7, 'link_type': 'blocks'})])
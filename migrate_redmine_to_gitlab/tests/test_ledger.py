@@ -0,0 +1,56 @@
+import tempfile
+import unittest
+
+from migrate_redmine_to_gitlab.ledger import NOTE, Ledger
+from migrate_redmine_to_gitlab.parallel import run_concurrently
+from migrate_redmine_to_gitlab.workqueue import ATTACHMENT, ISSUE, MILESTONE
+
+
+class LedgerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.ledger = Ledger(self.tmp.name)
+
+    def tearDown(self):
+        self.ledger.close()
+        self.tmp.cleanup()
+
+    def test_lookups(self):
+        self.ledger.record(ISSUE, 12, 3, 'https://gitlab/p/issues/3')
+        self.ledger.record(ISSUE, 15, 4)
+        self.ledger.record(MILESTONE, 12, 100)
+        self.ledger.record(ATTACHMENT, 7, url='/uploads/abc/file.txt')
+
+        self.assertEqual(self.ledger.gitlab_id(ISSUE, 12), 3)
+        self.assertEqual(self.ledger.gitlab_id(MILESTONE, 12), 100)
+        self.assertEqual(self.ledger.redmine_id(ISSUE, 4), 15)
+        self.assertEqual(self.ledger.url(ISSUE, 12), 'https://gitlab/p/issues/3')
+        self.assertEqual(self.ledger.url(ATTACHMENT, 7), '/uploads/abc/file.txt')
+        self.assertIsNone(self.ledger.gitlab_id(ISSUE, 13))
+        self.assertIsNone(self.ledger.redmine_id(MILESTONE, 3))
+        self.assertEqual(self.ledger.mapping(ISSUE), {12: 3, 15: 4})
+
+        # the iid command moves issues
+        self.ledger.record(ISSUE, 12, 12)
+        self.assertEqual(self.ledger.gitlab_id(ISSUE, 12), 12)
+        self.assertIsNone(self.ledger.redmine_id(ISSUE, 3))
+
+        self.ledger.forget(ISSUE, 15)
+        self.assertEqual(self.ledger.mapping(ISSUE), {12: 12})
+
+    def test_persistence(self):
+        self.ledger.record(ISSUE, 1, 1)
+        self.ledger.record(NOTE, 10, 501)
+        self.ledger.record(NOTE, 11, 502)
+        self.ledger.close()
+
+        self.ledger = Ledger(self.tmp.name)
+        self.assertEqual(self.ledger.gitlab_id(NOTE, 11), 502)
+        self.assertEqual(self.ledger.counts(), {ISSUE: 1, NOTE: 2})
+        self.assertEqual(self.ledger.summary(), '1 issue(s), 2 note(s)')
+
+    def test_threads(self):
+        self.assertEqual(self.ledger.summary(), 'nothing')
+        results = run_concurrently(lambda i: self.ledger.record(NOTE, i, i + 1000), range(50), 8)
+        self.assertTrue(all(error is None for item, result, error in results))
+        self.assertEqual(len(self.ledger.mapping(NOTE)), 50)
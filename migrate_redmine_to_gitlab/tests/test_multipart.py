@@ -0,0 +1,64 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import requests
+
+from migrate_redmine_to_gitlab.multipart import MultipartFileBody
+
+BOUNDARY = '0123456789abcdef0123456789abcdef'
+
+
+class MultipartFileBodyTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'data')
+        self.content = os.urandom(300000)
+        with open(self.path, 'wb') as f:
+            f.write(self.content)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _body(self, **kwargs):
+        return MultipartFileBody({'id': 3, 'file': 'é "quoted".png'}, 'file', 'é "quoted".png', self.path,
+                                 'image/png', boundary=BOUNDARY, **kwargs)
+
+    def test_same_bytes_as_requests(self):
+        with open(self.path, 'rb') as content:
+            with mock.patch('urllib3.filepost.choose_boundary', return_value=BOUNDARY):
+                expected = requests.Request(
+                    'POST', 'http://localhost/uploads', data={'id': 3, 'file': 'é "quoted".png'},
+                    files={'file': ('é "quoted".png', content, 'image/png')}).prepare()
+
+        with self._body() as body:
+            self.assertEqual(len(body), len(expected.body))
+            self.assertEqual(body.read(), expected.body)
+            self.assertEqual(body.content_type, expected.headers['Content-Type'])
+
+    def test_chunked_reads(self):
+        with self._body(chunk_size=4096) as body:
+            chunks = list(body)
+        self.assertTrue(all(len(i) <= 4096 for i in chunks))
+        self.assertIn(self.content, b''.join(chunks))
+        self.assertEqual(sum(len(i) for i in chunks), body.size)
+
+        with self._body() as body:
+            sizes = []
+            while True:
+                chunk = body.read(7000)
+                if not chunk:
+                    break
+                sizes.append(len(chunk))
+            self.assertEqual(sum(sizes), body.size)
+            self.assertEqual(set(sizes[:-1]), {7000})
+
+    def test_streamed_by_requests(self):
+        with self._body() as body:
+            prepared = requests.Request('POST', 'http://localhost/uploads', data=body,
+                                        headers={'Content-Type': body.content_type}).prepare()
+            # the body is not read by requests, only sent with its length
+            self.assertIs(prepared.body, body)
+            self.assertEqual(prepared.headers['Content-Length'], str(body.size))
+            self.assertNotIn('Transfer-Encoding', prepared.headers)
@@ -0,0 +1,97 @@
+import os
+import random
+import threading
+import time
+import unittest
+
+from migrate_redmine_to_gitlab.parallel import ProcessDied, RateLimiter, SharedRateLimiter, Turnstile, run_concurrently, \
+    run_lanes, run_processes
+
+
+class ParallelTestCase(unittest.TestCase):
+    def test_results_and_errors(self):
+        def func(i):
+            if i == 3:
+                raise ValueError(i)
+            return i * 2
+
+        for workers in (1, 4):
+            results = {item: (result, error) for item, result, error in run_concurrently(func, range(5), workers)}
+            self.assertEqual(sorted(results), [0, 1, 2, 3, 4])
+            self.assertEqual(results[2], (4, None))
+            self.assertIsNone(results[3][0])
+            self.assertIsInstance(results[3][1], ValueError)
+
+    def test_lanes(self):
+        started = []
+        results = list(run_lanes(started.append, [([3, 2, 1], 1), ([4, 5], 1)]))
+        self.assertEqual(sorted(i[0] for i in results), [1, 2, 3, 4, 5])
+        # each lane starts its items in order
+        self.assertEqual([i for i in started if i < 4], [3, 2, 1])
+        self.assertEqual([i for i in started if i >= 4], [4, 5])
+
+    def test_turnstile(self):
+        turnstile = Turnstile()
+        passed = []
+        lock = threading.Lock()
+
+        def func(ticket):
+            time.sleep(random.random() / 100)
+            with turnstile.turn(ticket):
+                if ticket == 3:
+                    raise ValueError(ticket)
+                with lock:
+                    passed.append(ticket)
+            time.sleep(random.random() / 100)
+
+        errors = [i[0] for i in run_concurrently(func, range(20), 4) if i[2] is not None]
+        self.assertEqual(errors, [3])
+        self.assertEqual(passed, [i for i in range(20) if i != 3])
+
+    def test_rate_limiter(self):
+        limiter = RateLimiter(100)
+        calls = []
+        func = limiter.limited(lambda i: calls.append(time.monotonic()))
+        start = time.monotonic()
+        list(run_concurrently(func, range(11), 4))
+        # 10 intervals of 10ms
+        self.assertGreaterEqual(time.monotonic() - start, 0.095)
+        self.assertEqual(len(calls), 11)
+
+        limiter = RateLimiter(None)
+        start = time.monotonic()
+        for i in range(1000):
+            limiter.wait()
+        self.assertLess(time.monotonic() - start, 0.1)
+
+
+def _square(i):
+    if i == 3:
+        raise ValueError(i)
+    return i * i
+
+
+class ProcessesTestCase(unittest.TestCase):
+    def test_run_processes(self):
+        results = {item: (result, error) for item, result, error in run_processes(_square, range(5), 2)}
+        self.assertEqual({i: results[i][0] for i in (0, 1, 2, 4)}, {0: 0, 1: 1, 2: 4, 4: 16})
+        self.assertIsInstance(results[3][1], ValueError)
+
+    def test_shared_rate_limiter(self):
+        limiter = SharedRateLimiter(20)
+        start = time.monotonic()
+        for i in range(5):
+            limiter.wait()
+        self.assertGreaterEqual(time.monotonic() - start, 0.19)
+
+    def test_process_dies(self):
+        results = {item: (result, error) for item, result, error in run_processes(_die_on_one, range(6), 2)}
+        self.assertIsInstance(results[1][1], ProcessDied)
+        self.assertEqual({i: results[i] for i in (0, 2, 3, 4, 5)},
+                         {0: (0, None), 2: (4, None), 3: (9, None), 4: (16, None), 5: (25, None)})
+
+
+def _die_on_one(i):
+    if i == 1:
+        os._exit(3)
+    return i * i
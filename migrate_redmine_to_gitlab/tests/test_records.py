@@ -0,0 +1,73 @@
+import copy
+import json
+import os
+import pickle
+import tempfile
+import tracemalloc
+import unittest
+
+from .fake import REDMINE_ISSUE_1439, REDMINE_ISSUE_1732
+from migrate_redmine_to_gitlab.records import IssueRecord
+from migrate_redmine_to_gitlab.redmine import RedmineProjectWithCache
+
+
+class IssueRecordTestCase(unittest.TestCase):
+    def test_from_dict(self):
+        record = IssueRecord.from_dict(REDMINE_ISSUE_1732)
+        self.assertEqual(record.id, 1732)
+        self.assertEqual(record.subject, 'Update doc for v1')
+        self.assertEqual(record.tracker, 'Evolution')
+        self.assertEqual(record.priority, 'Urgent')
+        self.assertEqual(record.author_id, 3)
+        self.assertEqual(record.assigned_to_id, 83)
+        self.assertEqual(record.fixed_version, None)
+        self.assertEqual(record.closed_on, '2015-09-09T15:54:49Z')
+        self.assertEqual(record.attachment_ids, ())
+
+    def test_names_are_interned(self):
+        first = IssueRecord.from_dict(copy.deepcopy(REDMINE_ISSUE_1732))
+        second = IssueRecord.from_dict(copy.deepcopy(REDMINE_ISSUE_1439))
+        self.assertIs(first.tracker, second.tracker)
+
+    def test_pickle_keeps_interning(self):
+        record = pickle.loads(pickle.dumps(IssueRecord.from_dict(copy.deepcopy(REDMINE_ISSUE_1439))))
+        self.assertEqual(record, IssueRecord.from_dict(REDMINE_ISSUE_1439))
+        self.assertIs(record.tracker, IssueRecord.from_dict(REDMINE_ISSUE_1732).tracker)
+
+    def test_memory_compared_to_dicts(self):
+        def measure(factory):
+            tracemalloc.start()
+            data = [factory(dict(copy.deepcopy(REDMINE_ISSUE_1732), id=i)) for i in range(500)]
+            size = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            del data
+            return size
+
+        dicts_size = measure(lambda issue: issue)
+        records_size = measure(IssueRecord.from_dict)
+        self.assertLess(records_size * 4, dicts_size)
+
+
+class RedmineProjectWithCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        os.makedirs(os.path.join(self.tmp.name, 'issues'))
+        with open(os.path.join(self.tmp.name, 'project.json'), 'w') as outfile:
+            json.dump({'id': 196}, outfile)
+        for issue in (REDMINE_ISSUE_1732, REDMINE_ISSUE_1439):
+            with open(os.path.join(self.tmp.name, 'issues', '{}.json'.format(issue['id'])), 'w') as outfile:
+                json.dump(issue, outfile)
+        self.project = RedmineProjectWithCache(
+            'http://localhost:9000/projects/diaspora-site', self.tmp.name, None)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_get_issue_records(self):
+        records = self.project.get_issue_records()
+        self.assertEqual([i.id for i in records], [1439, 1732])
+        self.assertEqual(records[0].fixed_version, 'v0.11')
+
+    def test_get_issue(self):
+        issue = self.project.get_issue(1732)
+        self.assertEqual(len(issue['journals']), 2)
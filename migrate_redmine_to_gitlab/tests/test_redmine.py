@@ -1,7 +1,10 @@
+import json
+import os
+import tempfile
 import unittest
 
 from .fake import FakeRedmineClient
-from migrate_redmine_to_gitlab.redmine import RedmineProject
+from migrate_redmine_to_gitlab.redmine import RedmineProject, RedmineProjectWithCache
 
 
 class RedmineTestCase(unittest.TestCase):
@@ -42,3 +45,54 @@ class RedmineTestCase(unittest.TestCase):
             self.client)
         self.assertEqual(
             project.public_url, 'http://localhost:9000/projects/diaspora-site')
+
+
+class RecordingRedmineClient:
+    def __init__(self):
+        self.requests = []
+        self.issues = {}
+
+    def get(self, url, params=None, **kwargs):
+        self.requests.append((url, params))
+        return self.issues[url]
+
+    def put(self, url, json=None, **kwargs):
+        self.requests.append((url, json))
+
+
+class RedmineLinkTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        with open(os.path.join(self.tmp.name, 'project.json'), 'w') as outfile:
+            json.dump({'id': 196}, outfile)
+        self.client = RecordingRedmineClient()
+        self.project = RedmineProjectWithCache('http://localhost:9000/projects/diaspora-site', self.tmp.name,
+                                               self.client)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_link_roadmap(self):
+        version = {'id': 66, 'name': 'v0.11', 'description': 'First release. '}
+        self.assertTrue(self.project.link_roadmap(version, 3, 'https://gitlab/p'))
+        self.assertEqual(self.client.requests, [('http://localhost:9000/versions/66.json', {'version': {
+            'name': 'v0.11', 'description': 'First release. Moved to https://gitlab/p/milestones/3'}})])
+
+        # already linked
+        self.assertFalse(self.project.link_roadmap(version, 3, 'https://gitlab/p'))
+        self.assertEqual(len(self.client.requests), 1)
+
+    def test_link_issue(self):
+        self.project.link_issue({'id': 1439, 'subject': 'Update doc'}, 12, 'https://gitlab/p')
+        self.assertEqual(self.client.requests, [('http://localhost:9000/issues/1439.json', {'issue': {
+            'notes': 'Moved to https://gitlab/p/issues/12'}})])
+
+    def test_is_issue_linked(self):
+        url = 'http://localhost:9000/issues/1439.json'
+        self.client.issues[url] = {'id': 1439, 'journals': [{'notes': 'Fixed'}, {'notes': None}]}
+        self.assertFalse(self.project.is_issue_linked({'id': 1439}, 'https://gitlab/p'))
+        self.assertEqual(self.client.requests, [(url, {'include': 'journals'})])
+
+        self.client.issues[url]['journals'].append({'notes': 'Moved to https://gitlab/p/issues/12'})
+        self.assertTrue(self.project.is_issue_linked({'id': 1439}, 'https://gitlab/p'))
+        self.assertFalse(self.project.is_issue_linked({'id': 1439}, 'https://gitlab/other'))
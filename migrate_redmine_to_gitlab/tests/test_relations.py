@@ -0,0 +1,68 @@
+import os
+import tempfile
+import unittest
+
+from migrate_redmine_to_gitlab.relations import CHECKPOINT_FILE, RelationCheckpoint, iter_links, relation_link
+
+
+def _relation(issue_id, issue_to_id, relation_type):
+    return {'id': issue_id * 100 + issue_to_id, 'issue_id': issue_id, 'issue_to_id': issue_to_id,
+            'relation_type': relation_type}
+
+
+class FakeRedmine:
+    def __init__(self, issues):
+        self.issues = issues
+
+    def get_issue(self, issue_id):
+        return self.issues[issue_id]
+
+
+class RelationLinkTestCase(unittest.TestCase):
+    def test_both_sides_give_one_link(self):
+        self.assertEqual(relation_link(_relation(3, 2, 'relates')), (2, 3, 'relates_to'))
+        self.assertEqual(relation_link(_relation(2, 3, 'relates')), (2, 3, 'relates_to'))
+        self.assertEqual(relation_link(_relation(2, 3, 'blocks')), (2, 3, 'blocks'))
+        self.assertEqual(relation_link(_relation(3, 2, 'blocked')), (2, 3, 'blocks'))
+        self.assertEqual(relation_link(_relation(3, 2, 'follows')), (2, 3, 'blocks'))
+
+    def test_unknown_type(self):
+        self.assertIsNone(relation_link(_relation(2, 3, 'ref')))
+
+    def test_iter_links(self):
+        # redmine lists a relation in both of its issues
+        relates, blocks = _relation(1, 2, 'relates'), _relation(2, 3, 'blocks')
+        redmine = FakeRedmine({
+            1: {'id': 1, 'relations': [relates]},
+            2: {'id': 2, 'relations': [relates, blocks, _relation(2, 1, 'relates')]},
+            3: {'id': 3, 'relations': [blocks, _relation(3, 9, 'ref')]},
+            4: {'id': 4},
+        })
+        self.assertEqual(list(iter_links(redmine, [1, 2, 3, 4])), [(1, 2, 'relates_to'), (2, 3, 'blocks')])
+
+
+class RelationCheckpointTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_resume(self):
+        checkpoint = RelationCheckpoint(self.tmp.name)
+        checkpoint.add((1, 2, 'relates_to'))
+        checkpoint.add((2, 3, 'blocks'))
+        # interrupted while writing
+        with open(os.path.join(self.tmp.name, CHECKPOINT_FILE), 'a') as outfile:
+            outfile.write('4 5')
+
+        checkpoint = RelationCheckpoint(self.tmp.name)
+        self.assertEqual(len(checkpoint), 2)
+        self.assertIn((2, 3, 'blocks'), checkpoint)
+        self.assertNotIn((3, 2, 'blocks'), checkpoint)
+
+        # the next link is not appended to the partial line
+        checkpoint.add((5, 6, 'blocks'))
+        checkpoint = RelationCheckpoint(self.tmp.name)
+        self.assertEqual(len(checkpoint), 3)
+        self.assertIn((5, 6, 'blocks'), checkpoint)
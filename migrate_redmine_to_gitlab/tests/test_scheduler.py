@@ -0,0 +1,71 @@
+import threading
+import unittest
+
+from migrate_redmine_to_gitlab.scheduler import DependencyError, TaskGraph
+
+
+class TaskGraphTestCase(unittest.TestCase):
+    def setUp(self):
+        self.graph = TaskGraph()
+        self.done = []
+        self._lock = threading.Lock()
+
+    def _task(self, key, fail=False):
+        def func():
+            with self._lock:
+                self.done.append(key)
+            if fail:
+                raise ValueError(key)
+            return key
+        return func
+
+    def _run(self, workers=4):
+        return {key: (result, error) for key, result, error in self.graph.run(workers)}
+
+    def test_prerequisites_first(self):
+        self.graph.add('issue', self._task('issue'), requires=['milestone', 'attachment'])
+        self.graph.add('link', self._task('link'), requires=['issue', 'other'])
+        self.graph.add('attachment', self._task('attachment'))
+        self.graph.add('milestone', self._task('milestone'))
+        results = self._run()
+
+        self.assertEqual(results['link'], ('link', None))
+        self.assertEqual(sorted(self.done[:2]), ['attachment', 'milestone'])
+        self.assertEqual(self.done[2:], ['issue', 'link'])
+
+    def test_failed_prerequisite(self):
+        self.graph.add('attachment', self._task('attachment', fail=True))
+        self.graph.add('issue', self._task('issue'), requires=['attachment'])
+        self.graph.add('notes', self._task('notes'), requires=['issue'])
+        self.graph.add('next', self._task('next'), after=['issue'])
+        results = self._run()
+
+        self.assertIsInstance(results['attachment'][1], ValueError)
+        self.assertIsInstance(results['issue'][1], DependencyError)
+        self.assertIsInstance(results['notes'][1], DependencyError)
+        # ordering prerequisites only need to be over
+        self.assertEqual(results['next'], ('next', None))
+        self.assertEqual(sorted(self.done), ['attachment', 'next'])
+
+    def test_order(self):
+        previous = None
+        for i in range(20):
+            self.graph.add(i, self._task(i), after=[previous] if previous is not None else [])
+            previous = i
+        self._run()
+        self.assertEqual(self.done, list(range(20)))
+
+    def test_circular(self):
+        self.graph.add('a', self._task('a'), requires=['b'])
+        self.graph.add('b', self._task('b'), requires=['a'])
+        self.graph.add('c', self._task('c'))
+        results = self._run()
+
+        self.assertEqual(results['c'], ('c', None))
+        self.assertIsInstance(results['a'][1], DependencyError)
+        self.assertEqual(self.done, ['c'])
+
+    def test_added_twice(self):
+        self.graph.add('a', self._task('a'))
+        with self.assertRaises(ValueError):
+            self.graph.add('a', self._task('a'))
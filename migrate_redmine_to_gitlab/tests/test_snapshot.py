@@ -0,0 +1,145 @@
+import tempfile
+import unittest
+
+from .fake import JACK, JOHN
+from migrate_redmine_to_gitlab.snapshot import GitlabSnapshot, redmine_id_of
+
+PROJECT_URL = 'http://localhost:3000/diaspora/diaspora-project-site'
+
+
+class FakeProject:
+    def __init__(self):
+        self.project = {'id': 3}
+        self.issues = [
+            {'id': 43, 'iid': 1, 'title': '-RM-1732-MR-Update doc', 'description': '', 'state': 'closed',
+             'updated_at': '2019-01-01T10:00:00Z'},
+            {'id': 44, 'iid': 2, 'title': 'Support SSL',
+             'description': 'ssl\n\n*(from redmine issue 1439 created on 2015-04-03)*', 'state': 'opened',
+             'updated_at': '2019-01-02T10:00:00Z'},
+        ]
+        self.milestones = [{'id': 7, 'iid': 1, 'title': 'v0.11', 'state': 'active',
+                            'updated_at': '2019-01-01T10:00:00Z'}]
+        self.params = []
+
+    def iter_issues(self, params=None):
+        self.params.append(('issues', params))
+        after = (params or {}).get('updated_after', '')
+        return iter([i for i in self.issues if i['updated_at'] >= after])
+
+    def iter_milestones(self, params=None):
+        self.params.append(('milestones', params))
+        after = (params or {}).get('updated_after', '')
+        return iter([i for i in self.milestones if i['updated_at'] >= after])
+
+    def count_issues(self):
+        return len(self.issues)
+
+    def count_milestones(self):
+        return len(self.milestones)
+
+    def get_members(self):
+        return [JOHN, JACK]
+
+
+class GitlabSnapshotTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.gitlab = FakeProject()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _snapshot(self, url=PROJECT_URL):
+        return GitlabSnapshot(self.tmp.name, url)
+
+    def test_redmine_id_of(self):
+        self.assertEqual(redmine_id_of(self.gitlab.issues[0]), 1732)
+        self.assertEqual(redmine_id_of(self.gitlab.issues[1]), 1439)
+        self.assertEqual(redmine_id_of({'title': 'foo', 'description': None}), None)
+
+    def test_indexes(self):
+        snapshot = self._snapshot()
+        snapshot.refresh(self.gitlab)
+        self.assertEqual(snapshot.issues_by_iid[2]['id'], 44)
+        self.assertEqual(snapshot.issues_by_redmine_id[1732]['iid'], 1)
+        self.assertEqual(snapshot.milestones_by_title['v0.11']['id'], 7)
+        self.assertEqual(snapshot.get_milestone_by_id(7)['title'], 'v0.11')
+        self.assertRaises(ValueError, snapshot.get_milestone_by_id, 8)
+        self.assertEqual(snapshot.members_by_username['john_smith']['id'], JOHN['id'])
+
+    def test_incremental_refresh(self):
+        self._snapshot().refresh(self.gitlab)
+
+        snapshot = self._snapshot()
+        self.assertEqual(snapshot.project, {'id': 3})
+        self.assertEqual(len(snapshot.issues_by_iid), 2)
+
+        self.gitlab.params = []
+        self.gitlab.issues[0] = dict(self.gitlab.issues[0], title='Update doc', updated_at='2019-01-03T10:00:00Z')
+        snapshot.refresh(self.gitlab)
+        self.assertEqual(self.gitlab.params, [('issues', {'updated_after': '2019-01-02T10:00:00Z'}),
+                                              ('milestones', {'updated_after': '2019-01-01T10:00:00Z'})])
+        self.assertEqual(snapshot.issues_by_iid[1]['title'], 'Update doc')
+        self.assertEqual(snapshot.issues_by_redmine_id[1732]['iid'], 1)
+
+    def test_deleted_issues_trigger_full_refresh(self):
+        self._snapshot().refresh(self.gitlab)
+        del self.gitlab.issues[1]
+        self.gitlab.params = []
+
+        snapshot = self._snapshot()
+        snapshot.refresh(self.gitlab)
+        self.assertEqual(self.gitlab.params[1], ('issues', None))
+        self.assertEqual(list(snapshot.issues_by_iid), [1])
+        self.assertNotIn(1439, snapshot.issues_by_redmine_id)
+
+    def test_deleted_and_created_objects_trigger_full_refresh(self):
+        self._snapshot().refresh(self.gitlab)
+        # as many issues and milestones as before, but not the same ones
+        self.gitlab.issues[1] = {'id': 45, 'iid': 3, 'title': 'New', 'description': '', 'state': 'opened',
+                                 'updated_at': '2019-02-01T10:00:00Z'}
+        self.gitlab.milestones[0] = {'id': 8, 'iid': 2, 'title': 'v0.12', 'state': 'active',
+                                     'updated_at': '2019-02-01T10:00:00Z'}
+        self.gitlab.params = []
+
+        snapshot = self._snapshot()
+        snapshot.refresh(self.gitlab)
+        self.assertIn(('issues', None), self.gitlab.params)
+        self.assertIn(('milestones', None), self.gitlab.params)
+        self.assertEqual(sorted(snapshot.issues_by_iid), [1, 3])
+        self.assertNotIn(1439, snapshot.issues_by_redmine_id)
+        self.assertEqual(list(snapshot.milestones_by_title), ['v0.12'])
+
+    def test_recreated_project_triggers_full_refresh(self):
+        self._snapshot().refresh(self.gitlab)
+        self.gitlab.project = {'id': 4}
+        self.gitlab.issues = self.gitlab.issues[:1]
+        self.gitlab.params = []
+
+        snapshot = self._snapshot()
+        snapshot.refresh(self.gitlab)
+        self.assertEqual(self.gitlab.params, [('issues', None), ('milestones', None)])
+        self.assertEqual(snapshot.project, {'id': 4})
+        self.assertEqual(list(snapshot.issues_by_iid), [1])
+
+    def test_record_new_objects(self):
+        snapshot = self._snapshot()
+        snapshot.refresh(self.gitlab)
+        snapshot.record_issue({'id': 45, 'iid': 3, 'title': 'New', 'state': 'opened', 'redmine_id': 12,
+                               'updated_at': '2019-02-01T10:00:00Z', 'author': JOHN})
+        snapshot.save()
+
+        snapshot = self._snapshot()
+        self.assertEqual(snapshot.issues_by_redmine_id[12], {
+            'id': 45, 'iid': 3, 'title': 'New', 'state': 'opened', 'redmine_id': 12,
+            'updated_at': '2019-02-01T10:00:00Z'})
+        snapshot.forget_issue(3)
+        self.assertNotIn(12, snapshot.issues_by_redmine_id)
+        snapshot.forget_milestone(7)
+        self.assertEqual((snapshot.milestones_by_id, snapshot.milestones_by_title), ({}, {}))
+
+    def test_snapshot_of_another_project_is_ignored(self):
+        self._snapshot().refresh(self.gitlab)
+        snapshot = self._snapshot('http://localhost:3000/brightbox/puppet')
+        self.assertEqual(snapshot.project, None)
+        self.assertEqual(snapshot.issues_by_iid, {})
@@ -0,0 +1,14 @@
+import unittest
+
+from migrate_redmine_to_gitlab.sql import parse_rows, parse_update_counts
+
+
+class SqlOutputTestCase(unittest.TestCase):
+    def test_parse_rows(self):
+        self.assertEqual(parse_rows('3|Update doc\n12|-RM-12-MR-Support SSL\n\n'),
+                         [['3', 'Update doc'], ['12', '-RM-12-MR-Support SSL']])
+        self.assertEqual(parse_rows('\n'), [])
+
+    def test_parse_update_counts(self):
+        self.assertEqual(parse_update_counts('BEGIN\nUPDATE 12\nUPDATE 12\nUPDATE 1\nCOMMIT\n'), [12, 12, 1])
+        self.assertEqual(parse_update_counts('ROLLBACK\n'), [])
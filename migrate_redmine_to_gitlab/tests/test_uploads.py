@@ -0,0 +1,162 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from migrate_redmine_to_gitlab.converters import convert_attachment
+from migrate_redmine_to_gitlab.parallel import run_concurrently
+from migrate_redmine_to_gitlab.uploads import AttachmentUploader, is_uploaded, large_file_workers, MB, UPLOADS_FILE
+
+
+class FakeAttachmentProject:
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.paths = []
+        self.lock = threading.Lock()
+
+    def get_id(self):
+        return 3
+
+    def create_attachment(self, data, path=None):
+        name = data['redmine']['filename']
+        if name in self.failing:
+            raise IOError('upload failed')
+        with self.lock:
+            self.paths.append(path)
+        alt = os.path.splitext(name)[0]
+        return {'alt': alt, 'url': '/uploads/x/{}'.format(name), 'markdown': '![{}](/uploads/x/{})'.format(alt, name)}
+
+
+class SlowAttachmentProject(FakeAttachmentProject):
+    """ Uploads take long enough for concurrent uploads to overlap """
+
+    def create_attachment(self, data, path=None):
+        time.sleep(0.1)
+        return super().create_attachment(data, path)
+
+
+class FakeCache:
+    def __init__(self):
+        self.attachments = []
+
+    def load_attachment(self, attachment):
+        self.attachments.append(attachment)
+
+
+def _attachment(_id, filename, filesize=10):
+    return {'id': _id, 'filename': filename, 'filesize': filesize, 'file': '/nowhere/{}'.format(filename)}
+
+
+class AttachmentUploaderTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        os.makedirs(os.path.join(self.tmp.name, 'attachments'))
+        self.cache = FakeCache()
+
+    def _write_data(self, _id, content):
+        with open(os.path.join(self.tmp.name, 'attachments', '{}.data'.format(_id)), 'wb') as f:
+            f.write(content)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_upload(self):
+        for i in (1, 2, 3):
+            self._write_data(i, str(i).encode())
+        gitlab = FakeAttachmentProject(failing=['b.txt'])
+        attachments = [_attachment(1, 'a.txt'), _attachment(2, 'b.txt'), _attachment(3, 'c.txt')]
+        data = [convert_attachment(3, i) for i in attachments]
+
+        created, failed = AttachmentUploader(gitlab, self.cache, self.tmp.name, workers=2).upload(data)
+        self.assertEqual(sorted(i['redmine']['id'] for i in created), [1, 3])
+        self.assertEqual([i['redmine']['id'] for i in failed], [2])
+
+        # results are persisted as they complete, tagged with the gitlab project
+        self.assertEqual(sorted(i['id'] for i in self.cache.attachments), [1, 3])
+        self.assertTrue(is_uploaded(attachments[0], 3))
+        self.assertFalse(is_uploaded(attachments[0], 4))
+        self.assertFalse(is_uploaded(attachments[1], 3))
+
+        gitlab.failing = set()
+        created, failed = AttachmentUploader(gitlab, self.cache, self.tmp.name, workers=2).upload(failed)
+        self.assertEqual((len(created), failed), (1, []))
+        # the data downloaded in the cache is preferred to the original path
+        self.assertIn(os.path.join(self.tmp.name, 'attachments', '2.data'), gitlab.paths)
+
+    def test_same_content_is_uploaded_once(self):
+        for i in (1, 2, 3):
+            self._write_data(i, b'same screenshot')
+        self._write_data(4, b'another one')
+        gitlab = FakeAttachmentProject()
+        attachments = [_attachment(1, 'a.png'), _attachment(2, 'b.png'), _attachment(3, 'a.png'),
+                       _attachment(4, 'd.png')]
+
+        created, failed = AttachmentUploader(gitlab, self.cache, self.tmp.name).upload(
+            [convert_attachment(3, i) for i in attachments[:3]])
+        self.assertEqual((len(created), failed, len(gitlab.paths)), (3, [], 1))
+        self.assertEqual(attachments[0]['gitlab']['url'], attachments[1]['gitlab']['url'])
+        self.assertEqual(attachments[0]['gitlab'], attachments[2]['gitlab'])
+        # each attachment keeps its own name
+        self.assertEqual(attachments[1]['gitlab']['alt'], 'b')
+        self.assertEqual(attachments[1]['gitlab']['markdown'], '![b](/uploads/x/a.png)')
+        self.assertTrue(os.path.exists(os.path.join(self.tmp.name, UPLOADS_FILE)))
+
+        # known contents are not uploaded again on the next runs, for the same project only
+        for i in attachments:
+            i.pop('gitlab', None)
+        created, failed = AttachmentUploader(gitlab, self.cache, self.tmp.name).upload(
+            [convert_attachment(3, i) for i in attachments])
+        self.assertEqual((len(created), failed, len(gitlab.paths)), (4, [], 2))
+
+        gitlab.get_id = lambda: 4
+        AttachmentUploader(gitlab, self.cache, self.tmp.name).upload([convert_attachment(4, attachments[0])])
+        self.assertEqual(len(gitlab.paths), 3)
+        self.assertEqual(attachments[0]['gitlab']['project_id'], 4)
+
+    def test_lanes_by_size(self):
+        self.assertEqual(large_file_workers(None, 8), 2)
+        self.assertEqual(large_file_workers(1 * MB, 8), 1)
+        self.assertEqual(large_file_workers(100 * MB, 8), 8)
+
+        sizes = {1: 10, 2: 20 * MB, 3: 10, 4: 50 * MB, 5: 5 * MB, 6: 500 * MB}
+        for i in sizes:
+            self._write_data(i, str(i).encode())
+        gitlab = FakeAttachmentProject()
+        attachments = [_attachment(i, '{}.bin'.format(i), size) for i, size in sizes.items()]
+        uploader = AttachmentUploader(gitlab, self.cache, self.tmp.name, workers=4, bandwidth=1 * MB,
+                                      link_above=100 * MB)
+        created, failed = uploader.upload([convert_attachment(3, i) for i in attachments])
+
+        self.assertEqual((sorted(i['redmine']['id'] for i in created), failed), ([1, 2, 3, 4, 5], []))
+        # the large files lane has one worker and starts with the largest file
+        large_files = [i for i in map(os.path.basename, gitlab.paths) if i in ('2.data', '4.data', '5.data')]
+        self.assertEqual(large_files, ['4.data', '2.data', '5.data'])
+        # the largest file is linked to redmine
+        self.assertNotIn('gitlab', attachments[5])
+
+    def test_upload_one(self):
+        for i in (1, 2):
+            self._write_data(i, b'same screenshot')
+        gitlab = FakeAttachmentProject()
+        uploader = AttachmentUploader(gitlab, self.cache, self.tmp.name, link_above=100)
+        first = uploader.upload_one(convert_attachment(3, _attachment(1, 'a.png')))
+        second = uploader.upload_one(convert_attachment(3, _attachment(2, 'b.png')))
+        self.assertIsNone(uploader.upload_one(convert_attachment(3, _attachment(3, 'c.png', filesize=200))))
+
+        # the content is uploaded once, the second attachment reuses it under its name
+        self.assertEqual(len(gitlab.paths), 1)
+        self.assertEqual(first['url'], second['url'])
+        self.assertEqual(second['alt'], 'b')
+        self.assertEqual(sorted(i['id'] for i in self.cache.attachments), [1, 2])
+
+    def test_upload_one_concurrently(self):
+        for i in (1, 2, 3):
+            self._write_data(i, b'same screenshot')
+        gitlab = SlowAttachmentProject()
+        uploader = AttachmentUploader(gitlab, self.cache, self.tmp.name)
+        results = list(run_concurrently(
+            lambda i: uploader.upload_one(convert_attachment(3, _attachment(i, 'a.png'))), (1, 2, 3), 3))
+        self.assertTrue(all(error is None for item, result, error in results))
+        self.assertEqual(len(gitlab.paths), 1)
+        self.assertEqual(len(set(result['url'] for item, result, error in results)), 1)
@@ -0,0 +1,75 @@
+import os
+import tempfile
+import threading
+import unittest
+
+from .fake import JACK, JOHN
+from migrate_redmine_to_gitlab.converters import redmine_uid_to_gitlab_uid
+from migrate_redmine_to_gitlab.users import GitlabUserResolver
+
+INSTANCE_URL = 'http://localhost:3000/api/v4'
+
+
+class FakeUsersClient:
+    def __init__(self, users):
+        self.users = {i['username']: i for i in users}
+        self.lookups = []
+        self.lock = threading.Lock()
+
+    def get(self, url, params=None):
+        assert url == '{}/users'.format(INSTANCE_URL)
+        with self.lock:
+            self.lookups.append(params['username'])
+        user = self.users.get(params['username'])
+        return [user] if user else []
+
+
+class GitlabUserResolverTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache_path = os.path.join(self.tmp.name, 'users', 'gitlab-users.json')
+        self.client = FakeUsersClient([JOHN, JACK])
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _resolver(self, **kwargs):
+        return GitlabUserResolver(self.client, INSTANCE_URL, cache_path=self.cache_path, **kwargs)
+
+    def test_resolve_only_referenced_users(self):
+        resolver = self._resolver()
+        found = resolver.resolve(['john_smith', 'macha_smith'])
+        self.assertEqual(sorted(found), ['john_smith'])
+        self.assertEqual(found['john_smith']['id'], JOHN['id'])
+        self.assertNotIn('avatar_url', found['john_smith'])
+        self.assertEqual(sorted(self.client.lookups), ['john_smith', 'macha_smith'])
+
+        # second lookups are served from memory, including missing users
+        self.assertIn('john_smith', resolver)
+        self.assertNotIn('macha_smith', resolver)
+        self.assertRaises(KeyError, lambda: resolver['macha_smith'])
+        self.assertEqual(len(self.client.lookups), 2)
+
+    def test_disk_cache_shared_between_resolvers(self):
+        self._resolver().resolve(['john_smith', 'macha_smith'])
+        self.assertTrue(os.path.exists(self.cache_path))
+
+        resolver = self._resolver()
+        self.assertEqual(resolver.resolve(['john_smith', 'macha_smith']).keys(), {'john_smith'})
+        # missing users are not persisted, so they are looked up again
+        self.assertEqual(sorted(self.client.lookups), ['john_smith', 'macha_smith', 'macha_smith'])
+
+    def test_disk_cache_expires(self):
+        self._resolver().resolve(['john_smith'])
+        self._resolver(ttl=0).resolve(['john_smith'])
+        self.assertEqual(self.client.lookups, ['john_smith', 'john_smith'])
+
+    def test_lru_is_bounded(self):
+        resolver = GitlabUserResolver(self.client, INSTANCE_URL, lru_size=1)
+        resolver.resolve(['john_smith', 'jack_smith'])
+        self.assertEqual(len(resolver._lru), 1)
+
+    def test_feeds_converters(self):
+        resolver = self._resolver()
+        redmine_user_index = {83: {'id': 83, 'login': 'john_smith'}}
+        self.assertEqual(redmine_uid_to_gitlab_uid(83, redmine_user_index, resolver), JOHN['id'])
@@ -0,0 +1,75 @@
+import copy
+import hashlib
+import json
+import os
+import tempfile
+import unittest
+
+from .fake import REDMINE_ISSUE_1439, REDMINE_ISSUE_1732
+from migrate_redmine_to_gitlab.verify import verify_cache
+
+CONTENT = b'some attachment content'
+
+
+class VerifyCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = self.tmp.name
+        issue = copy.deepcopy(REDMINE_ISSUE_1732)
+        issue['attachments'] = [{'id': 10, 'filename': 'doc.txt'}]
+        self._store('issues', issue)
+        self._store('issues', REDMINE_ISSUE_1439)
+        self._store('users', {'id': 3, 'login': 'jack_smith'})
+        self._store('users', {'id': 83, 'login': 'john_smith'})
+        self._store('versions', {'id': 66, 'name': 'v0.11', 'status': 'open', 'created_on': '2015-11-16T10:11:44Z'})
+        self._store('attachments', {'id': 10, 'filename': 'doc.txt', 'filesize': len(CONTENT),
+                                    'content_url': 'http://localhost:9000/attachments/download/10/doc.txt',
+                                    'digest': hashlib.md5(CONTENT).hexdigest()})
+        with open(os.path.join(self.path, 'attachments', '10.data'), 'wb') as outfile:
+            outfile.write(CONTENT)
+        with open(os.path.join(self.path, 'project.json'), 'w') as outfile:
+            json.dump({'id': 196}, outfile)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _store(self, kind, data):
+        path = os.path.join(self.path, kind)
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, '{}.json'.format(data['id'])), 'w') as outfile:
+            json.dump(data, outfile)
+
+    def _errors(self, jobs=1):
+        return sorted((i['error'], str(i['id'])) for i in verify_cache(self.path, jobs)['errors'])
+
+    def test_valid_cache(self):
+        report = verify_cache(self.path, jobs=1)
+        self.assertTrue(report['ok'])
+        self.assertEqual(report['counts'], {'issues': 2, 'users': 2, 'versions': 1, 'attachments': 1})
+        self.assertEqual(json.loads(json.dumps(report)), report)
+
+    def test_invalid_json(self):
+        with open(os.path.join(self.path, 'users', '3.json'), 'w') as outfile:
+            outfile.write('{"id": 3, "log')
+        self.assertEqual(self._errors(), [('invalid_json', '3'), ('missing_user', '1439'), ('missing_user', '1732')])
+
+    def test_attachment_content(self):
+        with open(os.path.join(self.path, 'attachments', '10.data'), 'wb') as outfile:
+            outfile.write(CONTENT.upper())
+        self.assertEqual(self._errors(), [('digest_mismatch', '10')])
+
+        with open(os.path.join(self.path, 'attachments', '10.data'), 'wb') as outfile:
+            outfile.write(CONTENT[:-1])
+        self.assertEqual(self._errors(), [('size_mismatch', '10')])
+
+        os.remove(os.path.join(self.path, 'attachments', '10.data'))
+        self.assertEqual(self._errors(), [('missing_data', '10')])
+
+    def test_missing_references(self):
+        os.remove(os.path.join(self.path, 'versions', '66.json'))
+        os.remove(os.path.join(self.path, 'attachments', '10.json'))
+        self.assertEqual(self._errors(), [('missing_attachment', '1732'), ('missing_version', '1439')])
+
+    def test_parallel_matches_serial(self):
+        os.remove(os.path.join(self.path, 'users', '83.json'))
+        self.assertEqual(self._errors(jobs=2), self._errors(jobs=1))
@@ -0,0 +1,63 @@
+import tempfile
+import unittest
+
+from migrate_redmine_to_gitlab.parallel import run_concurrently
+from migrate_redmine_to_gitlab.workqueue import DONE, FAILED, IN_FLIGHT, ISSUE, MILESTONE, PENDING, WorkQueue
+
+
+class WorkQueueTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.queue = WorkQueue(self.tmp.name)
+
+    def tearDown(self):
+        self.queue.close()
+        self.tmp.cleanup()
+
+    def test_states(self):
+        self.queue.add(ISSUE, [1, 2, 3])
+        self.queue.start(ISSUE, 1)
+        self.queue.done(ISSUE, 1)
+        self.queue.start(ISSUE, 2)
+        self.queue.fail(ISSUE, 2, ValueError('boom'))
+        self.queue.start(ISSUE, 2)
+        self.queue.fail(ISSUE, 2, ValueError('boom again'))
+        self.queue.start(ISSUE, 3)
+
+        self.assertEqual(self.queue.counts(ISSUE), {DONE: 1, FAILED: 1, IN_FLIGHT: 1})
+        self.assertEqual(self.queue.failures(ISSUE), [('2', 2, 'boom again')])
+        self.assertEqual(self.queue.failures(ISSUE, [1, 3]), [])
+        self.assertEqual(self.queue.counts(MILESTONE), {})
+
+        # known items keep their state
+        self.queue.add(ISSUE, [1, 4])
+        self.assertTrue(self.queue.is_done(ISSUE, 1))
+        self.assertEqual(self.queue.get(ISSUE, 4)['state'], PENDING)
+        self.assertIsNone(self.queue.get(ISSUE, 5))
+
+    def test_resume(self):
+        self.queue.add(ISSUE, [1, 2])
+        self.queue.start(ISSUE, 1)
+        self.queue.save_progress(ISSUE, 1, {'issue': {'iid': 4}, 'notes': 2})
+        self.queue.start(ISSUE, 2)
+        self.queue.done(ISSUE, 2)
+        self.queue.close()
+
+        # as after the process was killed
+        self.queue = WorkQueue(self.tmp.name)
+        self.assertEqual(self.queue.done_ids(ISSUE), {'2'})
+        state = self.queue.get(ISSUE, 1)
+        self.assertEqual((state['state'], state['attempts']), (IN_FLIGHT, 1))
+        self.assertEqual(state['progress'], {'issue': {'iid': 4}, 'notes': 2})
+
+        self.queue.forget(ISSUE, 2)
+        self.assertEqual(self.queue.done_ids(ISSUE), set())
+
+    def test_threads(self):
+        def func(i):
+            self.queue.start(MILESTONE, i)
+            self.queue.done(MILESTONE, i)
+
+        self.queue.add(MILESTONE, range(50))
+        self.assertTrue(all(error is None for item, result, error in run_concurrently(func, range(50), 8)))
+        self.assertEqual(self.queue.counts(MILESTONE), {DONE: 50})
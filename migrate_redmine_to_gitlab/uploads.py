@@ -0,0 +1,250 @@
+import json
+import logging
+import os
+import threading
+import time
+
+from .cache import attachment_data_path, file_digest
+from .parallel import DEFAULT_WORKERS, run_concurrently, run_lanes
+
+""" Upload of redmine attachments to gitlab
+"""
+
+log = logging.getLogger(__name__)
+
+UPLOADS_FILE = 'uploads.json'
+
+MB = 1024 * 1024
+
+# files above this size go to the large files lane
+LARGE_FILE_SIZE = 4 * MB
+LARGE_FILE_WORKERS = 2
+# bandwidth, in bytes per second, given to each large upload when sizing the lane
+LARGE_FILE_BANDWIDTH = 5 * MB
+
+
+def large_file_workers(bandwidth, workers):
+    """ Number of concurrent large uploads for the available bandwidth (bytes per second, None if unknown)
+    """
+    if bandwidth is None:
+        return min(LARGE_FILE_WORKERS, workers)
+    return max(1, min(workers, int(bandwidth // LARGE_FILE_BANDWIDTH)))
+
+
+def is_uploaded(redmine_attachment, gitlab_project_id):
+    """ Whether an attachment was already uploaded to the given gitlab project
+    """
+    gitlab_attachment = redmine_attachment.get('gitlab')
+    return gitlab_attachment is not None and gitlab_attachment.get('project_id') == gitlab_project_id
+
+
+def reuse_upload(upload, filename):
+    """ Returns a gitlab upload pointing to the content of another one, under its own filename
+    """
+    alt = os.path.splitext(filename)[0]
+    reused = dict(upload, alt=alt)
+    if 'markdown' in upload:
+        reused['markdown'] = upload['markdown'].replace('[{}]'.format(upload['alt']), '[{}]'.format(alt), 1)
+    return reused
+
+
+class UploadIndex:
+    """ Gitlab uploads by content digest, per gitlab project, persisted in the redmine cache
+
+    :param cache_dir: the redmine cache directory
+    """
+
+    def __init__(self, cache_dir):
+        self.path = os.path.join(cache_dir, UPLOADS_FILE)
+        self.uploads = {}
+        self._lock = threading.Lock()
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as infile:
+                self.uploads = json.load(infile)
+
+    def get(self, gitlab_project_id, digest):
+        return self.uploads.get(str(gitlab_project_id), {}).get(digest)
+
+    def record(self, gitlab_project_id, digest, upload):
+        with self._lock:
+            self.uploads.setdefault(str(gitlab_project_id), {})[digest] = upload
+
+    def save(self):
+        with self._lock:
+            tmp_path = '{}.tmp'.format(self.path)
+            with open(tmp_path, 'w') as outfile:
+                json.dump(self.uploads, outfile)
+            os.replace(tmp_path, self.path)
+
+
+class AttachmentUploader:
+    """ Uploads attachments to a gitlab project from a pool of workers
+
+    Each upload result is stored in the cache as soon as it completes (under
+    the ``gitlab`` key of the redmine attachment), so an interrupted run
+    loses nothing.
+
+    Contents are identified by their sha256 digest: a content is uploaded
+    once per gitlab project, all the attachments sharing it reuse the same
+    upload, on this run and the next ones (see :class:`UploadIndex`).
+
+    Uploads are scheduled in two lanes, so that small files do not wait
+    behind large ones: small files are uploaded by ``workers`` threads,
+    large files (above ``large_file_size``) by a few threads sized by the
+    available ``bandwidth``, largest first.
+
+    :param gitlab: the :class:`GitlabProject`
+    :param cache: the :class:`RedmineCacheWriter`
+    :param cache_dir: the redmine cache directory
+    :param workers: number of concurrent uploads of small files
+    :param bandwidth: available upload bandwidth, in bytes per second (None if unknown)
+    :param large_file_size: size above which a file goes to the large files lane
+    :param link_above: size above which a file is not uploaded, the issue links to redmine instead (None to
+        upload everything)
+    """
+
+    def __init__(self, gitlab, cache, cache_dir, workers=DEFAULT_WORKERS, bandwidth=None,
+                 large_file_size=LARGE_FILE_SIZE, link_above=None):
+        self.gitlab = gitlab
+        self.cache = cache
+        self.cache_dir = cache_dir
+        self.workers = workers
+        self.large_file_workers = large_file_workers(bandwidth, workers)
+        self.large_file_size = large_file_size
+        self.link_above = link_above
+        self.index = UploadIndex(cache_dir)
+        # reason of the last failure, by redmine attachment id
+        self.errors = {}
+        # held while a content is looked up and uploaded by upload_one, by digest
+        self._content_locks = {}
+        self._lock = threading.Lock()
+
+    def upload(self, attachments_data):
+        """ Uploads attachments, as converted by ``convert_attachment``
+
+        :return: couple: list of uploaded attachments data, list of failed ones
+        """
+        gitlab_id = self.gitlab.get_id()
+        if self.link_above is not None:
+            linked = [i for i in attachments_data if i['redmine']['filesize'] > self.link_above]
+            if linked:
+                log.info('{} attachment(s) larger than {} bytes are not uploaded, they link to redmine'.format(
+                    len(linked), self.link_above))
+                attachments_data = [i for i in attachments_data if i['redmine']['filesize'] <= self.link_above]
+        total = len(attachments_data)
+        created = []
+        failed = []
+        start = time.time()
+
+        digests = [None] * total
+        for i, digest, error in run_concurrently(
+                lambda i: self._digest(attachments_data[i]), range(total), self.workers):
+            if error is not None:
+                failed.append(attachments_data[i])
+                self.errors[attachments_data[i]['redmine']['id']] = str(error)
+                log.error('Could not read attachment {}: {}'.format(attachments_data[i]['redmine']['id'], error))
+            digests[i] = digest
+
+        # attachments by digest, the first one of each is uploaded
+        by_digest = {}
+        for data, digest in zip(attachments_data, digests):
+            if digest is not None:
+                by_digest.setdefault(digest, []).append(data)
+
+        to_upload = []
+        for digest, same_data in by_digest.items():
+            upload = self.index.get(gitlab_id, digest)
+            if upload is None:
+                to_upload.append(digest)
+            else:
+                created += self._store(gitlab_id, upload, same_data)
+        if created:
+            log.info('{} attachment(s) reuse content already uploaded'.format(len(created)))
+        log.info('{} attachment(s) to upload, {} distinct content(s)'.format(
+            sum(len(by_digest[i]) for i in to_upload), len(to_upload)))
+
+        def size(digest):
+            return by_digest[digest][0]['redmine']['filesize']
+
+        small_files = [i for i in to_upload if size(i) <= self.large_file_size]
+        large_files = sorted((i for i in to_upload if size(i) > self.large_file_size), key=size, reverse=True)
+        log.debug('{} small file(s) on {} worker(s), {} large file(s) on {} worker(s)'.format(
+            len(small_files), self.workers, len(large_files), self.large_file_workers))
+
+        uploaded_bytes = 0
+        try:
+            for digest, elapsed, error in run_lanes(lambda i: self._upload(by_digest[i][0]),
+                                                    [(large_files, self.large_file_workers),
+                                                     (small_files, self.workers)]):
+                same_data = by_digest[digest]
+                redmine_attachment = same_data[0]['redmine']
+                if error is not None:
+                    failed += same_data
+                    self.errors.update((i['redmine']['id'], str(error)) for i in same_data)
+                    # noinspection SpellCheckingInspection
+                    log.error('Could not create attachment {} {} (size: {}): {}'.format(
+                        redmine_attachment['id'], redmine_attachment['filename'], redmine_attachment['filesize'],
+                        error))
+                    continue
+
+                upload = same_data[0]['gitlab']
+                self.index.record(gitlab_id, digest, upload)
+                created += self._store(gitlab_id, upload, same_data)
+                uploaded_bytes += redmine_attachment['filesize']
+                log.info('[{}/{}] Created attachment (was: {}) {} ({} bytes in {:.1f}s{})'.format(
+                    len(created) + len(failed), total, redmine_attachment['id'], upload['markdown'],
+                    redmine_attachment['filesize'], elapsed,
+                    ', shared by {} attachments'.format(len(same_data)) if len(same_data) > 1 else ''))
+        finally:
+            self.index.save()
+
+        duration = max(time.time() - start, 0.001)
+        log.info('{} attachment(s) created, {:.1f} MB uploaded in {:.1f}s ({:.2f} MB/s, {:.1f} file(s)/s), '
+                 '{} failed'.format(len(created), uploaded_bytes / 1e6, duration, uploaded_bytes / 1e6 / duration,
+                                    len(created) / duration, len(failed)))
+        return created, failed
+
+    def upload_one(self, data):
+        """ Uploads a single attachment, unless its content is known, from any thread
+
+        Attachments sharing a content wait for the one being uploaded, so
+        that the content is uploaded once. Unlike :meth:`upload`, the index
+        is not saved, call ``index.save()`` once done.
+
+        :return: the gitlab upload, None if the attachment links to redmine (see ``link_above``)
+        """
+        if self.link_above is not None and data['redmine']['filesize'] > self.link_above:
+            return None
+        gitlab_id = self.gitlab.get_id()
+        digest = self._digest(data)
+        with self._lock:
+            content_lock = self._content_locks.setdefault(digest, threading.Lock())
+        with content_lock:
+            upload = self.index.get(gitlab_id, digest)
+            if upload is None:
+                self._upload(data)
+                upload = data['gitlab']
+                self.index.record(gitlab_id, digest, upload)
+        self._store(gitlab_id, upload, [data])
+        return data['gitlab']
+
+    def _store(self, gitlab_id, upload, attachments_data):
+        upload = dict(upload, project_id=gitlab_id)
+        for data in attachments_data:
+            redmine_attachment = data['redmine']
+            if upload['alt'] != os.path.splitext(redmine_attachment['filename'])[0]:
+                data['gitlab'] = reuse_upload(upload, redmine_attachment['filename'])
+            else:
+                data['gitlab'] = upload
+            redmine_attachment['gitlab'] = data['gitlab']
+            self.cache.load_attachment(redmine_attachment)
+        return attachments_data
+
+    def _digest(self, data):
+        return file_digest(attachment_data_path(self.cache_dir, data['redmine']))
+
+    def _upload(self, data):
+        start = time.time()
+        path = attachment_data_path(self.cache_dir, data['redmine'])
+        data['gitlab'] = self.gitlab.create_attachment(data, path=path)
+        return time.time() - start
@@ -0,0 +1,154 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+""" Resolution of gitlab users by username
+"""
+
+log = logging.getLogger(__name__)
+
+# Only these fields of gitlab users are kept in memory and on disk
+USER_FIELDS = ('id', 'username', 'name', 'state')
+
+
+def default_cache_path():
+    """ Default on-disk users cache, shared by all the projects migrated by the current user
+    """
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'migrate-redmine-to-gitlab', 'gitlab-users.json')
+
+
+class GitlabUserResolver:
+    """ Resolves gitlab users by username, querying only the ones asked for
+
+    Lookups go through an in-memory LRU, then an on-disk cache whose entries
+    expire after ``ttl`` seconds, and finally the ``/users?username=`` API.
+    Unknown usernames are only remembered in memory, so that a user created
+    after a failed check is found on next run.
+
+    The resolver can be used as a read-only mapping of users by username, as
+    expected by :func:`converters.redmine_uid_to_gitlab_uid`.
+
+    :param client: a :class:`GitlabClient`
+    :param instance_url: the gitlab API URL (ex: ``https://gitlab.com/api/v4``)
+    :param cache_path: on-disk cache file, or None to disable it
+    """
+    DEFAULT_TTL = 24 * 3600
+    LRU_SIZE = 4096
+    WORKERS = 8
+
+    def __init__(self, client, instance_url, cache_path=None, ttl=DEFAULT_TTL, workers=WORKERS, lru_size=LRU_SIZE):
+        self.api = client
+        self.instance_url = instance_url.rstrip('/')
+        self.cache_path = cache_path
+        self.ttl = ttl
+        self.workers = workers
+        self.lru_size = lru_size
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk = self._read_disk_cache()
+        self._dirty = False
+
+    def resolve(self, usernames):
+        """ Resolves many usernames, querying the unknown ones concurrently
+
+        :return: dict of found users by username
+        """
+        usernames = set(usernames)
+        missing = [i for i in usernames if self._lookup(i) is KeyError]
+        if missing:
+            log.info('Looking up {} user(s) on gitlab'.format(len(missing)))
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                for username, user in zip(missing, executor.map(self._fetch, missing)):
+                    self._remember(username, user)
+            self.save()
+        found = {}
+        for username in usernames:
+            user = self._lookup(username)
+            if user not in (None, KeyError):
+                found[username] = user
+        return found
+
+    def get(self, username, default=None):
+        user = self._lookup(username)
+        if user is KeyError:
+            user = self._fetch(username)
+            self._remember(username, user)
+        return default if user is None else user
+
+    def __getitem__(self, username):
+        user = self.get(username)
+        if user is None:
+            raise KeyError(username)
+        return user
+
+    def __contains__(self, username):
+        return self.get(username) is not None
+
+    def save(self):
+        """ Writes new entries to the on-disk cache, merged with entries written by other processes
+        """
+        if self.cache_path is None or not self._dirty:
+            return
+        data = self._read_disk_data()
+        with self._lock:
+            entries = data.setdefault(self.instance_url, {})
+            entries.update(self._disk)
+            self._dirty = False
+        os.makedirs(os.path.dirname(os.path.abspath(self.cache_path)), exist_ok=True)
+        tmp_path = '{}.{}.tmp'.format(self.cache_path, os.getpid())
+        with open(tmp_path, 'w') as outfile:
+            json.dump(data, outfile)
+        os.replace(tmp_path, self.cache_path)
+        log.debug('Saved {} user(s) to {}'.format(len(entries), self.cache_path))
+
+    def _lookup(self, username):
+        """ :return: the user, None if known as missing, or KeyError if unknown
+        """
+        with self._lock:
+            if username in self._lru:
+                self._lru.move_to_end(username)
+                return self._lru[username]
+            entry = self._disk.get(username)
+            if entry is not None and time.time() - entry['fetched_at'] < self.ttl:
+                self._put_lru(username, entry['user'])
+                return entry['user']
+        return KeyError
+
+    def _remember(self, username, user):
+        with self._lock:
+            self._put_lru(username, user)
+            if user is not None:
+                self._disk[username] = {'user': user, 'fetched_at': time.time()}
+                self._dirty = True
+
+    def _put_lru(self, username, user):
+        self._lru[username] = user
+        self._lru.move_to_end(username)
+        while len(self._lru) > self.lru_size:
+            self._lru.popitem(last=False)
+
+    def _fetch(self, username):
+        users = self.api.get('{}/users'.format(self.instance_url), params={'username': username})
+        for user in users:
+            # username lookups are case insensitive on gitlab
+            if user['username'].lower() == username.lower():
+                return {i: user.get(i) for i in USER_FIELDS}
+        return None
+
+    def _read_disk_cache(self):
+        return self._read_disk_data().get(self.instance_url, {})
+
+    def _read_disk_data(self):
+        if self.cache_path is None or not os.path.exists(self.cache_path):
+            return {}
+        try:
+            with open(self.cache_path, 'r') as infile:
+                return json.load(infile)
+        except ValueError:
+            log.warning('Ignoring invalid users cache {}'.format(self.cache_path))
+            return {}
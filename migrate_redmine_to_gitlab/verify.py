@@ -0,0 +1,154 @@
+import logging
+import os
+import time
+from collections import Counter
+
+from .cache import attachment_data_path, file_digest, list_json_files, load_json_file, map_shards
+from .redmine import ANONYMOUS_USER_ID
+
+""" Integrity verification of the redmine cache
+"""
+
+log = logging.getLogger(__name__)
+
+CACHE_KINDS = ('issues', 'users', 'versions', 'attachments')
+
+REQUIRED_FIELDS = {
+    'issues': ('subject', 'tracker', 'priority', 'author', 'created_on'),
+    'users': ('login',),
+    'versions': ('name', 'status', 'created_on'),
+    'attachments': ('filename', 'filesize', 'content_url'),
+}
+
+# Redmine < 4 stores a MD5 digest of attachments, later versions a SHA256 one.
+DIGEST_ALGORITHMS = {32: 'md5', 64: 'sha256'}
+
+
+def _error(error, message, kind, record_id, path):
+    return {'kind': kind, 'id': record_id, 'path': path, 'error': error, 'message': message}
+
+
+def _issue_refs(issue):
+    users = set()
+    for user in [issue.get('author'), issue.get('assigned_to')] + issue.get('watchers', []):
+        if user:
+            users.add(user['id'])
+    version = issue.get('fixed_version')
+    return {
+        'users': sorted(users - {ANONYMOUS_USER_ID}),
+        'attachments': [i['id'] for i in issue.get('attachments', [])],
+        'versions': [version['id']] if version else [],
+    }
+
+
+def _verify_attachment_data(cache_dir, attachment, path):
+    errors = []
+    data_path = attachment_data_path(cache_dir, attachment)
+    record_id = attachment['id']
+    if not os.path.exists(data_path):
+        return [_error('missing_data', 'no content file {}'.format(data_path), 'attachments', record_id, path)]
+
+    size = os.path.getsize(data_path)
+    if size != attachment['filesize']:
+        errors.append(_error('size_mismatch', 'expected {} bytes, got {}'.format(attachment['filesize'], size),
+                             'attachments', record_id, path))
+
+    digest = attachment.get('digest') or ''
+    algorithm = DIGEST_ALGORITHMS.get(len(digest))
+    if algorithm and not errors:
+        actual = file_digest(data_path, algorithm)
+        if actual != digest.lower():
+            errors.append(_error('digest_mismatch', 'expected {} {}, got {}'.format(algorithm, digest, actual),
+                                 'attachments', record_id, path))
+    return errors
+
+
+def _verify_record(cache_dir, kind, path):
+    stem = os.path.splitext(os.path.basename(path))[0]
+    result = {'kind': kind, 'id': stem, 'path': path, 'errors': [], 'refs': None}
+    try:
+        data = load_json_file(path)
+    except (OSError, ValueError) as e:
+        result['errors'].append(_error('invalid_json', str(e), kind, stem, path))
+        return result
+
+    if not isinstance(data, dict) or 'id' not in data:
+        result['errors'].append(_error('invalid_record', 'record has no id', kind, stem, path))
+        return result
+
+    result['id'] = data['id']
+    if str(data['id']) != stem:
+        result['errors'].append(_error('id_mismatch', 'record id is {}'.format(data['id']), kind, stem, path))
+
+    missing = [i for i in REQUIRED_FIELDS[kind] if i not in data]
+    if missing:
+        result['errors'].append(_error('missing_fields', ', '.join(missing), kind, data['id'], path))
+        return result
+
+    if kind == 'issues':
+        result['refs'] = _issue_refs(data)
+    elif kind == 'attachments':
+        result['errors'] += _verify_attachment_data(cache_dir, data, path)
+    return result
+
+
+def _verify_shard(items, cache_dir):
+    return [_verify_record(cache_dir, kind, path) for kind, path in items]
+
+
+def verify_cache(cache_dir, jobs=None):
+    """ Checks that a redmine cache is complete and uncorrupted
+
+    Every json record is decoded and validated, attachment content files are
+    checked against their ``filesize`` and ``digest``, and the users,
+    attachments and versions referenced by issues must be present in the
+    cache. Records are verified in parallel across a process pool.
+
+    :param cache_dir: the redmine cache directory
+    :param jobs: number of worker processes (default: number of CPUs)
+    :return: a json-serializable report dict, with a global ``ok`` flag
+    """
+    start = time.time()
+    errors = []
+
+    project_path = os.path.join(cache_dir, 'project.json')
+    try:
+        load_json_file(project_path)
+    except (OSError, ValueError) as e:
+        errors.append(_error('invalid_json', str(e), 'project', None, project_path))
+
+    items = []
+    for kind in CACHE_KINDS:
+        path = os.path.join(cache_dir, kind)
+        if not os.path.isdir(path):
+            errors.append(_error('missing_directory', 'no {} directory'.format(kind), kind, None, path))
+            continue
+        items += [(kind, i) for i in list_json_files(path)]
+
+    results = map_shards(_verify_shard, items, jobs, args=(cache_dir,))
+
+    ids = {kind: set() for kind in CACHE_KINDS}
+    for result in results:
+        errors += result['errors']
+        ids[result['kind']].add(result['id'])
+
+    for result in results:
+        if not result['refs']:
+            continue
+        for kind, referenced_ids in sorted(result['refs'].items()):
+            for referenced_id in referenced_ids:
+                if referenced_id not in ids[kind]:
+                    errors.append(_error('missing_{}'.format(kind[:-1]),
+                                         '{} {} is not in cache'.format(kind[:-1], referenced_id),
+                                         'issues', result['id'], result['path']))
+
+    counts = Counter(kind for kind, _ in items)
+    report = {
+        'cache_dir': cache_dir,
+        'ok': len(errors) == 0,
+        'duration': round(time.time() - start, 3),
+        'counts': {kind: counts[kind] for kind in CACHE_KINDS},
+        'errors': errors,
+    }
+    log.info('Verified {} record(s) in {}s, {} error(s)'.format(len(items), report['duration'], len(errors)))
+    return report
@@ -0,0 +1,143 @@
+import json
+import logging
+import os
+import time
+
+from .store import SQLiteStore
+
+""" Durable state of the items processed by the commands
+"""
+
+log = logging.getLogger(__name__)
+
+QUEUE_FILE = 'work.sqlite'
+
+# kinds of items
+MILESTONE = 'milestone'
+ATTACHMENT = 'attachment'
+ISSUE = 'issue'
+# links from redmine to what it became on gitlab
+VERSION_LINK = 'version-link'
+ISSUE_LINK = 'issue-link'
+
+PENDING = 'pending'
+IN_FLIGHT = 'in-flight'
+DONE = 'done'
+FAILED = 'failed'
+
+# number of tries of an item within a run of a command
+MAX_ATTEMPTS = 3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    kind TEXT NOT NULL,
+    id TEXT NOT NULL,
+    state TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    reason TEXT,
+    progress TEXT,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (kind, id)
+)
+"""
+
+
+class WorkQueue(SQLiteStore):
+    """ State of each item (milestone, attachment, issue...) of the migration, stored with the redmine cache
+
+    Every change is committed at once, so that a command killed at any time
+    and run again only processes the items that are not done, and resumes an
+    item from its last saved ``progress``. Items are identified by their
+    kind and redmine id. Safe to use from several threads.
+
+    :param cache_dir: the redmine cache directory
+    """
+
+    def __init__(self, cache_dir):
+        # noinspection PyCompatibility
+        super().__init__(os.path.join(cache_dir, QUEUE_FILE), SCHEMA)
+
+    def _set(self, kind, item_id, state, reason=None, attempt=False):
+        self._execute(
+            'INSERT INTO items (kind, id, state, attempts, reason, updated_at) VALUES (?, ?, ?, ?, ?, ?) '
+            'ON CONFLICT (kind, id) DO UPDATE SET state = excluded.state, attempts = attempts + ?, '
+            'reason = excluded.reason, updated_at = excluded.updated_at',
+            (kind, str(item_id), state, int(attempt), reason, time.time(), int(attempt)))
+
+    def get(self, kind, item_id):
+        """ Returns the state of an item, as a dict, or None if it was never queued
+        """
+        rows = self._execute('SELECT state, attempts, reason, progress FROM items WHERE kind = ? AND id = ?',
+                             (kind, str(item_id)))
+        if not rows:
+            return None
+        state, attempts, reason, progress = rows[0]
+        return {'state': state, 'attempts': attempts, 'reason': reason,
+                'progress': json.loads(progress) if progress else None}
+
+    def add(self, kind, item_ids):
+        """ Queues new items, keeping the state of the known ones
+        """
+        now = time.time()
+        with self._lock:
+            self._db.execute('BEGIN')
+            self._db.executemany(
+                'INSERT OR IGNORE INTO items (kind, id, state, updated_at) VALUES (?, ?, ?, ?)',
+                [(kind, str(i), PENDING, now) for i in item_ids])
+            self._db.execute('COMMIT')
+
+    def done_ids(self, kind):
+        """ Returns the set of the ids of the items done (as strings)
+        """
+        return set(i for i, in self._execute('SELECT id FROM items WHERE kind = ? AND state = ?', (kind, DONE)))
+
+    def is_done(self, kind, item_id):
+        state = self.get(kind, item_id)
+        return state is not None and state['state'] == DONE
+
+    def start(self, kind, item_id):
+        self._set(kind, item_id, IN_FLIGHT, attempt=True)
+
+    def done(self, kind, item_id):
+        self._set(kind, item_id, DONE)
+
+    def fail(self, kind, item_id, reason):
+        self._set(kind, item_id, FAILED, reason=str(reason))
+
+    def save_progress(self, kind, item_id, progress):
+        """ Saves how far the processing of an item went (any json-serializable value)
+        """
+        self._execute('UPDATE items SET progress = ?, updated_at = ? WHERE kind = ? AND id = ?',
+                      (json.dumps(progress), time.time(), kind, str(item_id)))
+
+    def forget(self, kind, item_id):
+        """ Removes an item, as if it was never queued (ex: once its gitlab object is deleted)
+        """
+        self._execute('DELETE FROM items WHERE kind = ? AND id = ?', (kind, str(item_id)))
+
+    def failures(self, kind, item_ids=None):
+        """ Returns the failed items, as triples: id, number of attempts, reason of the last failure
+
+        :param item_ids: only return these items (default: all the failed items)
+        """
+        rows = self._execute('SELECT id, attempts, reason FROM items WHERE kind = ? AND state = ? ORDER BY id',
+                             (kind, FAILED))
+        if item_ids is not None:
+            item_ids = set(str(i) for i in item_ids)
+            rows = [i for i in rows if i[0] in item_ids]
+        return rows
+
+    def counts(self, kind):
+        """ Returns the number of items of a kind, by state
+        """
+        return dict(self._execute('SELECT state, COUNT(*) FROM items WHERE kind = ? GROUP BY state', (kind,)))
+
+    def log_failures(self, kind, item_ids=None):
+        """ Logs the items of a kind that are failed, returns their number
+        """
+        failures = self.failures(kind, item_ids)
+        for item_id, attempts, reason in failures:
+            log.error('{} {} failed after {} attempt(s): {}'.format(kind, item_id, attempts, reason))
+        if failures:
+            log.error('{} {}(s) failed, run the command again to retry them'.format(len(failures), kind))
+        return len(failures)
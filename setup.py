@@ -20,7 +20,8 @@ setup(
     license='GPL',
     url='https://github/ultreia-io/migrate-redmine-to-gitlab',
     packages=['migrate_redmine_to_gitlab'],
-    install_requires=['requests'],
+    python_requires='>=3.7',
+    install_requires=['requests', 'urllib3'],
     entry_points={
         'console_scripts': [
             'migrate-redmine-to-gitlab = migrate_redmine_to_gitlab.commands:main'